@@ -1,21 +1,38 @@
 import os
+import sqlite3
 import jinja2
-import pandas as pd
 import json
 import gc
+import gzip
+import zlib
 import re
+import csv
+import base64
 import zipfile
 import random
 import math
+import sys
+import time
+import subprocess
+import cProfile
+import hashlib
+import itertools
+import threading
 import requests
 import urllib.parse
+import click
+try: import resource
+except ImportError: resource = None
 from io import BytesIO, StringIO
-from datetime import datetime, timedelta
-from flask import Flask, render_template, request, redirect, url_for, flash, send_file, Response, stream_with_context, jsonify
+from datetime import datetime, date, timedelta
+from functools import wraps
+from flask import Flask, render_template, stream_template, get_flashed_messages, request, redirect, url_for, flash, send_file, Response, stream_with_context, jsonify, g, has_app_context, session, make_response
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FlaskSQLAlchemySession
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy import text, func, inspect, or_, and_
+from sqlalchemy import text, func, inspect, or_, and_, select, false, event, literal, case, Select
+from sqlalchemy.engine import Engine
 from itertools import zip_longest
 from collections import defaultdict
 
@@ -28,15 +45,297 @@ app.secret_key = os.environ.get('SECRET_KEY', 'bi_mat_khong_the_bat_mi')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///local.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_recycle': 280, 'pool_pre_ping': True}
+# Kích thước pool cấu hình qua biến môi trường (DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT)
+for env_key, opt_key in [('DB_POOL_SIZE', 'pool_size'), ('DB_MAX_OVERFLOW', 'max_overflow'), ('DB_POOL_TIMEOUT', 'pool_timeout')]:
+    if os.environ.get(env_key): app.config['SQLALCHEMY_ENGINE_OPTIONS'][opt_key] = int(os.environ[env_key])
+# Bind chỉ đọc (read replica) cho các trang báo cáo nặng và bot; import/sửa dữ liệu luôn ghi vào DB chính
+if os.environ.get('DATABASE_READ_URL'): app.config['SQLALCHEMY_BINDS'] = {'read': os.environ['DATABASE_READ_URL']}
 app.config['MAX_CONTENT_LENGTH'] = 64 * 1024 * 1024
 
 TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', '')
-
-db = SQLAlchemy(app)
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 15000))
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_conn, conn_record):
+    # WAL: người đọc không bị chặn bởi transaction import đang ghi; busy_timeout: chờ khóa thay vì lỗi "database is locked"
+    if not isinstance(dbapi_conn, sqlite3.Connection): return
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.close()
+
+class RoutingSession(FlaskSQLAlchemySession):
+    # Câu SELECT trong route/lệnh bot đã bật use_read_replica() đi sang bind 'read'; mọi lệnh ghi (và các
+    # lệnh đọc sau đó trong cùng request, để đọc được dữ liệu vừa ghi) đi vào DB chính
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context() and g.get('db_read_replica'):
+            if self._flushing or not isinstance(clause, Select): g.db_read_replica = False
+            elif 'read' in self._db.engines: return self._db.engines['read']
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def use_read_replica():
+    g.db_read_replica = True
+
+def read_replica(f):
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        use_read_replica()
+        return f(*args, **kwargs)
+    return wrapper
+
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
+# ==============================================================================
+# 1b. METRICS (PROMETHEUS TEXT FORMAT)
+# ==============================================================================
+
+METRICS_PREFIX = 'kpi_monitor_'
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SQL_OPS = {'SELECT', 'INSERT', 'UPDATE', 'DELETE'}
+BOT_COMMANDS = {'HELP', 'DASHBOARD', 'KPI', 'CHARTKPI', 'RF', 'PCI', 'CTS', 'CHARTCTS'}
+
+class Metrics:
+    # Bộ đếm trong bộ nhớ của từng worker (mỗi tiến trình gunicorn có số liệu riêng), xuất ra /metrics
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta = {}
+        self._values = {}
+
+    def describe(self, name, kind, help_text, buckets=None):
+        self._meta[name] = (kind, help_text, buckets)
+
+    def _key(self, name, labels):
+        return (name, tuple(sorted((labels or {}).items())))
+
+    def inc(self, name, labels=None, value=1):
+        key = self._key(name, labels)
+        with self._lock: self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, name, labels=None, value=0):
+        key = self._key(name, labels)
+        with self._lock: self._values[key] = value
+
+    def observe(self, name, labels, value):
+        key, buckets = self._key(name, labels), self._meta[name][2]
+        with self._lock:
+            h = self._values.get(key)
+            if h is None: h = self._values[key] = [[0] * len(buckets), 0.0, 0]
+            for i, b in enumerate(buckets):
+                if value <= b: h[0][i] += 1
+            h[1] += value; h[2] += 1
+
+    def render(self):
+        def fmt_labels(pairs):
+            if not pairs: return ''
+            esc = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            return '{' + ','.join(f'{k}="{esc(v)}"' for k, v in pairs) + '}'
+        with self._lock: snapshot = sorted((k, [list(v[0]), v[1], v[2]] if isinstance(v, list) else v) for k, v in self._values.items())
+        lines = []
+        for name, (kind, help_text, buckets) in self._meta.items():
+            full = METRICS_PREFIX + name
+            lines += [f'# HELP {full} {help_text}', f'# TYPE {full} {kind}']
+            for (n, labels), v in snapshot:
+                if n != name: continue
+                if kind != 'histogram':
+                    lines.append(f'{full}{fmt_labels(labels)} {v}')
+                    continue
+                counts, total, count = v
+                for b, c in zip(buckets, counts): lines.append(f'{full}_bucket{fmt_labels(labels + (("le", repr(float(b))),))} {c}')
+                lines.append(f'{full}_bucket{fmt_labels(labels + (("le", "+Inf"),))} {count}')
+                lines.append(f'{full}_sum{fmt_labels(labels)} {total}')
+                lines.append(f'{full}_count{fmt_labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+metrics.describe('http_request_duration_seconds', 'histogram', 'Thời gian xử lý request theo endpoint (tính cả phần stream).', LATENCY_BUCKETS)
+metrics.describe('sql_statements_total', 'counter', 'Số câu SQL đã thực thi theo endpoint và loại lệnh.')
+metrics.describe('sql_duration_seconds_total', 'counter', 'Tổng thời gian thực thi SQL theo endpoint và loại lệnh.')
+metrics.describe('sql_rows_total', 'counter', 'Số dòng trả về/bị ảnh hưởng theo cursor.rowcount (SQLite không báo số dòng của SELECT).')
+metrics.describe('request_peak_rss_growth_bytes_total', 'counter', 'Mức tăng RSS đỉnh của tiến trình xảy ra trong các request của endpoint.')
+metrics.describe('process_resident_memory_bytes', 'gauge', 'RSS hiện tại của worker.')
+metrics.describe('process_peak_resident_memory_bytes', 'gauge', 'RSS đỉnh của worker từ khi khởi động.')
+metrics.describe('import_rows_total', 'counter', 'Số dòng đã import theo loại dữ liệu.')
+metrics.describe('import_bytes_total', 'counter', 'Dung lượng file đã import theo loại dữ liệu.')
+metrics.describe('import_file_duration_seconds', 'histogram', 'Thời gian import một file theo loại dữ liệu.', LATENCY_BUCKETS)
+metrics.describe('import_last_rows_per_second', 'gauge', 'Tốc độ import (dòng/giây) của file gần nhất theo loại dữ liệu.')
+metrics.describe('bot_command_duration_seconds', 'histogram', 'Thời gian xử lý lệnh bot Telegram theo lệnh.', LATENCY_BUCKETS)
+
+def peak_rss_bytes():
+    if resource is None: return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def current_rss_bytes():
+    try:
+        with open('/proc/self/statm') as f: return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError): return None
+
+def record_import(itype, rows, nbytes, seconds):
+    labels = {'type': itype}
+    metrics.inc('import_rows_total', labels, rows)
+    metrics.inc('import_bytes_total', labels, nbytes)
+    metrics.observe('import_file_duration_seconds', labels, seconds)
+    if seconds > 0: metrics.set('import_last_rows_per_second', labels, round(rows / seconds, 1))
+
+def track_bot_latency(f):
+    @wraps(f)
+    def wrapper(text, *args, **kwargs):
+        parts = str(text).strip().upper().split()
+        command = parts[0] if parts and parts[0] in BOT_COMMANDS else 'OTHER'
+        t0 = time.perf_counter()
+        try: return f(text, *args, **kwargs)
+        finally: metrics.observe('bot_command_duration_seconds', {'command': command}, time.perf_counter() - t0)
+    return wrapper
+
+@app.before_request
+def metrics_start_request():
+    g.metrics_t0 = time.perf_counter()
+    g.metrics_endpoint = request.endpoint or 'unmatched'
+    g.metrics_peak0 = peak_rss_bytes()
+
+@app.after_request
+def metrics_finish_request(response):
+    t0 = g.get('metrics_t0')
+    if t0 is None: return response
+    labels = {'endpoint': g.metrics_endpoint, 'method': request.method, 'status': str(response.status_code)}
+    peak0 = g.metrics_peak0
+    # Ghi nhận khi response đóng để các trang stream (export CSV) được đo đủ thời gian
+    def record():
+        metrics.observe('http_request_duration_seconds', labels, time.perf_counter() - t0)
+        growth = peak_rss_bytes() - peak0
+        if growth > 0: metrics.inc('request_peak_rss_growth_bytes_total', {'endpoint': labels['endpoint']}, growth)
+    if response.is_streamed: response.call_on_close(record)
+    else: record()
+    return response
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def metrics_before_cursor(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def metrics_after_cursor(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['metrics_query_start'].pop()
+    op = statement.lstrip()[:6].upper()
+    labels = {'endpoint': (g.get('metrics_endpoint') or 'other') if has_app_context() else 'other', 'op': op if op in SQL_OPS else 'OTHER'}
+    metrics.inc('sql_statements_total', labels)
+    metrics.inc('sql_duration_seconds_total', labels, elapsed)
+    if cursor.rowcount is not None and cursor.rowcount >= 0: metrics.inc('sql_rows_total', labels, cursor.rowcount)
+
+@event.listens_for(Engine, 'handle_error')
+def metrics_cursor_error(exception_context):
+    conn = exception_context.connection
+    if conn is not None and conn.info.get('metrics_query_start'): conn.info['metrics_query_start'].pop()
+
+@app.route('/metrics')
+def metrics_endpoint():
+    if METRICS_TOKEN:
+        if request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}' and request.args.get('token') != METRICS_TOKEN: return "Unauthorized", 401
+    # Không cấu hình token: chỉ cho scrape từ localhost hoặc user đã đăng nhập
+    elif request.remote_addr not in ('127.0.0.1', '::1') and not current_user.is_authenticated: return "Unauthorized", 401
+    rss = current_rss_bytes()
+    if rss is not None: metrics.set('process_resident_memory_bytes', None, rss)
+    metrics.set('process_peak_resident_memory_bytes', None, peak_rss_bytes())
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# ==============================================================================
+# 1c. ON-DEMAND PROFILING (ADMIN)
+# ==============================================================================
+
+# Bật cho một request: admin thêm ?_profile=stacks|pstats (hoặc header X-Profile). Lấy mẫu định kỳ: cứ N request
+# thì profile một lần (PROFILE_EVERY_N, sửa được trên trang /admin/profiles, lưu riêng trong từng worker).
+PROFILE_DIR = os.environ.get('PROFILE_DIR') or os.path.join(app.instance_path, 'profiles')
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 50))
+PROFILE_MODES = ('stacks', 'pstats')
+PROFILE_FILE_RE = re.compile(r'^(\d{8}-\d{6})_([\w.]+)_(\d+)ms_(\d+)\.(collapsed|prof)$')
+PROFILE_SKIP_ENDPOINTS = {'static', 'metrics_endpoint', 'admin_profiles', 'admin_profile_download'}
+profiling = {'every_n': int(os.environ.get('PROFILE_EVERY_N', 0)), 'mode': os.environ.get('PROFILE_MODE', 'stacks')}
+profile_counter = itertools.count(1)
+
+class StackSampler:
+    # Lấy mẫu stack của thread đang xử lý request, gộp thành dạng collapsed stacks (flamegraph.pl, speedscope)
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id, self.interval = thread_id, interval
+        self.counts = defaultdict(int)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self): self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack: self.counts[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        return ''.join(f"{stack} {n}\n" for stack, n in sorted(self.counts.items()))
+
+def list_profiles():
+    if not os.path.isdir(PROFILE_DIR): return []
+    items = []
+    for name in os.listdir(PROFILE_DIR):
+        m = PROFILE_FILE_RE.match(name)
+        if not m: continue
+        items.append({'name': name, 'time': datetime.strptime(m.group(1), '%Y%m%d-%H%M%S'), 'endpoint': m.group(2), 'ms': int(m.group(3)),
+                      'pid': m.group(4), 'mode': 'stacks' if m.group(5) == 'collapsed' else 'pstats', 'size': os.path.getsize(os.path.join(PROFILE_DIR, name))})
+    return sorted(items, key=lambda x: x['name'], reverse=True)
+
+def save_profile(mode, profiler, endpoint, elapsed):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    name = f"{datetime.now():%Y%m%d-%H%M%S}_{endpoint}_{int(elapsed * 1000)}ms_{os.getpid()}.{'collapsed' if mode == 'stacks' else 'prof'}"
+    path = os.path.join(PROFILE_DIR, name)
+    if mode == 'stacks':
+        with open(path, 'w', encoding='utf-8') as f: f.write(profiler.collapsed())
+    else: profiler.dump_stats(path)
+    for old in list_profiles()[PROFILE_KEEP:]:
+        try: os.remove(os.path.join(PROFILE_DIR, old['name']))
+        except OSError: pass
+
+@app.before_request
+def profiling_start_request():
+    mode = request.args.get('_profile') or request.headers.get('X-Profile')
+    if mode:
+        if not (current_user.is_authenticated and current_user.role == 'admin'): return
+        mode = mode if mode in PROFILE_MODES else 'stacks'
+    elif profiling['every_n'] and next(profile_counter) % profiling['every_n'] == 0: mode = profiling['mode']
+    else: return
+    if request.endpoint in PROFILE_SKIP_ENDPOINTS: return
+    if mode == 'pstats':
+        profiler = cProfile.Profile()
+        profiler.enable()
+    else:
+        profiler = StackSampler(threading.get_ident())
+        profiler.start()
+    g.profiler = (mode, profiler, time.perf_counter())
+
+@app.after_request
+def profiling_finish_request(response):
+    active = g.pop('profiler', None)
+    if active is None: return response
+    mode, profiler, t0 = active
+    endpoint = request.endpoint or 'unmatched'
+    def finish():
+        if mode == 'pstats': profiler.disable()
+        else: profiler.stop()
+        try: save_profile(mode, profiler, endpoint, time.perf_counter() - t0)
+        except OSError as e: print("Không lưu được profile:", e)
+    if response.is_streamed: response.call_on_close(finish)
+    else: finish()
+    return response
+
 # ==============================================================================
 # 2. UTILS & ROBUST HEADER MAPPING
 # ==============================================================================
@@ -108,10 +407,121 @@ def clean_header(col_name):
     clean_fb = re.sub(r'_+', '_', clean_fb).strip('_')
     return clean_fb
 
+def json_array_rows(df):
+    # Tuần tự hóa mỗi dòng thành mảng JSON theo cột: mỗi giá trị khác nhau chỉ json.dumps một lần, NULL -> null
+    import pandas as pd, numpy as np
+    out = pd.Series('[', index=df.index, dtype=object)
+    for n, col in enumerate(df.columns):
+        codes, uniques = pd.factorize(df[col], use_na_sentinel=True)
+        uniq = pd.Series(uniques, dtype=object).astype(str)
+        tokens = '"' + uniq + '"'
+        needs_escape = uniq.str.contains(r'["\\\x00-\x1f]', regex=True)
+        if needs_escape.any(): tokens[needs_escape] = uniq[needs_escape].map(lambda v: json.dumps(v, ensure_ascii=False))
+        tokens = np.append(tokens.to_numpy(dtype=object), 'null')
+        out = out + ('' if n == 0 else ',') + tokens[codes]
+    return (out + ']').tolist()
+
+def encode_cursor(val, row_id):
+    return base64.urlsafe_b64encode(json.dumps([val, row_id]).encode('utf-8')).decode('ascii')
+
+def decode_cursor(token):
+    try:
+        val, row_id = json.loads(base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8'))
+        return val, int(row_id)
+    except Exception: return None
+
+def keyset_page(query, Model, sort_key='id', order='asc', cursor=None, limit=100):
+    # Phân trang keyset theo (cột sắp xếp, id): không dùng OFFSET nên trang sau cũng rẻ như trang đầu.
+    # Giá trị NULL của cột sắp xếp luôn nằm cuối danh sách.
+    col, pk = getattr(Model, sort_key), Model.id
+    desc = order == 'desc'
+    pos = decode_cursor(cursor) if cursor else None
+    if pos:
+        val, last_id = pos
+        if sort_key == 'id': query = query.filter(pk < last_id if desc else pk > last_id)
+        elif val is None: query = query.filter(col.is_(None), pk < last_id if desc else pk > last_id)
+        elif desc: query = query.filter(or_(col < val, and_(col == val, pk < last_id), col.is_(None)))
+        else: query = query.filter(or_(col > val, and_(col == val, pk > last_id), col.is_(None)))
+    if sort_key == 'id': query = query.order_by(pk.desc() if desc else pk.asc())
+    else: query = query.order_by(col.is_(None), col.desc() if desc else col.asc(), pk.desc() if desc else pk.asc())
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(getattr(rows[-1], sort_key), rows[-1].id)
+    return rows, next_cursor
+
 def generate_colors(n):
+    # Cố định seed để một cell giữ cùng màu trên mọi biểu đồ (các biểu đồ được tải bằng các request riêng)
     base = ['#0078d4', '#107c10', '#d13438', '#ffaa44', '#00bcf2', '#5c2d91', '#e3008c', '#b4009e']
     if n <= len(base): return base[:n]
-    return base + ["#"+''.join([random.choice('0123456789ABCDEF') for j in range(6)]) for i in range(n - len(base))]
+    rng = random.Random(n)
+    return base + ["#"+''.join([rng.choice('0123456789ABCDEF') for j in range(6)]) for i in range(n - len(base))]
+
+def normalize_cell_key(value):
+    if value is None: return None
+    key = str(value).strip().upper()
+    return key if key and key not in ('NAN', 'NONE', 'NULL') else None
+
+def round_series(values, ndigits=2):
+    return [None if v is None else round(v, ndigits) for v in values]
+
+GZIP_MIN_SIZE = int(os.environ.get('GZIP_MIN_SIZE', 1024))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 6))
+GZIP_MIMETYPES = {'text/html', 'application/json', 'text/csv'}
+STREAM_CHUNK_SIZE = 16 * 1024
+
+def buffered_chunks(chunks, size=STREAM_CHUNK_SIZE):
+    # Gom các mảnh nhỏ của template stream thành khối ~16KB trước khi gửi/nén
+    buf, n = [], 0
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str): chunk = chunk.encode('utf-8')
+            buf.append(chunk); n += len(chunk)
+            if n >= size:
+                yield b''.join(buf)
+                buf, n = [], 0
+        if buf: yield b''.join(buf)
+    finally:
+        if hasattr(chunks, 'close'): chunks.close()
+
+def gzip_chunks(chunks):
+    # Z_SYNC_FLUSH sau mỗi khối để trình duyệt giải nén và hiển thị dần phần đầu trang
+    z = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    source = buffered_chunks(chunks)
+    try:
+        for chunk in source:
+            data = z.compress(chunk) + z.flush(zlib.Z_SYNC_FLUSH)
+            if data: yield data
+        yield z.flush()
+    finally: source.close()
+
+def compress_response(response):
+    # Nén gzip HTML/JSON/CSV khi trình duyệt hỗ trợ và nội dung đủ lớn (response stream luôn được nén)
+    if response.status_code != 200 or response.direct_passthrough or 'Content-Encoding' in response.headers or response.mimetype not in GZIP_MIMETYPES: return response
+    response.vary.add('Accept-Encoding')
+    if 'gzip' not in request.headers.get('Accept-Encoding', '').lower():
+        if response.is_streamed: response.response = buffered_chunks(response.response)
+        return response
+    if response.is_streamed:
+        response.response = gzip_chunks(response.response)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < GZIP_MIN_SIZE: return response
+        response.set_data(gzip.compress(data, compresslevel=GZIP_LEVEL))
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+@app.after_request
+def compress_after_request(response):
+    return compress_response(response)
+
+def stream_page(template_name, **context):
+    # Render trang nặng theo kiểu stream: phần <head> (Leaflet, Chart.js) tới trình duyệt trước khi các khối dữ liệu lớn được sinh xong.
+    # Lấy flash trước khi gửi header để session kịp lưu việc xóa flash.
+    get_flashed_messages(with_categories=True)
+    return Response(stream_template(template_name, **context), mimetype='text/html')
 
 # ==============================================================================
 # 3. MODELS
@@ -128,6 +538,7 @@ class RF3G(db.Model):
     csht_cell = db.Column(db.String(100))
     cell_name = db.Column(db.String(255))
     cell_code = db.Column(db.String(100), index=True)
+    cell_key = db.Column(db.String(255), index=True)
     site_code = db.Column(db.String(100))
     latitude = db.Column(db.Float)
     longitude = db.Column(db.Float)
@@ -150,25 +561,88 @@ class RF3G(db.Model):
     extra_data = db.Column(db.Text)
 
 class RF4G(db.Model):
-    __tablename__='rf_4g'; id=db.Column(db.Integer, primary_key=True); cell_code=db.Column(db.String(100), index=True); site_code=db.Column(db.String(100)); cell_name=db.Column(db.String(255)); csht_code=db.Column(db.String(100)); latitude=db.Column(db.Float); longitude=db.Column(db.Float); antena=db.Column(db.Text); azimuth=db.Column(db.Integer); total_tilt=db.Column(db.Float); equipment=db.Column(db.String(100)); frequency=db.Column(db.String(50)); dl_uarfcn=db.Column(db.String(50)); pci=db.Column(db.String(50)); tac=db.Column(db.String(50)); enodeb_id=db.Column(db.String(50)); lcrid=db.Column(db.String(50)); anten_height=db.Column(db.Float); m_t=db.Column(db.Float); e_t=db.Column(db.Float); mimo=db.Column(db.String(50)); hang_sx=db.Column(db.String(100)); swap=db.Column(db.String(50)); start_day=db.Column(db.String(100)); ghi_chu=db.Column(db.Text)
+    __tablename__='rf_4g'; id=db.Column(db.Integer, primary_key=True); cell_code=db.Column(db.String(100), index=True); cell_key=db.Column(db.String(255), index=True); site_code=db.Column(db.String(100)); cell_name=db.Column(db.String(255)); csht_code=db.Column(db.String(100)); latitude=db.Column(db.Float); longitude=db.Column(db.Float); antena=db.Column(db.Text); azimuth=db.Column(db.Integer); total_tilt=db.Column(db.Float); equipment=db.Column(db.String(100)); frequency=db.Column(db.String(50)); dl_uarfcn=db.Column(db.String(50)); pci=db.Column(db.String(50)); tac=db.Column(db.String(50)); enodeb_id=db.Column(db.String(50)); lcrid=db.Column(db.String(50)); anten_height=db.Column(db.Float); m_t=db.Column(db.Float); e_t=db.Column(db.Float); mimo=db.Column(db.String(50)); hang_sx=db.Column(db.String(100)); swap=db.Column(db.String(50)); start_day=db.Column(db.String(100)); ghi_chu=db.Column(db.Text)
 
 class RF5G(db.Model):
-    __tablename__='rf_5g'; id=db.Column(db.Integer, primary_key=True); cell_code=db.Column(db.String(50), index=True); site_code=db.Column(db.String(50)); site_name=db.Column(db.String(255)); csht_code=db.Column(db.String(100)); latitude=db.Column(db.Float); longitude=db.Column(db.Float); antena=db.Column(db.Text); azimuth=db.Column(db.Integer); total_tilt=db.Column(db.Float); equipment=db.Column(db.String(100)); frequency=db.Column(db.String(50)); nrarfcn=db.Column(db.String(50)); pci=db.Column(db.String(50)); tac=db.Column(db.String(50)); gnodeb_id=db.Column(db.String(50)); lcrid=db.Column(db.String(50)); anten_height=db.Column(db.Float); m_t=db.Column(db.Float); e_t=db.Column(db.Float); mimo=db.Column(db.String(50)); hang_sx=db.Column(db.String(100)); dong_bo=db.Column(db.String(50)); start_day=db.Column(db.String(100)); ghi_chu=db.Column(db.Text)
-
-class POI4G(db.Model): __tablename__='poi_4g'; id=db.Column(db.Integer, primary_key=True); cell_code=db.Column(db.String(100)); site_code=db.Column(db.String(100)); poi_name=db.Column(db.String(255), index=True)
-class POI5G(db.Model): __tablename__='poi_5g'; id=db.Column(db.Integer, primary_key=True); cell_code=db.Column(db.String(100)); site_code=db.Column(db.String(100)); poi_name=db.Column(db.String(255), index=True)
-class QoE4G(db.Model): __tablename__='qoe_4g'; id=db.Column(db.Integer, primary_key=True); cell_name=db.Column(db.String(255), index=True); week_name=db.Column(db.String(100)); qoe_score=db.Column(db.Float); qoe_percent=db.Column(db.Float); details=db.Column(db.Text)
-class QoS4G(db.Model): __tablename__='qos_4g'; id=db.Column(db.Integer, primary_key=True); cell_name=db.Column(db.String(255), index=True); week_name=db.Column(db.String(100)); qos_score=db.Column(db.Float); qos_percent=db.Column(db.Float); details=db.Column(db.Text)
+    __tablename__='rf_5g'; id=db.Column(db.Integer, primary_key=True); cell_code=db.Column(db.String(50), index=True); cell_key=db.Column(db.String(255), index=True); site_code=db.Column(db.String(50)); site_name=db.Column(db.String(255)); csht_code=db.Column(db.String(100)); latitude=db.Column(db.Float); longitude=db.Column(db.Float); antena=db.Column(db.Text); azimuth=db.Column(db.Integer); total_tilt=db.Column(db.Float); equipment=db.Column(db.String(100)); frequency=db.Column(db.String(50)); nrarfcn=db.Column(db.String(50)); pci=db.Column(db.String(50)); tac=db.Column(db.String(50)); gnodeb_id=db.Column(db.String(50)); lcrid=db.Column(db.String(50)); anten_height=db.Column(db.Float); m_t=db.Column(db.Float); e_t=db.Column(db.Float); mimo=db.Column(db.String(50)); hang_sx=db.Column(db.String(100)); dong_bo=db.Column(db.String(50)); start_day=db.Column(db.String(100)); ghi_chu=db.Column(db.Text)
+
+class POI4G(db.Model): __tablename__='poi_4g'; id=db.Column(db.Integer, primary_key=True); cell_code=db.Column(db.String(100)); cell_key=db.Column(db.String(255), index=True); site_code=db.Column(db.String(100)); poi_name=db.Column(db.String(255), index=True)
+class POI5G(db.Model): __tablename__='poi_5g'; id=db.Column(db.Integer, primary_key=True); cell_code=db.Column(db.String(100)); cell_key=db.Column(db.String(255), index=True); site_code=db.Column(db.String(100)); poi_name=db.Column(db.String(255), index=True)
+class QoE4G(db.Model): __tablename__='qoe_4g'; id=db.Column(db.Integer, primary_key=True); cell_name=db.Column(db.String(255), index=True); cell_key=db.Column(db.String(255), index=True); week_name=db.Column(db.String(100)); qoe_score=db.Column(db.Float); qoe_percent=db.Column(db.Float); details=db.Column(db.Text); schema_id=db.Column(db.Integer, index=True); detail_values=db.Column(db.Text)
+class QoS4G(db.Model): __tablename__='qos_4g'; id=db.Column(db.Integer, primary_key=True); cell_name=db.Column(db.String(255), index=True); cell_key=db.Column(db.String(255), index=True); week_name=db.Column(db.String(100)); qos_score=db.Column(db.Float); qos_percent=db.Column(db.Float); details=db.Column(db.Text); schema_id=db.Column(db.Integer, index=True); detail_values=db.Column(db.Text)
+# Header của file QoE/QoS lưu một lần cho mỗi tuần; từng dòng chỉ giữ mảng giá trị (detail_values) theo đúng thứ tự header
+class QoEQoSSchema(db.Model): __tablename__='qoe_qos_schema'; id=db.Column(db.Integer, primary_key=True); kind=db.Column(db.String(10)); week_name=db.Column(db.String(100), index=True); headers=db.Column(db.Text)
+# Ngưỡng chẩn đoán NPO (sửa được trên trang Tối ưu) và kết quả chẩn đoán đã tính sẵn theo tuần
+class NPOConfig(db.Model): __tablename__='npo_config'; id=db.Column(db.Integer, primary_key=True); key=db.Column(db.String(50), unique=True, nullable=False); value=db.Column(db.Float)
+class NPOWeek(db.Model): __tablename__='npo_week'; id=db.Column(db.Integer, primary_key=True); week_name=db.Column(db.String(100), unique=True, nullable=False); computed_at=db.Column(db.DateTime, default=datetime.utcnow)
+class NPODiagnosis(db.Model): __tablename__='npo_diagnosis'; id=db.Column(db.Integer, primary_key=True); week_name=db.Column(db.String(100), index=True); cell_name=db.Column(db.String(255)); qoe_score=db.Column(db.Float); qoe_percent=db.Column(db.Float); qos_score=db.Column(db.Float); qos_percent=db.Column(db.Float); prb=db.Column(db.Float); thput=db.Column(db.Float); cqi=db.Column(db.Float); drop=db.Column(db.Float); issues=db.Column(db.Text); actions=db.Column(db.Text)
+# Kết quả phân tích hình học RF (overshoot/đối đầu/chồng lấn) tính sẵn cho từng công nghệ, gắn với version bảng RF lúc tính
+class RFAnalysis(db.Model): __tablename__='rf_analysis'; id=db.Column(db.Integer, primary_key=True); tech=db.Column(db.String(10), unique=True, nullable=False); rf_version=db.Column(db.Integer); sectors=db.Column(db.Integer); pairs=db.Column(db.Integer); computed_at=db.Column(db.DateTime, default=datetime.utcnow)
+class RFSectorIssue(db.Model): __tablename__='rf_sector_issue'; id=db.Column(db.Integer, primary_key=True); tech=db.Column(db.String(10), index=True); issue=db.Column(db.String(20)); cell_code=db.Column(db.String(100)); cell_key=db.Column(db.String(255), index=True); site_code=db.Column(db.String(100)); other_cell=db.Column(db.String(100)); other_key=db.Column(db.String(255), index=True); distance=db.Column(db.Float); reach=db.Column(db.Float); detail=db.Column(db.Text)
+# Xung đột PCI (trùng PCI / trùng mod 3 / mod 30) trên cùng lớp tần số của RF 4G/5G; sửa/thêm RF chỉ tính lại các cặp của cell đó
+class PCICheck(db.Model): __tablename__='pci_check'; id=db.Column(db.Integer, primary_key=True); tech=db.Column(db.String(10), unique=True, nullable=False); rf_version=db.Column(db.Integer); computed_at=db.Column(db.DateTime, default=datetime.utcnow)
+class PCIConflict(db.Model): __tablename__='pci_conflict'; id=db.Column(db.Integer, primary_key=True); tech=db.Column(db.String(10), index=True); kind=db.Column(db.String(20)); layer=db.Column(db.String(50)); cell_code=db.Column(db.String(100)); cell_key=db.Column(db.String(255), index=True); site_code=db.Column(db.String(100)); pci=db.Column(db.Integer); other_cell=db.Column(db.String(100)); other_key=db.Column(db.String(255), index=True); other_site=db.Column(db.String(100)); other_pci=db.Column(db.Integer); distance=db.Column(db.Float)
+# Mỗi file RF/KPI/POI đã import: hash nội dung, loại, khoảng ngày KPI thực tế và số dòng (upload lại file y hệt thì bỏ qua)
+class ImportManifest(db.Model): __tablename__='import_manifest'; id=db.Column(db.Integer, primary_key=True); content_hash=db.Column(db.String(64), index=True, nullable=False); import_type=db.Column(db.String(20), nullable=False); filename=db.Column(db.String(255)); day_from=db.Column(db.Date); day_to=db.Column(db.Date); rows=db.Column(db.Integer); size=db.Column(db.Integer); imported_at=db.Column(db.DateTime, default=datetime.now)
+# Version dữ liệu theo bảng, tăng mỗi khi import/reset/restore/sửa RF; dùng làm ETag cho các trang báo cáo
+class DataVersion(db.Model): __tablename__='data_version'; id=db.Column(db.Integer, primary_key=True); table_name=db.Column(db.String(50), unique=True, nullable=False); version=db.Column(db.Integer, default=1); updated_at=db.Column(db.DateTime, default=datetime.utcnow)
 class ITSLog(db.Model): __tablename__='its_log'; id=db.Column(db.Integer, primary_key=True); timestamp=db.Column(db.String(50)); latitude=db.Column(db.Float); longitude=db.Column(db.Float); networktech=db.Column(db.String(20)); level=db.Column(db.Float); qual=db.Column(db.Float); cellid=db.Column(db.String(100))
 
 class KPI3G(db.Model):
-    __tablename__='kpi_3g'; id=db.Column(db.Integer, primary_key=True); ten_cell=db.Column(db.String(255), index=True); thoi_gian=db.Column(db.String(50)); traffic=db.Column(db.Float); pstraffic=db.Column(db.Float); cssr=db.Column(db.Float); dcr=db.Column(db.Float); ps_cssr=db.Column(db.Float); ps_dcr=db.Column(db.Float); hsdpa_throughput=db.Column(db.Float); hsupa_throughput=db.Column(db.Float); cs_so_att=db.Column(db.Float); ps_so_att=db.Column(db.Float); csconges=db.Column(db.Float); psconges=db.Column(db.Float); stt=db.Column(db.String(50)); nha_cung_cap=db.Column(db.String(100)); tinh=db.Column(db.String(255)); ten_rnc=db.Column(db.String(255)); ma_vnp=db.Column(db.String(100)); loai_ne=db.Column(db.String(100)); lac=db.Column(db.String(50)); ci=db.Column(db.String(50))
+    __tablename__='kpi_3g'; id=db.Column(db.Integer, primary_key=True); ten_cell=db.Column(db.String(255), index=True); cell_key=db.Column(db.String(255), index=True); thoi_gian=db.Column(db.String(50)); traffic=db.Column(db.Float); pstraffic=db.Column(db.Float); cssr=db.Column(db.Float); dcr=db.Column(db.Float); ps_cssr=db.Column(db.Float); ps_dcr=db.Column(db.Float); hsdpa_throughput=db.Column(db.Float); hsupa_throughput=db.Column(db.Float); cs_so_att=db.Column(db.Float); ps_so_att=db.Column(db.Float); csconges=db.Column(db.Float); psconges=db.Column(db.Float); stt=db.Column(db.String(50)); nha_cung_cap=db.Column(db.String(100)); tinh=db.Column(db.String(255)); ten_rnc=db.Column(db.String(255)); ma_vnp=db.Column(db.String(100)); loai_ne=db.Column(db.String(100)); lac=db.Column(db.String(50)); ci=db.Column(db.String(50))
 
 class KPI4G(db.Model):
-    __tablename__='kpi_4g'; id=db.Column(db.Integer, primary_key=True); ten_cell=db.Column(db.String(255), index=True); thoi_gian=db.Column(db.String(50)); traffic=db.Column(db.Float); traffic_vol_dl=db.Column(db.Float); traffic_vol_ul=db.Column(db.Float); cell_dl_avg_thputs=db.Column(db.Float); cell_ul_avg_thput=db.Column(db.Float); user_dl_avg_thput=db.Column(db.Float); user_ul_avg_thput=db.Column(db.Float); erab_ssrate_all=db.Column(db.Float); service_drop_all=db.Column(db.Float); unvailable=db.Column(db.Float); res_blk_dl=db.Column(db.Float); cqi_4g=db.Column(db.Float); stt=db.Column(db.String(50)); nha_cung_cap=db.Column(db.String(100)); tinh=db.Column(db.String(255)); ten_rnc=db.Column(db.String(255)); ma_vnp=db.Column(db.String(100)); loai_ne=db.Column(db.String(100)); enodeb_id=db.Column(db.String(100)); cell_id=db.Column(db.String(100))
+    __tablename__='kpi_4g'; id=db.Column(db.Integer, primary_key=True); ten_cell=db.Column(db.String(255), index=True); cell_key=db.Column(db.String(255), index=True); thoi_gian=db.Column(db.String(50)); traffic=db.Column(db.Float); traffic_vol_dl=db.Column(db.Float); traffic_vol_ul=db.Column(db.Float); cell_dl_avg_thputs=db.Column(db.Float); cell_ul_avg_thput=db.Column(db.Float); user_dl_avg_thput=db.Column(db.Float); user_ul_avg_thput=db.Column(db.Float); erab_ssrate_all=db.Column(db.Float); service_drop_all=db.Column(db.Float); unvailable=db.Column(db.Float); res_blk_dl=db.Column(db.Float); cqi_4g=db.Column(db.Float); stt=db.Column(db.String(50)); nha_cung_cap=db.Column(db.String(100)); tinh=db.Column(db.String(255)); ten_rnc=db.Column(db.String(255)); ma_vnp=db.Column(db.String(100)); loai_ne=db.Column(db.String(100)); enodeb_id=db.Column(db.String(100)); cell_id=db.Column(db.String(100))
 
 class KPI5G(db.Model):
-    __tablename__='kpi_5g'; id=db.Column(db.Integer, primary_key=True); ten_cell=db.Column(db.String(255), index=True); thoi_gian=db.Column(db.String(50)); traffic=db.Column(db.Float); dl_traffic_volume_gb=db.Column(db.Float); ul_traffic_volume_gb=db.Column(db.Float); cell_downlink_average_throughput=db.Column(db.Float); cell_uplink_average_throughput=db.Column(db.Float); user_dl_avg_throughput=db.Column(db.Float); cqi_5g=db.Column(db.Float); cell_avaibility_rate=db.Column(db.Float); sgnb_addition_success_rate=db.Column(db.Float); sgnb_abnormal_release_rate=db.Column(db.Float); nha_cung_cap=db.Column(db.String(100)); tinh=db.Column(db.String(255)); ten_gnodeb=db.Column(db.String(255)); ma_vnp=db.Column(db.String(100)); loai_ne=db.Column(db.String(100)); gnodeb_id=db.Column(db.String(100)); cell_id=db.Column(db.String(100))
+    __tablename__='kpi_5g'; id=db.Column(db.Integer, primary_key=True); ten_cell=db.Column(db.String(255), index=True); cell_key=db.Column(db.String(255), index=True); thoi_gian=db.Column(db.String(50)); traffic=db.Column(db.Float); dl_traffic_volume_gb=db.Column(db.Float); ul_traffic_volume_gb=db.Column(db.Float); cell_downlink_average_throughput=db.Column(db.Float); cell_uplink_average_throughput=db.Column(db.Float); user_dl_avg_throughput=db.Column(db.Float); cqi_5g=db.Column(db.Float); cell_avaibility_rate=db.Column(db.Float); sgnb_addition_success_rate=db.Column(db.Float); sgnb_abnormal_release_rate=db.Column(db.Float); nha_cung_cap=db.Column(db.String(100)); tinh=db.Column(db.String(255)); ten_gnodeb=db.Column(db.String(255)); ma_vnp=db.Column(db.String(100)); loai_ne=db.Column(db.String(100)); gnodeb_id=db.Column(db.String(100)); cell_id=db.Column(db.String(100))
+
+# Bảng archive KPI theo tuần/tháng cho từng cell (dữ liệu ngày cũ hơn KPI_RETENTION_DAYS được gộp vào đây rồi xóa khỏi bảng raw).
+# Cột lưu lượng lưu tổng của chu kỳ, các cột còn lại lưu trung bình; `days` là số dòng ngày đã gộp, `<chỉ số>_n` là số ngày có giá trị của chỉ số đó.
+KPI_MODELS = {'3g': KPI3G, '4g': KPI4G, '5g': KPI5G}
+KPI_SUM_COLUMNS = {'3g': {'traffic', 'pstraffic'}, '4g': {'traffic', 'traffic_vol_dl', 'traffic_vol_ul'}, '5g': {'traffic', 'dl_traffic_volume_gb', 'ul_traffic_volume_gb'}}
+KPI_ARCHIVE_GRANULARITIES = ('weekly', 'monthly')
+
+def kpi_metric_columns(Model): return [c.key for c in Model.__table__.columns if isinstance(c.type, db.Float)]
+
+def make_kpi_archive_model(Model, granularity):
+    tname = f"{Model.__tablename__}_{granularity}"
+    attrs = {'__tablename__': tname, '__table_args__': (db.UniqueConstraint('ten_cell', 'period_start', name=f'uq_{tname}_cell_period'), db.Index(f'ix_{tname}_period', 'period_start')),
+             'id': db.Column(db.Integer, primary_key=True), 'ten_cell': db.Column(db.String(255), nullable=False), 'cell_key': db.Column(db.String(255), index=True), 'period_start': db.Column(db.Date, nullable=False), 'days': db.Column(db.Integer, default=0)}
+    for key in kpi_metric_columns(Model):
+        attrs[key] = db.Column(db.Float)
+        attrs[f'{key}_n'] = db.Column(db.Integer, default=0)
+    return type(f"{Model.__name__}{granularity.title()}", (db.Model,), attrs)
+
+KPI_ARCHIVES = {tech: {gran: make_kpi_archive_model(Model, gran) for gran in KPI_ARCHIVE_GRANULARITIES} for tech, Model in KPI_MODELS.items()}
+KPI_ARCHIVE_MODELS = [m for archives in KPI_ARCHIVES.values() for m in archives.values()]
+
+# Khóa cell chuẩn hóa (strip + upper) lưu sẵn, có index, trên mọi bảng theo cell: RF/POI (cell_code), KPI (ten_cell), QoE/QoS (cell_name).
+# Các phép nối RF↔KPI↔POI↔QoE dùng cột này trong SQL thay vì chuẩn hóa bằng Python lúc truy vấn.
+CELL_KEY_SOURCES = {RF3G: 'cell_code', RF4G: 'cell_code', RF5G: 'cell_code', POI4G: 'cell_code', POI5G: 'cell_code', KPI3G: 'ten_cell', KPI4G: 'ten_cell', KPI5G: 'ten_cell', QoE4G: 'cell_name', QoS4G: 'cell_name'}
+CELL_KEY_SOURCES.update({m: 'ten_cell' for m in KPI_ARCHIVE_MODELS})
+INTERNAL_COLUMNS = ['id', 'extra_data', 'cell_key']
+
+def set_cell_key(mapper, connection, target):
+    target.cell_key = normalize_cell_key(getattr(target, CELL_KEY_SOURCES[type(target)]))
+
+for _model in CELL_KEY_SOURCES:
+    event.listen(_model, 'before_insert', set_cell_key)
+    event.listen(_model, 'before_update', set_cell_key)
+
+def backfill_cell_keys(*models):
+    # Dùng cho DB cũ và dữ liệu restore từ backup chưa có cột cell_key
+    for Model in models or CELL_KEY_SOURCES:
+        src = CELL_KEY_SOURCES[Model]
+        db.session.execute(text(f"UPDATE {Model.__tablename__} SET cell_key = UPPER(TRIM({src})) WHERE cell_key IS NULL AND {src} IS NOT NULL"))
+    db.session.commit()
+
+# Cube tổng hợp theo ngày × công nghệ × tỉnh × vendor × RNC/gNodeB. Mỗi chỉ số lưu tổng và số mẫu để gộp lên mọi cấp (trung bình = sum / n).
+class KPIRollup(db.Model):
+    __tablename__='kpi_rollup'; __table_args__=(db.Index('ix_kpi_rollup_tech_day', 'tech', 'day'), db.Index('ix_kpi_rollup_tech_tinh_day', 'tech', 'tinh', 'day'))
+    id=db.Column(db.Integer, primary_key=True); day=db.Column(db.Date, nullable=False); tech=db.Column(db.String(5), nullable=False); tinh=db.Column(db.String(255), default=''); nha_cung_cap=db.Column(db.String(100), default=''); controller=db.Column(db.String(255), default=''); cell_count=db.Column(db.Integer, default=0)
+    traffic_sum=db.Column(db.Float, default=0); traffic_n=db.Column(db.Integer, default=0); thput_sum=db.Column(db.Float, default=0); thput_n=db.Column(db.Integer, default=0); prb_sum=db.Column(db.Float, default=0); prb_n=db.Column(db.Integer, default=0)
+    cqi_sum=db.Column(db.Float, default=0); cqi_n=db.Column(db.Integer, default=0); cssr_sum=db.Column(db.Float, default=0); cssr_n=db.Column(db.Integer, default=0); drop_sum=db.Column(db.Float, default=0); drop_n=db.Column(db.Integer, default=0)
 
 @login_manager.user_loader
 def load_user(user_id): return db.session.get(User, int(user_id))
@@ -186,13 +660,1305 @@ def init_database():
                 print("--> Đã loại bỏ kiến trúc cũ. Tiến hành xóa bảng CONFIG_3G thừa...")
                 db.session.execute(text("DROP TABLE IF EXISTS config_3g"))
                 db.session.commit()
+            # Bổ sung cột mới cho các bảng đã tồn tại (create_all không ALTER bảng cũ)
+            added_cols = {'qoe_4g': {'schema_id': 'INTEGER', 'detail_values': 'TEXT'}, 'qos_4g': {'schema_id': 'INTEGER', 'detail_values': 'TEXT'}}
+            for Model in CELL_KEY_SOURCES: added_cols.setdefault(Model.__tablename__, {})['cell_key'] = 'VARCHAR(255)'
+            for Archive in KPI_ARCHIVE_MODELS: added_cols[Archive.__tablename__].update({f'{c}_n': 'INTEGER' for c in kpi_metric_columns(Archive)})
+            for tname, cols in added_cols.items():
+                if tname not in inspector.get_table_names(): continue
+                existing = {c['name'] for c in inspector.get_columns(tname)}
+                for cname, ctype in cols.items():
+                    if cname not in existing:
+                        print(f"--> Thêm cột {cname} vào bảng {tname}...")
+                        db.session.execute(text(f"ALTER TABLE {tname} ADD COLUMN {cname} {ctype}"))
+                        if cname == 'cell_key':
+                            db.session.execute(text(f"CREATE INDEX ix_{tname}_cell_key ON {tname} (cell_key)"))
+                            Model = next(m for m in CELL_KEY_SOURCES if m.__tablename__ == tname)
+                            src = CELL_KEY_SOURCES[Model]
+                            db.session.execute(text(f"UPDATE {tname} SET cell_key = UPPER(TRIM({src})) WHERE {src} IS NOT NULL"))
+                        elif cname.endswith('_n'):
+                            # Archive cũ chưa có số đếm theo chỉ số: coi như mọi ngày đã gộp đều có giá trị
+                            db.session.execute(text(f"UPDATE {tname} SET {cname} = days WHERE {cname[:-2]} IS NOT NULL"))
+                db.session.commit()
         except Exception as e: print("Auto-migration check failed:", e)
 
         db.create_all()
+        known = {r[0] for r in db.session.query(DataVersion.table_name)}
+        for tname in db.metadata.tables:
+            if tname not in known: db.session.add(DataVersion(table_name=tname, version=1))
+        db.session.commit()
         if not User.query.filter_by(username='admin').first():
             u = User(username='admin', role='admin'); u.set_password('admin123')
             db.session.add(u); db.session.commit()
-init_database()
+
+# Worker khởi động không chạy DDL: schema được cập nhật một lần bằng `flask --app app migrate` trước khi chạy gunicorn
+# (AUTO_MIGRATE=1 giữ lại hành vi cũ cho môi trường chỉ có một tiến trình)
+@app.cli.command('migrate')
+def migrate_command():
+    """Tạo bảng mới, thêm cột mới và tài khoản admin mặc định."""
+    init_database()
+    with app.app_context():
+        # Lần đầu có bảng kpi_rollup: dựng lại từ dữ liệu KPI hiện có
+        if not db.session.query(KPIRollup.id).first():
+            for tech in KPI_MODELS:
+                if db.session.query(KPI_MODELS[tech].id).first(): print(f"--> Dựng kpi_rollup {tech.upper()}: {rebuild_kpi_rollup(tech)} dòng KPI")
+        # Dữ liệu QoE/QoS có từ trước khi có bảng chẩn đoán NPO: tính một lần
+        if not db.session.query(NPOWeek.id).first() and (db.session.query(QoE4G.id).first() or db.session.query(QoS4G.id).first()):
+            refresh_npo_diagnosis(); print("--> Tính chẩn đoán NPO cho các tuần QoE/QoS đã có")
+        # Phân tích RF/PCI chưa có hoặc lệch version RF (bản cũ tính lúc xem trang): tính lại một lần
+        for tech in RF_MODELS:
+            if rf_stale(get_rf_analysis(tech), tech) or (tech in PCI_TECHS and rf_stale(get_pci_conflicts(tech), tech)):
+                refresh_rf_derived(tech); print(f"--> Tính lại phân tích RF/PCI {tech.upper()}")
+    print("--> Migrate xong.")
+
+@app.cli.command('startup-stats')
+@click.option('--runs', default=5, show_default=True, help='Số lần khởi động tiến trình mới để đo.')
+def startup_stats_command(runs):
+    """Đo thời gian import app và RSS của một worker mới (pandas/openpyxl không được nạp khi khởi động)."""
+    probe = (
+        "import time, sys, json, resource; t0 = time.perf_counter(); import {mod}; t1 = time.perf_counter();"
+        "print(json.dumps({{'import_ms': (t1 - t0) * 1000, 'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,"
+        "'pandas_loaded': 'pandas' in sys.modules, 'openpyxl_loaded': 'openpyxl' in sys.modules}}))"
+    ).format(mod=os.path.splitext(os.path.basename(__file__))[0])
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', probe], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True)
+        samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    import_ms = sorted(x['import_ms'] for x in samples)
+    rss_mb = sorted(x['rss_mb'] for x in samples)
+    print(f"Import app: median {import_ms[len(import_ms) // 2]:.0f} ms (min {import_ms[0]:.0f}, max {import_ms[-1]:.0f}) qua {runs} lần")
+    print(f"RSS sau khi import: median {rss_mb[len(rss_mb) // 2]:.1f} MB")
+    print(f"pandas nạp lúc khởi động: {samples[-1]['pandas_loaded']}, openpyxl: {samples[-1]['openpyxl_loaded']}")
+
+if os.environ.get('AUTO_MIGRATE') == '1': init_database()
+
+# ==============================================================================
+# 3b. CELL SEARCH INDEX (TRIGRAM)
+# ==============================================================================
+
+# Chỉ mục trigram trong bộ nhớ cho các mã cell/site: ilike('%x%') không dùng được index của cell_code/ten_cell/cell_name
+class CellSearchIndex:
+    MAX_IN_VALUES = 900
+    RECHECK_SECONDS = 30
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock: self._entries.clear()
+
+    def _signature(self, column):
+        # Version của bảng trong data_version tăng ở mọi đường ghi (import, sửa/xóa lẻ, reset, restore) kể cả ở worker khác;
+        # entry được đối chiếu lại tối đa mỗi RECHECK_SECONDS và dựng lại khi version đổi
+        return db.session.query(DataVersion.version).filter_by(table_name=column.class_.__tablename__).scalar()
+
+    def _build(self, column):
+        codes = sorted({str(r[0]) for r in db.session.query(column).distinct() if r[0] is not None and str(r[0]).strip()})
+        lowered = [c.lower() for c in codes]
+        grams = defaultdict(set)
+        for i, c in enumerate(lowered):
+            for j in range(len(c) - 2): grams[c[j:j + 3]].add(i)
+        return {'codes': codes, 'lowered': lowered, 'grams': grams}
+
+    def _entry(self, column):
+        key = f"{column.class_.__tablename__}.{column.key}"
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry and now - entry['checked'] < self.RECHECK_SECONDS: return entry
+        sig = self._signature(column)
+        if entry and entry['sig'] == sig:
+            entry['checked'] = now
+            return entry
+        entry = self._build(column) | {'sig': sig, 'checked': now}
+        with self._lock: self._entries[key] = entry
+        return entry
+
+    def lookup(self, column, q):
+        q = str(q or '').strip().lower()
+        if not q: return []
+        entry = self._entry(column)
+        lowered = entry['lowered']
+        if len(q) < 3: candidates = range(len(lowered))
+        else:
+            postings = sorted((entry['grams'].get(q[j:j + 3], set()) for j in range(len(q) - 2)), key=len)
+            candidates = set(postings[0]).intersection(*postings[1:]) if postings[0] else set()
+        return [entry['codes'][i] for i in sorted(candidates) if q in lowered[i]]
+
+    # Tương đương column.ilike('%q%') nhưng dùng IN trên index khi số mã khớp đủ nhỏ
+    def match(self, column, q):
+        codes = self.lookup(column, q)
+        if not codes: return false()
+        if len(codes) > self.MAX_IN_VALUES: return column.ilike(f"%{q}%")
+        return column.in_(codes)
+
+cell_index = CellSearchIndex()
+
+# ==============================================================================
+# 3c. NPO DIAGNOSIS (MATERIALIZED PER WEEK)
+# ==============================================================================
+
+NPO_DEFAULTS = {
+    'qoe_score_max': 2, 'qoe_percent_min': 80, 'qos_score_max': 3, 'qos_percent_min': 90,
+    'prb_congestion': 20, 'thput_congestion': 10, 'cqi_min': 93, 'drop_max': 0.3, 'kpi_days': 3
+}
+NPO_LABELS = {
+    'qoe_score_max': 'Điểm QoE ≤', 'qoe_percent_min': '% QoE <', 'qos_score_max': 'Điểm QoS ≤', 'qos_percent_min': '% QoS <',
+    'prb_congestion': 'PRB nghẽn >', 'thput_congestion': 'Thput nghẽn <', 'cqi_min': 'CQI <', 'drop_max': 'Drop >', 'kpi_days': 'Số ngày KPI'
+}
+
+def get_npo_config():
+    cfg = dict(NPO_DEFAULTS)
+    cfg.update({r.key: r.value for r in NPOConfig.query.all() if r.key in cfg and r.value is not None})
+    return cfg
+
+def compute_npo_week(week_name, cfg, l900_cells, latest_dates):
+    qoe_bad = db.session.query(QoE4G.cell_key, QoE4G.cell_name, QoE4G.qoe_score, QoE4G.qoe_percent).filter((QoE4G.week_name == week_name) & ((QoE4G.qoe_score <= cfg['qoe_score_max']) | (QoE4G.qoe_percent < cfg['qoe_percent_min']))).all()
+    qos_bad = db.session.query(QoS4G.cell_key, QoS4G.cell_name, QoS4G.qos_score, QoS4G.qos_percent).filter((QoS4G.week_name == week_name) & ((QoS4G.qos_score <= cfg['qos_score_max']) | (QoS4G.qos_percent < cfg['qos_percent_min']))).all()
+
+    def is_trash(c_name):
+        c_str = str(c_name).strip().upper()
+        if not c_str or c_str in ['NAN', 'NONE', 'NULL']: return True
+        if len(c_str) < 5: return True
+        if c_str.replace('.', '', 1).isdigit(): return True
+        if c_str in l900_cells: return True
+        if c_str.startswith('VNP-4G') or c_str.startswith('MBF_TH'): return True
+        return False
+
+    # Gom theo cell_key để khớp KPI4G qua cột đã chuẩn hóa; giữ tên gốc đầu tiên để hiển thị
+    bad_cells, display_names = {}, {}
+    for r in qoe_bad:
+        if not r.cell_key or is_trash(r.cell_name): continue
+        display_names.setdefault(r.cell_key, r.cell_name)
+        bad_cells[r.cell_key] = {'qoe_score': r.qoe_score, 'qoe_percent': r.qoe_percent}
+    for r in qos_bad:
+        if not r.cell_key or is_trash(r.cell_name): continue
+        display_names.setdefault(r.cell_key, r.cell_name)
+        bad_cells.setdefault(r.cell_key, {}).update({'qos_score': r.qos_score, 'qos_percent': r.qos_percent})
+
+    if bad_cells and latest_dates:
+        cell_keys = list(bad_cells.keys())
+        for start in range(0, len(cell_keys), 900):
+            kpi_records = db.session.query(
+                KPI4G.cell_key,
+                func.avg(KPI4G.res_blk_dl).label('avg_prb'),
+                func.avg(KPI4G.user_dl_avg_thput).label('avg_thput'),
+                func.avg(KPI4G.cqi_4g).label('avg_cqi'),
+                func.avg(KPI4G.service_drop_all).label('avg_drop')
+            ).filter(KPI4G.cell_key.in_(cell_keys[start:start + 900]), KPI4G.thoi_gian.in_(latest_dates)).group_by(KPI4G.cell_key).all()
+
+            for r in kpi_records:
+                if r.cell_key not in bad_cells: continue
+                prb, thput, cqi, drop = r.avg_prb or 0, r.avg_thput or 0, r.avg_cqi or 0, r.avg_drop or 0
+                issues, actions = [], []
+                if prb > cfg['prb_congestion'] and thput < cfg['thput_congestion']:
+                    issues.append("Nghẽn (Congestion)")
+                    actions.append("Cân bằng tải L1800->L2100 / Thêm Carrier")
+                if cqi < cfg['cqi_min']:
+                    issues.append("Vô tuyến kém / Nhiễu")
+                    actions.append("Chỉnh Tx Power / Tối ưu Tilt, Azimuth")
+                if drop > cfg['drop_max'] and prb <= cfg['prb_congestion']:
+                    issues.append("Lỗi Thiết bị / Truyền dẫn")
+                    actions.append("NOC reset Card / UCTT đo kiểm Quang, VSWR")
+                if not issues:
+                    issues.append("Chưa rõ nguyên nhân")
+                    actions.append("Theo dõi sâu / Phân tích tham số")
+                bad_cells[r.cell_key].update({'prb': round(prb, 2), 'thput': round(thput, 2), 'cqi': round(cqi, 2), 'drop': round(drop, 2), 'issues': issues, 'actions': actions})
+
+    rows = []
+    for key, d in bad_cells.items():
+        issues = d.pop('issues', ['Thiếu dữ liệu KPI ngày'])
+        actions = d.pop('actions', ['Cần Import KPI'])
+        rows.append(d | {'week_name': week_name, 'cell_name': display_names[key], 'issues': ' | '.join(issues), 'actions': ' | '.join(actions)})
+    return rows
+
+def refresh_npo_diagnosis(weeks=None):
+    # Tính lại bảng chẩn đoán cho các tuần chỉ định (mặc định: mọi tuần đã có QoE/QoS)
+    if weeks is None:
+        weeks = {r[0] for r in db.session.query(QoE4G.week_name).distinct()} | {r[0] for r in db.session.query(QoS4G.week_name).distinct()}
+    weeks = [w for w in weeks if w]
+    if not weeks: return
+    cfg = get_npo_config()
+    l900_cells = {c[0] for c in db.session.query(RF4G.cell_key).filter(RF4G.frequency.ilike('%L900%')).all()}
+    all_dates = [d[0] for d in db.session.query(KPI4G.thoi_gian).distinct().all()]
+    date_objs = []
+    for d in all_dates:
+        try: date_objs.append(datetime.strptime(d, '%d/%m/%Y'))
+        except (TypeError, ValueError): pass
+    latest_dates = [d.strftime('%d/%m/%Y') for d in sorted(date_objs, reverse=True)[:int(cfg['kpi_days'])]]
+    for week in weeks:
+        rows = compute_npo_week(week, cfg, l900_cells, latest_dates)
+        db.session.query(NPODiagnosis).filter(NPODiagnosis.week_name == week).delete()
+        if rows: db.session.bulk_insert_mappings(NPODiagnosis, rows)
+        state = NPOWeek.query.filter_by(week_name=week).first()
+        if state: state.computed_at = datetime.utcnow()
+        else: db.session.add(NPOWeek(week_name=week))
+        db.session.commit()
+
+# ==============================================================================
+# 3d. DATA VERSIONS & CONDITIONAL GET (ETAG)
+# ==============================================================================
+
+# Đổi khi deploy code/template mới để trình duyệt không dùng lại trang render bởi phiên bản cũ
+def app_build_stamp():
+    folder = os.path.join(app.root_path, app.template_folder)
+    return str(int(max(os.path.getmtime(p) for p in [__file__] + [os.path.join(folder, f) for f in os.listdir(folder)])))
+
+APP_BUILD = os.environ.get('APP_BUILD') or app_build_stamp()
+
+def bump_data_version(*tables):
+    now = datetime.utcnow()
+    for tname in tables:
+        if not DataVersion.query.filter_by(table_name=tname).update({'version': DataVersion.version + 1, 'updated_at': now}):
+            db.session.add(DataVersion(table_name=tname, version=1, updated_at=now))
+    db.session.commit()
+
+def conditional_report(*models, by_day=False):
+    # Trả 304 khi If-None-Match khớp ETag (tham số route + user + version các bảng liên quan) mà không chạy truy vấn báo cáo.
+    # by_day: báo cáo lọc khoảng ngày tính từ hôm nay, ETag đổi theo ngày để qua nửa đêm không trả lại cửa sổ hôm trước
+    tables = sorted(m.__tablename__ for m in models)
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET' or session.get('_flashes'): return f(*args, **kwargs)
+            rows = db.session.query(DataVersion.table_name, DataVersion.version, DataVersion.updated_at).filter(DataVersion.table_name.in_(tables)).all()
+            params = sorted((k, v) for k, v in request.args.items(multi=True) if k != '_profile')
+            state = [request.endpoint, params, current_user.get_id(), current_user.role, APP_BUILD, sorted((r.table_name, r.version) for r in rows)]
+            if by_day: state.append(date.today().isoformat())
+            etag = hashlib.sha1(json.dumps(state, ensure_ascii=False).encode('utf-8')).hexdigest()
+            last_modified = max((r.updated_at for r in rows if r.updated_at), default=None)
+            if request.if_none_match.contains_weak(etag):
+                resp = Response(status=304)
+            else:
+                resp = make_response(f(*args, **kwargs))
+                if resp.status_code != 200: return resp
+            resp.set_etag(etag, weak=True)
+            if last_modified: resp.last_modified = last_modified
+            resp.headers['Cache-Control'] = 'private, no-cache'
+            return resp
+        return wrapper
+    return decorator
+
+# ==============================================================================
+# 3e. KPI RETENTION (ARCHIVE TUẦN/THÁNG)
+# ==============================================================================
+
+# Giữ dữ liệu ngày trong KPI_RETENTION_DAYS ngày; cũ hơn thì gộp vào bảng kpi_*_weekly / kpi_*_monthly.
+# Báo cáo KPI với khoảng dài hơn cửa sổ này đọc archive và gộp thêm phần raw còn lại theo cùng chu kỳ.
+KPI_RETENTION_DAYS = int(os.environ.get('KPI_RETENTION_DAYS', 120))
+KPI_WEEKLY_MAX_DAYS = 400
+KPI_RANGES = [('', 'Dữ liệu ngày'), ('30', '30 ngày'), ('90', '90 ngày'), ('180', '6 tháng'), ('365', '1 năm'), ('730', '2 năm'), ('all', 'Toàn bộ')]
+
+def parse_kpi_day(value):
+    try: return datetime.strptime(str(value).strip(), '%d/%m/%Y').date()
+    except (TypeError, ValueError): return None
+
+def kpi_period_start(day, granularity):
+    return day - timedelta(days=day.weekday()) if granularity == 'weekly' else day.replace(day=1)
+
+def kpi_period_label(start, granularity):
+    if granularity == 'weekly':
+        year, week, _ = start.isocalendar()
+        return f"W{week:02d}/{year}"
+    return start.strftime('%m/%Y')
+
+def kpi_granularity(range_days):
+    # range_days: None = toàn bộ dữ liệu ngày (hành vi cũ), 0 = toàn bộ lịch sử
+    if range_days is None or 0 < range_days <= KPI_RETENTION_DAYS: return 'daily'
+    return 'weekly' if 0 < range_days <= KPI_WEEKLY_MAX_DAYS else 'monthly'
+
+def kpi_series(tech, metric, cells, range_days=None):
+    """Trả về (labels, {cell_key: {label: value}}) của một chỉ số cho danh sách cell_key, theo ngày hoặc tuần/tháng tùy độ dài khoảng."""
+    Model = KPI_MODELS[tech]
+    granularity = kpi_granularity(range_days)
+    start = date.today() - timedelta(days=range_days) if range_days else None
+    raw = db.session.query(Model.cell_key, Model.thoi_gian, getattr(Model, metric)).filter(Model.cell_key.in_(cells)).all()
+    data_by_cell = defaultdict(dict)
+    if granularity == 'daily':
+        labels = set()
+        for cell, day, value in raw:
+            if not day: continue
+            if start:
+                d = parse_kpi_day(day)
+                if d is None or d < start: continue
+            labels.add(day)
+            data_by_cell[cell][day] = value or 0
+        try: all_labels = sorted(labels, key=lambda d: datetime.strptime(d, '%d/%m/%Y'))
+        except ValueError: all_labels = sorted(labels)
+        return all_labels, data_by_cell
+
+    summed = metric in KPI_SUM_COLUMNS[tech]
+    acc = defaultdict(lambda: [0.0, 0])
+    Archive = KPI_ARCHIVES[tech][granularity]
+    query = db.session.query(Archive.cell_key, Archive.period_start, getattr(Archive, f'{metric}_n'), getattr(Archive, metric)).filter(Archive.cell_key.in_(cells))
+    if start: query = query.filter(Archive.period_start >= kpi_period_start(start, granularity))
+    for cell, period, n, value in query:
+        if value is None or not n: continue
+        a = acc[(cell, period)]
+        a[0] += value if summed else value * n
+        a[1] += n
+    for cell, day, value in raw:
+        d = parse_kpi_day(day)
+        if d is None or value is None or (start and d < start): continue
+        a = acc[(cell, kpi_period_start(d, granularity))]
+        a[0] += value
+        a[1] += 1
+    periods = sorted({period for _, period in acc})
+    for (cell, period), (total, n) in acc.items():
+        data_by_cell[cell][kpi_period_label(period, granularity)] = total if summed else total / n
+    return [kpi_period_label(p, granularity) for p in periods], data_by_cell
+
+def kpi_cell_names(tech, cells):
+    # cell_key -> ten_cell gốc để hiển thị (legend biểu đồ); cell chỉ còn trong archive lấy tên từ archive
+    Model = KPI_MODELS[tech]
+    names = {}
+    for source in [Model, *KPI_ARCHIVES[tech].values()]:
+        missing = [c for c in cells if c not in names]
+        if not missing: break
+        for key, name in db.session.query(source.cell_key, func.min(source.ten_cell)).filter(source.cell_key.in_(missing)).group_by(source.cell_key):
+            names[key] = name
+    return names
+
+def archive_kpi(tech, retention_days=KPI_RETENTION_DAYS, batch_size=500, days_per_batch=7):
+    """Gộp các ngày cũ hơn retention_days của bảng KPI vào archive tuần/tháng rồi xóa khỏi bảng raw. Trả về số dòng đã gộp.
+    Mỗi lần xử lý days_per_batch ngày: gộp, ghi archive và xóa raw của các ngày đó trong cùng một transaction."""
+    Model = KPI_MODELS[tech]
+    cutoff = date.today() - timedelta(days=retention_days)
+    old_days = sorted((day for (day,) in db.session.query(Model.thoi_gian).distinct() if (parse_kpi_day(day) or cutoff) < cutoff), key=parse_kpi_day)
+    if not old_days: return 0
+    metric_cols = kpi_metric_columns(Model)
+    summed = KPI_SUM_COLUMNS[tech]
+    cols = [Model.ten_cell, Model.thoi_gian] + [getattr(Model, c) for c in metric_cols]
+    total_rows = 0
+    for b in range(0, len(old_days), days_per_batch):
+        batch_days = old_days[b:b + days_per_batch]
+        acc = {gran: {} for gran in KPI_ARCHIVE_GRANULARITIES}
+        for row in db.session.query(*cols).filter(Model.thoi_gian.in_(batch_days)):
+            total_rows += 1
+            if not row[0]: continue
+            day = parse_kpi_day(row[1])
+            for gran in KPI_ARCHIVE_GRANULARITIES:
+                a = acc[gran].setdefault((row[0], kpi_period_start(day, gran)), {'days': 0, 'values': {c: [0.0, 0] for c in metric_cols}})
+                a['days'] += 1
+                for c, value in zip(metric_cols, row[2:]):
+                    if value is None: continue
+                    a['values'][c][0] += value
+                    a['values'][c][1] += 1
+
+        for gran, groups in acc.items():
+            Archive = KPI_ARCHIVES[tech][gran]
+            existing = {}
+            periods = sorted({period for _, period in groups})
+            for i in range(0, len(periods), batch_size):
+                for r in Archive.query.filter(Archive.period_start.in_(periods[i:i + batch_size])):
+                    if (r.ten_cell, r.period_start) in groups: existing[(r.ten_cell, r.period_start)] = r
+            inserts, updates = [], []
+            for (cell, period), a in groups.items():
+                old = existing.get((cell, period))
+                row = {'ten_cell': cell, 'cell_key': normalize_cell_key(cell), 'period_start': period, 'days': a['days'] + ((old.days or 0) if old else 0)}
+                for c in metric_cols:
+                    total, n = a['values'][c]
+                    # Gộp với dòng archive sẵn có theo số giá trị khác NULL của từng chỉ số (không theo số ngày)
+                    old_n = (getattr(old, f'{c}_n') or 0) if old else 0
+                    if old_n and getattr(old, c) is not None:
+                        total += getattr(old, c) if c in summed else getattr(old, c) * old_n
+                        n += old_n
+                    row[c] = (total if c in summed else total / n) if n else None
+                    row[f'{c}_n'] = n
+                if old: updates.append(dict(row, id=old.id))
+                else: inserts.append(row)
+            if inserts: db.session.bulk_insert_mappings(Archive, inserts)
+            if updates: db.session.bulk_update_mappings(Archive, updates)
+        for i in range(0, len(batch_days), batch_size):
+            db.session.query(Model).filter(Model.thoi_gian.in_(batch_days[i:i + batch_size])).delete(synchronize_session=False)
+        db.session.commit()
+    bump_data_version(Model.__tablename__, *(a.__tablename__ for a in KPI_ARCHIVES[tech].values()))
+    cell_index.invalidate()
+    return total_rows
+
+@app.cli.command('kpi-retention')
+@click.option('--days', default=KPI_RETENTION_DAYS, show_default=True, help='Số ngày dữ liệu KPI ngày được giữ lại.')
+@click.option('--tech', type=click.Choice(['3g', '4g', '5g', 'all']), default='all', show_default=True)
+def kpi_retention_command(days, tech):
+    """Gộp dữ liệu KPI ngày cũ vào bảng archive tuần/tháng và xóa khỏi bảng raw (chạy định kỳ bằng cron)."""
+    for t in (KPI_MODELS if tech == 'all' else [tech]):
+        t0 = time.perf_counter()
+        n = archive_kpi(t, days)
+        print(f"--> KPI {t.upper()}: đã gộp {n} dòng ngày cũ hơn {days} ngày ({time.perf_counter() - t0:.1f}s)")
+
+# ==============================================================================
+# 3f. KPI ROLLUP (NGÀY × TỈNH × VENDOR × RNC)
+# ==============================================================================
+
+# Cube được cập nhật cộng dồn mỗi lần import KPI (không GROUP BY lại bảng per-cell). Dữ liệu đã archive (3e) vẫn giữ trong cube.
+ROLLUP_MEASURES = {
+    'traffic': {'3g': 'traffic', '4g': 'traffic', '5g': 'traffic'},
+    'thput': {'3g': 'hsdpa_throughput', '4g': 'user_dl_avg_thput', '5g': 'user_dl_avg_throughput'},
+    'prb': {'4g': 'res_blk_dl'},
+    'cqi': {'4g': 'cqi_4g', '5g': 'cqi_5g'},
+    'cssr': {'3g': 'cssr', '4g': 'erab_ssrate_all', '5g': 'sgnb_addition_success_rate'},
+    'drop': {'3g': 'dcr', '4g': 'service_drop_all', '5g': 'sgnb_abnormal_release_rate'},
+}
+ROLLUP_SUMMED = {'traffic'}
+ROLLUP_CONTROLLER = {'3g': 'ten_rnc', '4g': 'ten_rnc', '5g': 'ten_gnodeb'}
+ROLLUP_LEVELS = {'network': ('province', 'tinh'), 'province': ('controller', 'controller'), 'controller': ('cell', None)}
+
+class RollupAccumulator:
+    def __init__(self, tech):
+        self.tech = tech
+        self.columns = {m: cols[tech] for m, cols in ROLLUP_MEASURES.items() if tech in cols}
+        self.groups = {}
+
+    def add(self, row):
+        day = parse_kpi_day(row.get('thoi_gian'))
+        if day is None: return
+        key = (day, str(row.get('tinh') or '').strip(), str(row.get('nha_cung_cap') or '').strip(), str(row.get(ROLLUP_CONTROLLER[self.tech]) or '').strip())
+        grp = self.groups.get(key)
+        if grp is None: grp = self.groups[key] = defaultdict(float)
+        grp['cell_count'] += 1
+        for m, col in self.columns.items():
+            v = row.get(col)
+            if v is None or v != v: continue
+            grp[f'{m}_sum'] += v
+            grp[f'{m}_n'] += 1
+
+    def add_columns(self, data):
+        """Như add() cho cả chunk dạng mảng cột (dict cột -> mảng object): gom nhóm bằng pandas thay vì từng dòng."""
+        import pandas as pd, numpy as np
+        n = len(next(iter(data.values()))) if data else 0
+        if not n: return
+        def text_col(k): return unique_map(data[k], lambda v: str(v or '').strip()) if k in data else np.full(n, '', dtype=object)
+        frame = pd.DataFrame({'day': unique_map(data['thoi_gian'], parse_kpi_day) if 'thoi_gian' in data else np.full(n, None, dtype=object), 'tinh': text_col('tinh'), 'vendor': text_col('nha_cung_cap'), 'controller': text_col(ROLLUP_CONTROLLER[self.tech])})
+        for m, col in self.columns.items():
+            v = np.array(data[col], dtype=float) if col in data else np.full(n, np.nan)
+            frame[f'{m}_sum'] = np.where(np.isnan(v), 0.0, v)
+            frame[f'{m}_n'] = ~np.isnan(v)
+        frame = frame[frame['day'].notna()]
+        if frame.empty: return
+        groups = frame.groupby(['day', 'tinh', 'vendor', 'controller'], sort=False)
+        sums = groups.sum()
+        sums['cell_count'] = groups.size()
+        for key, row in zip(sums.index.tolist(), sums.to_dict('records')):
+            grp = self.groups.get(key)
+            if grp is None: grp = self.groups[key] = defaultdict(float)
+            for f, v in row.items(): grp[f] += v
+
+    def apply(self, replace=False):
+        """Ghi các nhóm vào kpi_rollup: cộng dồn vào dòng sẵn có, hoặc thay thế toàn bộ các ngày liên quan (replace=True)."""
+        if not self.groups: return 0
+        days = sorted({k[0] for k in self.groups})
+        existing = {}
+        for i in range(0, len(days), 500):
+            q = KPIRollup.query.filter(KPIRollup.tech == self.tech, KPIRollup.day.in_(days[i:i + 500]))
+            if replace: q.delete(synchronize_session=False)
+            else: existing.update({(r.day, r.tinh, r.nha_cung_cap, r.controller): r for r in q})
+        fields = ['cell_count'] + [f'{m}_{x}' for m in ROLLUP_MEASURES for x in ('sum', 'n')]
+        inserts, updates = [], []
+        for (day, tinh, vendor, controller), grp in self.groups.items():
+            old = existing.get((day, tinh, vendor, controller))
+            row = {f: grp.get(f, 0) + ((getattr(old, f) or 0) if old else 0) for f in fields}
+            if old: updates.append(dict(row, id=old.id))
+            else: inserts.append(dict(row, day=day, tech=self.tech, tinh=tinh, nha_cung_cap=vendor, controller=controller))
+        if inserts: db.session.bulk_insert_mappings(KPIRollup, inserts)
+        if updates: db.session.bulk_update_mappings(KPIRollup, updates)
+        db.session.commit()
+        n = len(self.groups)
+        self.groups = {}
+        return n
+
+def rebuild_kpi_rollup(tech, batch_size=200):
+    """Tính lại cube cho các ngày còn trong bảng KPI raw của một công nghệ. Trả về số dòng KPI đã đọc."""
+    Model = KPI_MODELS[tech]
+    acc = RollupAccumulator(tech)
+    keys = ['thoi_gian', 'tinh', 'nha_cung_cap', ROLLUP_CONTROLLER[tech]] + list(acc.columns.values())
+    days = [d for (d,) in db.session.query(Model.thoi_gian).distinct() if d]
+    total = 0
+    for i in range(0, len(days), batch_size):
+        for row in db.session.query(*[getattr(Model, k) for k in keys]).filter(Model.thoi_gian.in_(days[i:i + batch_size])):
+            acc.add(dict(zip(keys, row)))
+            total += 1
+        acc.apply(replace=True)
+    bump_data_version(KPIRollup.__tablename__)
+    return total
+
+@app.cli.command('kpi-rollup')
+@click.option('--tech', type=click.Choice(['3g', '4g', '5g', 'all']), default='all', show_default=True)
+def kpi_rollup_command(tech):
+    """Dựng lại bảng kpi_rollup từ các bảng KPI raw (import tự cập nhật cube, lệnh này chỉ dùng để sửa/khởi tạo)."""
+    for t in (KPI_MODELS if tech == 'all' else [tech]):
+        print(f"--> kpi_rollup {t.upper()}: {rebuild_kpi_rollup(t)} dòng KPI")
+
+def rollup_values(row, offset=0):
+    # row: (..., cell_count, <m>_sum, <m>_n, ...) theo thứ tự ROLLUP_MEASURES bắt đầu từ offset
+    out = {'cells': row[offset] or 0}
+    for i, m in enumerate(ROLLUP_MEASURES):
+        total, n = row[offset + 1 + 2 * i], row[offset + 2 + 2 * i]
+        out[m] = None if not n else round(total if m in ROLLUP_SUMMED else total / n, 2)
+    return out
+
+def rollup_columns():
+    cols = [func.sum(KPIRollup.cell_count)]
+    for m in ROLLUP_MEASURES: cols += [func.sum(getattr(KPIRollup, f'{m}_sum')), func.sum(getattr(KPIRollup, f'{m}_n'))]
+    return cols
+
+# ==============================================================================
+# 3g. SECTOR GEOMETRY (GIS)
+# ==============================================================================
+
+# Hình quạt của cell được tính sẵn bằng NumPy cho cả bảng RF (bán kính/độ mở theo băng tần) và cache theo version bảng RF;
+# trình duyệt chỉ vẽ lại hình đã tính (thanh trượt bán kính chỉ co giãn quanh tâm, không tính lượng giác).
+SECTOR_BASE_RADIUS = 350
+SECTOR_ARC_STEPS = 12
+SECTOR_MID_RATIO = 0.65
+# (chuỗi nhận diện trong cột frequency, độ mở búp sóng (độ), hệ số bán kính so với SECTOR_BASE_RADIUS)
+SECTOR_BANDS = [('900', 65, 1.4), ('1800', 60, 1.0), ('2100', 60, 0.85), ('2600', 60, 0.75), ('N41', 60, 0.75), ('N78', 60, 0.6), ('3500', 60, 0.6)]
+SECTOR_DEFAULT_BAND = (60, 1.0)
+RF_MODELS = {'3g': RF3G, '4g': RF4G, '5g': RF5G}
+
+def sector_band(frequency):
+    f = str(frequency or '').upper()
+    return next(((bw, factor) for key, bw, factor in SECTOR_BANDS if key in f), SECTOR_DEFAULT_BAND)
+
+def compute_sector_geometry(lat, lon, azimuth, beamwidth, radius, steps=SECTOR_ARC_STEPS):
+    """Tính toàn bộ hình quạt một lần: trả về rings (n, steps + 3, 2) [lat, lon] khép kín qua tâm và mid (n, 2) trên hướng azimuth."""
+    import numpy as np
+    lat, lon, azimuth, beamwidth, radius = (np.asarray(a, dtype=float) for a in (lat, lon, azimuth, beamwidth, radius))
+    lat_factor = 111320.0
+    lon_factor = 111320.0 * np.cos(np.radians(lat))
+    angles = np.radians(azimuth[:, None] + beamwidth[:, None] * np.linspace(-0.5, 0.5, steps + 1)[None, :])
+    arc = np.stack([lat[:, None] + radius[:, None] * np.cos(angles) / lat_factor,
+                    lon[:, None] + radius[:, None] * np.sin(angles) / lon_factor[:, None]], axis=2)
+    center = np.stack([lat, lon], axis=1)[:, None, :]
+    rings = np.concatenate([center, arc, center], axis=1)
+    az = np.radians(azimuth)
+    mid = np.stack([lat + radius * SECTOR_MID_RATIO * np.cos(az) / lat_factor, lon + radius * SECTOR_MID_RATIO * np.sin(az) / lon_factor], axis=1)
+    return rings.round(6), mid.round(6)
+
+class SectorGeometryCache:
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, tech):
+        Model = RF_MODELS[tech]
+        version = db.session.query(DataVersion.version).filter_by(table_name=Model.__tablename__).scalar()
+        entry = self._entries.get(tech)
+        if entry and entry['version'] == version: return entry
+        entry = self._build(Model) | {'version': version, 'geojson': None}
+        with self._lock: self._entries[tech] = entry
+        return entry
+
+    def _build(self, Model):
+        ids, meta, lat, lon, azi, bw, radius = [], [], [], [], [], [], []
+        for rid, cell, site, la, lo, az, freq in db.session.query(Model.id, Model.cell_code, Model.site_code, Model.latitude, Model.longitude, Model.azimuth, Model.frequency):
+            try: la, lo = float(la), float(lo)
+            except (TypeError, ValueError): continue
+            if not (8 <= la <= 24 and 102 <= lo <= 110): continue
+            beam, factor = sector_band(freq)
+            ids.append(rid); meta.append((cell, site, freq))
+            lat.append(la); lon.append(lo); azi.append(float(az or 0)); bw.append(beam); radius.append(round(SECTOR_BASE_RADIUS * factor, 1))
+        rings, mid = compute_sector_geometry(lat, lon, azi, bw, radius) if ids else ([], [])
+        return {'ids': ids, 'index': {rid: i for i, rid in enumerate(ids)}, 'meta': meta, 'beamwidth': bw, 'radius': radius, 'rings': rings, 'mid': mid}
+
+    def sector(self, entry, rid):
+        i = entry['index'].get(rid)
+        if i is None: return None
+        return {'ring': entry['rings'][i].tolist(), 'mid': entry['mid'][i].tolist()}
+
+    def geojson(self, tech):
+        entry = self.get(tech)
+        if entry['geojson'] is None:
+            features = [{'type': 'Feature', 'id': rid, 'geometry': {'type': 'Polygon', 'coordinates': [entry['rings'][i][:, ::-1].tolist()]},
+                         'properties': {'cell_code': cell, 'site_code': site, 'frequency': freq, 'beamwidth': entry['beamwidth'][i], 'radius': entry['radius'][i], 'mid': entry['mid'][i][::-1].tolist()}}
+                        for i, (rid, (cell, site, freq)) in enumerate(zip(entry['ids'], entry['meta']))]
+            entry['geojson'] = json.dumps({'type': 'FeatureCollection', 'base_radius': SECTOR_BASE_RADIUS, 'features': features}, separators=(',', ':'))
+        return entry['geojson']
+
+sector_cache = SectorGeometryCache()
+
+# ==============================================================================
+# 3h. RF GEOMETRY ANALYSIS (OVERSHOOT / ĐỐI ĐẦU / CHỒNG LẤN)
+# ==============================================================================
+
+# Cặp sector được lấy qua lưới ô vuông cạnh RF_ANALYSIS_RADIUS (chỉ so với 9 ô lân cận, không so mọi cặp) và tính khoảng cách/
+# phương vị bằng NumPy theo lô; kết quả lưu vào rf_sector_issue và chỉ tính lại khi version bảng RF đổi.
+RF_ANALYSIS_RADIUS = float(os.environ.get('RF_ANALYSIS_RADIUS', 3000))
+RF_OVERSHOOT_RATIO = float(os.environ.get('RF_OVERSHOOT_RATIO', 1.5))
+RF_PAIR_BATCH = 1000000
+RF_ISSUE_PAGE = 500
+RF_ISSUE_LABELS = {'overshoot': 'Overshoot', 'facing': 'Đối đầu', 'overlap': 'Chồng lấn'}
+RF_ISSUE_ACTIONS = {'overshoot': 'Tăng tilt / giảm độ cao anten', 'facing': 'Xoay azimuth tách hướng hai cell', 'overlap': 'Chỉnh tilt/azimuth giảm vùng chồng lấn'}
+
+def sector_band_key(frequency):
+    f = str(frequency or '').upper()
+    return next((key for key, bw, factor in SECTOR_BANDS if key in f), f)
+
+def angle_diff(a, b):
+    return abs((a - b + 180) % 360 - 180)
+
+def pair_offsets(lat, lon, i, j, lat2=None, lon2=None):
+    # Độ lệch (m) từ điểm i tới điểm j (của lat2/lon2, mặc định cùng tập) theo trục đông (dx) và bắc (dy); hệ số kinh độ lấy theo vĩ độ trung bình của cặp
+    import numpy as np
+    if lat2 is None: lat2, lon2 = lat, lon
+    return (lon2[j] - lon[i]) * 111320.0 * np.cos(np.radians((lat[i] + lat2[j]) / 2)), (lat2[j] - lat[i]) * 111320.0
+
+def grid_pair_batches(lat, lon, radius, q_lat=None, q_lon=None, batch=RF_PAIR_BATCH):
+    """Sinh các lô (i, j) với j là điểm (lat, lon) nằm cùng ô lưới hoặc 8 ô kề với điểm truy vấn i (ô cạnh >= radius).
+    Không truyền q_lat/q_lon thì truy vấn chính tập điểm và chỉ giữ i < j (mỗi cặp một lần)."""
+    import numpy as np
+    self_pairs = q_lat is None
+    if self_pairs: q_lat, q_lon = lat, lon
+    n = len(q_lat)
+    if not n or not len(lat): return
+    all_lat, all_lon = np.concatenate([lat, q_lat]), np.concatenate([lon, q_lon])
+    lat_step = radius / 111320.0
+    lon_step = radius / (111320.0 * math.cos(math.radians(float(np.abs(all_lat).max()))))
+    y0, x0 = np.floor(all_lat.min() / lat_step), np.floor(all_lon.min() / lon_step)
+    width = int(np.floor(all_lon.max() / lon_step) - x0) + 3
+    def grid_key(la, lo): return (np.floor(la / lat_step) - y0 + 1).astype(np.int64) * width + (np.floor(lo / lon_step) - x0 + 1).astype(np.int64)
+    key, q_key = grid_key(lat, lon), grid_key(q_lat, q_lon)
+    order = np.argsort(key, kind='stable')
+    sorted_key = key[order]
+    for dy, dx in itertools.product((-1, 0, 1), repeat=2):
+        target = q_key + dy * width + dx
+        start = np.searchsorted(sorted_key, target, 'left')
+        counts = np.searchsorted(sorted_key, target, 'right') - start
+        ends = np.cumsum(counts)
+        lo = 0
+        while lo < n:
+            hi = max(int(np.searchsorted(ends, ends[lo] - counts[lo] + batch, 'right')), lo + 1)
+            c = counts[lo:hi]
+            total = int(c.sum())
+            if total:
+                i = np.repeat(np.arange(lo, hi), c)
+                j = order[np.arange(total) - np.repeat(np.cumsum(c) - c, c) + np.repeat(start[lo:hi], c)]
+                if self_pairs: i, j = i[i < j], j[i < j]
+                yield i, j
+            lo = hi
+
+def analyze_rf_sectors(sectors, radius=RF_ANALYSIS_RADIUS, overshoot_ratio=RF_OVERSHOOT_RATIO):
+    """sectors: dict các mảng cell/site/lat/lon/azimuth/beamwidth/band/tilt/height. Trả về (danh sách vấn đề, số cặp trong bán kính).
+
+    - overshoot: tầm chạm đất của búp chính (độ cao / tan(tilt)) vượt quá RF_OVERSHOOT_RATIO lần khoảng cách tới trạm gần nhất nằm trong búp sóng
+    - facing: hai cell cùng băng chiếu vào nhau và tổng tầm phủ vượt khoảng cách giữa hai trạm
+    - overlap: cell cùng băng, cùng hướng nằm trong búp sóng và trong tầm phủ của cell kia
+    """
+    import numpy as np
+    lat, lon, azi = sectors['lat'], sectors['lon'], sectors['azimuth']
+    n = len(lat)
+    if not n: return [], 0
+    half_bw = sectors['beamwidth'] / 2.0
+    tilt, height = sectors['tilt'], sectors['height']
+    known = (height > 0) & ~np.isnan(tilt)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        reach = np.where(known & (tilt > 0), height / np.tan(np.radians(tilt)), radius)
+    reach = np.minimum(np.nan_to_num(reach, nan=radius), radius)
+    site_ids = np.unique(sectors['site'], return_inverse=True)[1]
+    band_ids = np.unique(sectors['band'], return_inverse=True)[1]
+    near_d, near_j = np.full(n, np.inf), np.full(n, -1)
+    issues, pair_count = [], 0
+    for i, j in grid_pair_batches(lat, lon, radius):
+        other_site = site_ids[i] != site_ids[j]
+        i, j = i[other_site], j[other_site]
+        dx, dy = pair_offsets(lat, lon, i, j)
+        d = np.hypot(dx, dy)
+        close = (d <= radius) & (d >= 1)
+        i, j, d, dx, dy = i[close], j[close], d[close], dx[close], dy[close]
+        pair_count += len(i)
+        bearing = np.degrees(np.arctan2(dx, dy)) % 360
+        in_i = angle_diff(azi[i], bearing) <= half_bw[i]
+        in_j = angle_diff(azi[j], (bearing + 180) % 360) <= half_bw[j]
+        # Trạm gần nhất trong búp sóng của từng sector (cho overshoot)
+        a = np.concatenate([i[in_i], j[in_j]]); b = np.concatenate([j[in_i], i[in_j]]); dd = np.concatenate([d[in_i], d[in_j]])
+        if len(a):
+            order = np.lexsort((dd, a))
+            a, b, dd = a[order], b[order], dd[order]
+            first = np.r_[True, a[1:] != a[:-1]]
+            a, b, dd = a[first], b[first], dd[first]
+            better = dd < near_d[a]
+            near_d[a[better]], near_j[a[better]] = dd[better], b[better]
+        same_band = band_ids[i] == band_ids[j]
+        facing = same_band & in_i & in_j & (d < reach[i] + reach[j])
+        same_dir = angle_diff(azi[i], azi[j]) <= np.minimum(half_bw[i], half_bw[j])
+        over_ij = same_band & ~facing & same_dir & in_i & (d < reach[i])
+        over_ji = same_band & ~facing & same_dir & in_j & (d < reach[j])
+        for kind, src, dst, mask in (('facing', i, j, facing), ('overlap', i, j, over_ij), ('overlap', j, i, over_ji)):
+            for x, y, dist in zip(src[mask].tolist(), dst[mask].tolist(), d[mask].tolist()):
+                issues.append((kind, x, y, dist))
+    flagged = known & (near_j >= 0) & (reach > overshoot_ratio * near_d)
+    for x in np.flatnonzero(flagged).tolist(): issues.append(('overshoot', x, int(near_j[x]), float(near_d[x])))
+    out = []
+    for kind, x, y, dist in issues:
+        if kind == 'overshoot': detail = f"Tilt {tilt[x]:g}°, cao {height[x]:g} m → tầm phủ ~{reach[x]:.0f} m; trạm gần nhất trong búp sóng ({sectors['cell'][y]}) cách {dist:.0f} m"
+        elif kind == 'facing': detail = f"Azimuth {azi[x]:g}° ↔ {azi[y]:g}°, cùng băng {sectors['band'][x]}, cách {dist:.0f} m"
+        else: detail = f"{sectors['cell'][y]} cùng hướng ({azi[x]:g}°/{azi[y]:g}°) nằm trong tầm phủ ~{reach[x]:.0f} m, cách {dist:.0f} m"
+        out.append({'issue': kind, 'index': x, 'other': y, 'distance': round(dist, 1), 'reach': round(float(reach[x]), 1), 'detail': detail})
+    return out, pair_count
+
+def load_rf_sectors(Model, *filters):
+    import numpy as np
+    cols = {k: [] for k in ('cell', 'site', 'lat', 'lon', 'azimuth', 'beamwidth', 'band', 'tilt', 'height')}
+    for cell, site, la, lo, az, freq, total_tilt, m_t, e_t, height in db.session.query(Model.cell_code, Model.site_code, Model.latitude, Model.longitude, Model.azimuth, Model.frequency, Model.total_tilt, Model.m_t, Model.e_t, Model.anten_height).filter(*filters):
+        try: la, lo = float(la), float(lo)
+        except (TypeError, ValueError): continue
+        if not (8 <= la <= 24 and 102 <= lo <= 110) or az is None: continue
+        if total_tilt is None and (m_t is not None or e_t is not None): total_tilt = (m_t or 0) + (e_t or 0)
+        cols['cell'].append(cell); cols['site'].append(site or cell or ''); cols['lat'].append(la); cols['lon'].append(lo); cols['azimuth'].append(float(az) % 360)
+        cols['beamwidth'].append(sector_band(freq)[0]); cols['band'].append(sector_band_key(freq))
+        cols['tilt'].append(np.nan if total_tilt is None else float(total_tilt)); cols['height'].append(float(height or 0))
+    return {k: (np.asarray(v, dtype=float) if k not in ('cell', 'site', 'band') else np.asarray(v, dtype=object)) for k, v in cols.items()}
+
+def refresh_rf_analysis(tech):
+    Model = RF_MODELS[tech]
+    version = db.session.query(DataVersion.version).filter_by(table_name=Model.__tablename__).scalar()
+    sectors = load_rf_sectors(Model)
+    issues, pairs = analyze_rf_sectors(sectors)
+    db.session.query(RFSectorIssue).filter(RFSectorIssue.tech == tech).delete()
+    rows = rf_issue_rows(tech, sectors, issues)
+    if rows: db.session.bulk_insert_mappings(RFSectorIssue, rows)
+    state = RFAnalysis.query.filter_by(tech=tech).first() or RFAnalysis(tech=tech)
+    state.rf_version, state.sectors, state.pairs, state.computed_at = version, len(sectors['cell']), pairs, datetime.utcnow()
+    db.session.add(state)
+    db.session.commit()
+    return state
+
+def rf_issue_rows(tech, sectors, issues):
+    cells, sites = sectors['cell'], sectors['site']
+    return [{'tech': tech, 'issue': r['issue'], 'cell_code': cells[r['index']], 'cell_key': normalize_cell_key(cells[r['index']]), 'site_code': sites[r['index']],
+             'other_cell': cells[r['other']], 'other_key': normalize_cell_key(cells[r['other']]), 'distance': r['distance'], 'reach': r['reach'], 'detail': r['detail']} for r in issues]
+
+def update_rf_cell(tech, rid, old_keys, old_points, prev_version):
+    """Sau rf_add/rf_edit/rf_delete: chỉ phân tích lại các sector trong bán kính quanh vị trí cũ/mới của cell (kết quả của chúng có thể đổi),
+    với ngữ cảnh là các sector trong 2 lần bán kính. Kết quả đang lưu phải ứng với version RF ngay trước lần sửa; nếu không, tính lại toàn bộ.
+    Số sector/cặp hiển thị giữ theo lần tính toàn bộ gần nhất."""
+    import numpy as np
+    state = RFAnalysis.query.filter_by(tech=tech).first()
+    if not state or state.rf_version != prev_version: return refresh_rf_analysis(tech)
+    Model = RF_MODELS[tech]
+    obj = db.session.get(Model, rid)
+    points = []
+    for la, lo in list(old_points) + ([(obj.latitude, obj.longitude)] if obj else []):
+        try: la, lo = float(la), float(lo)
+        except (TypeError, ValueError): continue
+        if 8 <= la <= 24 and 102 <= lo <= 110: points.append((la, lo))
+    keys = {k for k in old_keys if k}
+    if points:
+        radius = RF_ANALYSIS_RADIUS
+        boxes = [and_(Model.latitude.between(la - 2 * radius / 111320.0, la + 2 * radius / 111320.0),
+                      Model.longitude.between(lo - 2 * radius / (111320.0 * math.cos(math.radians(la))), lo + 2 * radius / (111320.0 * math.cos(math.radians(la)))))
+                 for la, lo in points]
+        sectors = load_rf_sectors(Model, or_(*boxes))
+        issues, _ = analyze_rf_sectors(sectors)
+        # Sector bị ảnh hưởng: trong bán kính quanh vị trí cũ/mới của cell vừa sửa
+        affected = np.zeros(len(sectors['cell']), dtype=bool)
+        for la, lo in points:
+            dx, dy = (sectors['lon'] - lo) * 111320.0 * np.cos(np.radians((sectors['lat'] + la) / 2)), (sectors['lat'] - la) * 111320.0
+            affected |= np.hypot(dx, dy) <= radius
+        keys |= {normalize_cell_key(c) for c in sectors['cell'][affected]}
+        # Overshoot phụ thuộc mọi trạm quanh sector nên chỉ lấy của sector bị ảnh hưởng; cặp đối đầu/chồng lấn lấy khi một đầu bị ảnh hưởng
+        issues = [r for r in issues if affected[r['index']] or (r['issue'] != 'overshoot' and affected[r['other']])]
+    else: sectors, issues = None, []
+    if keys: db.session.query(RFSectorIssue).filter(RFSectorIssue.tech == tech, or_(RFSectorIssue.cell_key.in_(keys), and_(RFSectorIssue.issue != 'overshoot', RFSectorIssue.other_key.in_(keys)))).delete(synchronize_session=False)
+    rows = rf_issue_rows(tech, sectors, issues) if issues else []
+    if rows: db.session.bulk_insert_mappings(RFSectorIssue, rows)
+    state.rf_version = rf_version(tech)
+    db.session.commit()
+    return state
+
+def get_rf_analysis(tech):
+    # Chỉ đọc kết quả đã lưu (trang xem chạy trên read replica); các đường ghi RF và `flask rf-analysis` mới tính lại
+    return RFAnalysis.query.filter_by(tech=tech).first()
+
+@app.cli.command('rf-analysis')
+@click.option('--tech', type=click.Choice(['3g', '4g', '5g', 'all']), default='all', show_default=True)
+def rf_analysis_command(tech):
+    """Tính lại phân tích overshoot/đối đầu/chồng lấn từ bảng RF (import/sửa/reset/restore RF tự tính lại)."""
+    for t in (RF_MODELS if tech == 'all' else [tech]):
+        t0 = time.perf_counter()
+        state = refresh_rf_analysis(t)
+        print(f"--> rf_analysis {t.upper()}: {state.sectors} sector, {state.pairs} cặp, {RFSectorIssue.query.filter_by(tech=t).count()} vấn đề ({time.perf_counter() - t0:.1f}s)")
+
+# ==============================================================================
+# 3i. PCI COLLISION / CONFUSION
+# ==============================================================================
+
+# Cùng lớp tần số (ARFCN, thiếu thì theo băng tần): trùng PCI trong PCI_COLLISION_DISTANCE là collision; khác PCI nhưng trùng
+# PCI mod 30 / mod 3 trong PCI_NEIGHBOR_DISTANCE (kể cả các cell cùng trạm) là confusion. Mỗi cặp chỉ ghi loại nặng nhất.
+PCI_COLLISION_DISTANCE = float(os.environ.get('PCI_COLLISION_DISTANCE', 5000))
+PCI_NEIGHBOR_DISTANCE = float(os.environ.get('PCI_NEIGHBOR_DISTANCE', 1500))
+PCI_TECHS = {'4g': (RF4G, 'dl_uarfcn'), '5g': (RF5G, 'nrarfcn')}
+PCI_KIND_LABELS = {'collision': 'Trùng PCI', 'mod30': 'Trùng PCI mod 30', 'mod3': 'Trùng PCI mod 3'}
+PCI_PAGE = 1000
+
+def load_pci_cells(tech, *filters):
+    import numpy as np
+    Model, layer_col = PCI_TECHS[tech]
+    cols = {k: [] for k in ('id', 'cell', 'site', 'lat', 'lon', 'pci', 'layer')}
+    for rid, cell, site, la, lo, pci, layer, freq in db.session.query(Model.id, Model.cell_code, Model.site_code, Model.latitude, Model.longitude, Model.pci, getattr(Model, layer_col), Model.frequency).filter(*filters):
+        try: la, lo, pci = float(la), float(lo), int(float(pci))
+        except (TypeError, ValueError): continue
+        if not (8 <= la <= 24 and 102 <= lo <= 110): continue
+        cols['id'].append(rid); cols['cell'].append(cell); cols['site'].append(site or ''); cols['lat'].append(la); cols['lon'].append(lo); cols['pci'].append(pci)
+        cols['layer'].append(str(layer or '').strip() or sector_band_key(freq))
+    return {k: np.asarray(v, dtype={'id': np.int64, 'pci': np.int64, 'lat': float, 'lon': float}.get(k, object)) for k, v in cols.items()}
+
+def classify_pci_pairs(cells, i, j):
+    """Trả về (kind, i, j, distance) cho các cặp (i, j) cùng lớp tần số có xung đột PCI."""
+    import numpy as np
+    i, j = i[cells['layer'][i] == cells['layer'][j]], j[cells['layer'][i] == cells['layer'][j]]
+    d = np.hypot(*pair_offsets(cells['lat'], cells['lon'], i, j))
+    pi, pj = cells['pci'][i], cells['pci'][j]
+    near = d <= PCI_NEIGHBOR_DISTANCE
+    kinds = [('collision', (pi == pj) & (d <= PCI_COLLISION_DISTANCE)), ('mod30', near & (pi != pj) & (pi % 30 == pj % 30)), ('mod3', near & (pi % 30 != pj % 30) & (pi % 3 == pj % 3))]
+    return [(kind, x, y, dist) for kind, mask in kinds for x, y, dist in zip(i[mask].tolist(), j[mask].tolist(), d[mask].tolist())]
+
+def pci_conflict_rows(tech, cells, conflicts):
+    return [{'tech': tech, 'kind': kind, 'layer': cells['layer'][x], 'cell_code': cells['cell'][x], 'cell_key': normalize_cell_key(cells['cell'][x]), 'site_code': cells['site'][x], 'pci': int(cells['pci'][x]),
+             'other_cell': cells['cell'][y], 'other_key': normalize_cell_key(cells['cell'][y]), 'other_site': cells['site'][y], 'other_pci': int(cells['pci'][y]), 'distance': round(dist, 1)} for kind, x, y, dist in conflicts]
+
+def set_pci_state(tech, version):
+    state = PCICheck.query.filter_by(tech=tech).first() or PCICheck(tech=tech)
+    state.rf_version, state.computed_at = version, datetime.utcnow()
+    db.session.add(state)
+    db.session.commit()
+    return state
+
+def rf_version(tech):
+    return db.session.query(DataVersion.version).filter_by(table_name=RF_MODELS[tech].__tablename__).scalar()
+
+def refresh_pci_conflicts(tech):
+    version = rf_version(tech)
+    cells = load_pci_cells(tech)
+    conflicts = []
+    if len(cells['id']):
+        for i, j in grid_pair_batches(cells['lat'], cells['lon'], max(PCI_COLLISION_DISTANCE, PCI_NEIGHBOR_DISTANCE)): conflicts += classify_pci_pairs(cells, i, j)
+    db.session.query(PCIConflict).filter(PCIConflict.tech == tech).delete()
+    rows = pci_conflict_rows(tech, cells, conflicts)
+    if rows: db.session.bulk_insert_mappings(PCIConflict, rows)
+    return set_pci_state(tech, version)
+
+def get_pci_conflicts(tech):
+    return PCICheck.query.filter_by(tech=tech).first()
+
+def rf_stale(state, tech):
+    # Kết quả RF/PCI đã lưu chưa có hoặc tính từ version RF cũ
+    return not state or state.rf_version != rf_version(tech)
+
+def refresh_rf_derived(*techs):
+    """Sau khi bảng RF đổi cả loạt (import/reset/restore): tính lại phân tích RF và bảng PCI ngay trong request ghi."""
+    for t in techs:
+        refresh_rf_analysis(t)
+        if t in PCI_TECHS: refresh_pci_conflicts(t)
+
+def update_pci_cell(tech, rid, old_keys, prev_version):
+    """Sau rf_add/rf_edit/rf_delete: bỏ các cặp cũ của cell rồi chỉ so cell đó (nếu còn) với các cell trong bán kính.
+    Kết quả đang lưu phải ứng với version RF ngay trước lần sửa; nếu không, tính lại toàn bộ."""
+    import numpy as np
+    if tech not in PCI_TECHS: return
+    state = PCICheck.query.filter_by(tech=tech).first()
+    if not state or state.rf_version != prev_version: return refresh_pci_conflicts(tech)
+    Model = PCI_TECHS[tech][0]
+    target = load_pci_cells(tech, Model.id == rid)
+    keys = {k for k in old_keys if k} | {normalize_cell_key(c) for c in target['cell']}
+    if keys: db.session.query(PCIConflict).filter(PCIConflict.tech == tech, or_(PCIConflict.cell_key.in_(keys), PCIConflict.other_key.in_(keys))).delete(synchronize_session=False)
+    if len(target['id']):
+        radius = max(PCI_COLLISION_DISTANCE, PCI_NEIGHBOR_DISTANCE)
+        la, lo = float(target['lat'][0]), float(target['lon'][0])
+        dlat, dlon = radius / 111320.0, radius / (111320.0 * math.cos(math.radians(la)))
+        cells = load_pci_cells(tech, Model.id != rid, Model.latitude.between(la - dlat, la + dlat), Model.longitude.between(lo - dlon, lo + dlon))
+        cells = {k: np.concatenate([target[k], cells[k]]) for k in cells}
+        others = np.arange(1, len(cells['id']))
+        rows = pci_conflict_rows(tech, cells, classify_pci_pairs(cells, np.zeros(len(others), dtype=np.int64), others))
+        if rows: db.session.bulk_insert_mappings(PCIConflict, rows)
+    set_pci_state(tech, rf_version(tech))
+
+def pci_query(tech):
+    # Collision trước, rồi mod 30, mod 3; trong cùng loại cặp gần nhau trước
+    severity = case({k: i for i, k in enumerate(PCI_KIND_LABELS)}, value=PCIConflict.kind, else_=len(PCI_KIND_LABELS))
+    return PCIConflict.query.filter(PCIConflict.tech == tech).order_by(severity, PCIConflict.distance, PCIConflict.id)
+
+@app.cli.command('pci-check')
+@click.option('--tech', type=click.Choice(['4g', '5g', 'all']), default='all', show_default=True)
+def pci_check_command(tech):
+    """Tính lại toàn bộ bảng xung đột PCI (import/sửa/reset/restore RF tự tính lại)."""
+    for t in (PCI_TECHS if tech == 'all' else [tech]):
+        t0 = time.perf_counter()
+        refresh_pci_conflicts(t)
+        print(f"--> pci_check {t.upper()}: {PCIConflict.query.filter_by(tech=t).count()} xung đột ({time.perf_counter() - t0:.1f}s)")
+
+# ==============================================================================
+# 3j. ITS DRIVE-TEST ASSOCIATION
+# ==============================================================================
+
+# Mẫu đo ITS được gán cell phục vụ theo ID (eNodeB_LCRID / CI / gNodeB_LCRID); mẫu không khớp ID lấy sector gần nhất trong
+# ITS_NEAREST_RADIUS. Thống kê vùng phủ theo cell (số mẫu, level TB/P10/P50, % dưới ngưỡng, khoảng cách tới trạm) tính theo cột.
+ITS_NEAREST_RADIUS = float(os.environ.get('ITS_NEAREST_RADIUS', 3000))
+ITS_LEVEL_THRESHOLDS = {'3g': -95, '4g': -105, '5g': -105}
+ITS_TECH_NAMES = {'3g': ('3G', 'WCDMA', 'HSPA', 'UMTS'), '4g': ('4G', 'LTE'), '5g': ('5G', 'NR')}
+ITS_ID_COLUMNS = {'3g': (None, 'ci'), '4g': ('enodeb_id', 'lcrid'), '5g': ('gnodeb_id', 'lcrid')}
+
+def clean_cell_id(v):
+    if v is None: return None
+    s = str(v).strip()
+    if s == '-' or s == '' or s.lower() in ['nan', 'null', 'none']: return None
+    try:
+        f = float(s)
+        if f.is_integer(): return str(int(f))
+        return str(f)
+    except ValueError: return s.upper()
+
+def its_sample_id(tech, node, cell):
+    # Khóa ID của mẫu theo cùng quy ước với load_its_cells: node_cell cho 4G/5G, CI cho 3G
+    if tech == '3g': return cell or ''
+    return f"{node}_{cell}" if node and cell else ''
+
+def load_its_cells(tech):
+    import numpy as np
+    Model = RF_MODELS[tech]
+    node_col, cell_col = ITS_ID_COLUMNS[tech]
+    cols = {k: [] for k in ('cell', 'site', 'lat', 'lon', 'azimuth', 'ident')}
+    node_attr = getattr(Model, node_col) if node_col else literal(None)
+    for cell, site, la, lo, az, node, cid in db.session.query(Model.cell_code, Model.site_code, Model.latitude, Model.longitude, Model.azimuth, node_attr, getattr(Model, cell_col)):
+        try: la, lo = float(la), float(lo)
+        except (TypeError, ValueError): continue
+        if not (8 <= la <= 24 and 102 <= lo <= 110): continue
+        cols['cell'].append(cell); cols['site'].append(site); cols['lat'].append(la); cols['lon'].append(lo); cols['azimuth'].append(float(az or 0) % 360)
+        cols['ident'].append(its_sample_id(tech, clean_cell_id(node), clean_cell_id(cid)))
+    return {k: np.asarray(v, dtype=float if k in ('lat', 'lon', 'azimuth') else object) for k, v in cols.items()}
+
+def associate_its_samples(tech, lat, lon, ident, radius=ITS_NEAREST_RADIUS):
+    """Trả về (cells, serving, by_id): serving[k] là chỉ số cell phục vụ mẫu k (-1 nếu không gán được), by_id đánh dấu mẫu khớp theo ID.
+    Mẫu không khớp ID: chọn trạm gần nhất trong bán kính, trong trạm đó chọn sector có azimuth hướng về mẫu nhất."""
+    import numpy as np
+    cells = load_its_cells(tech)
+    n = len(lat)
+    by_index = {}
+    for k, key in enumerate(cells['ident']):
+        if key: by_index.setdefault(key, k)
+    uniq, inverse = np.unique(ident, return_inverse=True)
+    serving = np.array([by_index.get(key, -1) for key in uniq], dtype=np.int64)[inverse] if n else np.zeros(0, dtype=np.int64)
+    by_id = serving >= 0
+    rest = np.flatnonzero(~by_id)
+    if len(rest) and len(cells['cell']):
+        best = np.full(len(rest), np.inf)
+        for qi, j in grid_pair_batches(cells['lat'], cells['lon'], radius, lat[rest], lon[rest]):
+            dx, dy = pair_offsets(lat[rest], lon[rest], qi, j, cells['lat'], cells['lon'])
+            d = np.hypot(dx, dy)
+            # Điểm = khoảng cách làm tròn 10 m (các cell cùng trạm bằng nhau) * 1000 + độ lệch azimuth so với hướng trạm -> mẫu
+            score = np.round(d / 10) * 1000 + angle_diff(cells['azimuth'][j], np.degrees(np.arctan2(-dx, -dy)) % 360)
+            ok = d <= radius
+            qi, j, score = qi[ok], j[ok], score[ok]
+            if not len(qi): continue
+            order = np.lexsort((score, qi))
+            qi, j, score = qi[order], j[order], score[order]
+            first = np.r_[True, qi[1:] != qi[:-1]]
+            qi, j, score = qi[first], j[first], score[first]
+            better = score < best[qi]
+            best[qi[better]] = score[better]
+            serving[rest[qi[better]]] = j[better]
+    return cells, serving, by_id
+
+def its_cell_stats(tech, cells, serving, by_id, lat, lon, level):
+    """Thống kê vùng phủ theo cell phục vụ; trả về (danh sách dòng theo số mẫu giảm dần, tổng hợp)."""
+    import numpy as np, pandas as pd
+    ok = serving >= 0
+    idx = serving[ok]
+    d = np.hypot(*pair_offsets(cells['lat'], cells['lon'], idx, np.flatnonzero(ok), lat, lon)) if len(idx) else np.zeros(0)
+    lvl = level[ok]
+    threshold = ITS_LEVEL_THRESHOLDS[tech]
+    df = pd.DataFrame({'cell': idx, 'level': lvl, 'below': np.where(np.isnan(lvl), np.nan, lvl < threshold), 'dist': d, 'by_id': by_id[ok]})
+    summary = {'samples': len(serving), 'by_id': int(by_id.sum()), 'nearest': int(ok.sum() - by_id.sum()), 'unmatched': int((~ok).sum()), 'threshold': threshold, 'radius': ITS_NEAREST_RADIUS}
+    if df.empty: return [], summary
+    groups = df.groupby('cell')
+    stats = groups.agg(samples=('level', 'size'), by_id=('by_id', 'sum'), level_mean=('level', 'mean'), below=('below', 'mean'), dist_mean=('dist', 'mean'), dist_max=('dist', 'max'))
+    stats = stats.join(groups['level'].quantile([0.1, 0.5]).unstack().rename(columns={0.1: 'p10', 0.5: 'p50'})).sort_values('samples', ascending=False)
+    def num(v, digits=1): return None if pd.isna(v) else round(float(v), digits)
+    rows = [{'cell_code': cells['cell'][k], 'site_code': cells['site'][k], 'lat': float(cells['lat'][k]), 'lon': float(cells['lon'][k]), 'samples': int(r.samples), 'by_id': int(r.by_id),
+             'level_mean': num(r.level_mean), 'p10': num(r.p10), 'p50': num(r.p50), 'below_pct': num(r.below * 100 if not pd.isna(r.below) else None), 'dist_mean': num(r.dist_mean, 0), 'dist_max': num(r.dist_max, 0)}
+            for k, r in zip(stats.index.tolist(), stats.itertuples())]
+    return rows, summary
+
+# ==============================================================================
+# 3k. IMPORT PARSING (PROCESS POOL)
+# ==============================================================================
+# Đọc file + dò header + ép kiểu chạy trong process con; ghi DB vẫn tuần tự ở request (một writer duy nhất)
+# Loại import (trường 'type' của form) -> bảng đích; RF 3G nhập thẳng vào RF3G
+IMPORT_MODELS = {'3g': RF3G, '4g': RF4G, '5g': RF5G, 'kpi3g': KPI3G, 'kpi4g': KPI4G, 'kpi5g': KPI5G, 'poi4g': POI4G, 'poi5g': POI5G}
+# Mặc định tối đa 2 process con: mỗi worker giữ một file đã parse trong RAM, cùng máy với các worker web
+IMPORT_WORKERS = int(os.environ.get('IMPORT_WORKERS', min(2, os.cpu_count() or 1)))
+IMPORT_HEADER_KEYWORDS = ['cell', 'site', 'tram', 'uarfcn', 'he thong', 'quan ly', 'thiet bi', 'lat', 'long', 'stt', 'node', 'bsc', 'rnc', 'azimuth', 'tilt', 'power', 'gain', 'csht']
+NULL_TOKENS = ['', '-', 'nan', 'none', 'n/a', 'null', '?']
+
+IMPORT_CHUNK_ROWS = int(os.environ.get('IMPORT_CHUNK_ROWS', 10000))
+# Chuỗi pandas.read_excel mặc định coi là NaN, cộng mã lỗi công thức Excel
+EXCEL_NA_VALUES = {'', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null', '#NULL!', '#DIV/0!', '#VALUE!', '#REF!', '#NAME?', '#NUM!'}
+
+def xlsx_cell_str(v):
+    # Giống read_excel(dtype=str): số nguyên dạng float -> '5', ô trống/lỗi -> None
+    if v is None: return None
+    if isinstance(v, str): return None if v in EXCEL_NA_VALUES else v
+    if isinstance(v, float) and v.is_integer(): return str(int(v))
+    return str(v)
+
+def iter_xlsx_rows(file_bytes):
+    """Đọc sheet đầu tiên bằng openpyxl read_only/iter_rows, sinh từng dòng (list chuỗi/None), bỏ dòng trống."""
+    from openpyxl import load_workbook
+    wb = load_workbook(BytesIO(file_bytes), read_only=True, data_only=True, keep_links=False)
+    try:
+        ws = wb.worksheets[0]
+        # File xuất từ OSS hay khai báo sai dimension: đọc theo dữ liệu thật
+        ws.reset_dimensions()
+        for row in ws.iter_rows(values_only=True):
+            vals = [xlsx_cell_str(v) for v in row]
+            if any(v is not None for v in vals): yield vals
+    finally: wb.close()
+
+def read_import_frame(filename, file_bytes):
+    import pandas as pd
+    if filename.lower().endswith('.csv'):
+        sample = file_bytes[:4096].decode('utf-8-sig', errors='ignore')
+        first_line = sample.split('\n')[0] if '\n' in sample else sample
+        sep = ',' if first_line.count(',') >= first_line.count(';') else ';'
+        df = pd.read_csv(BytesIO(file_bytes), encoding='utf-8-sig', on_bad_lines='skip', sep=sep, header=None, dtype=str, low_memory=False, engine='c')
+    else:
+        df = pd.DataFrame(list(iter_xlsx_rows(file_bytes)), dtype=object)
+    df.dropna(how='all', inplace=True)
+    df.dropna(axis=1, how='all', inplace=True)
+    return df.reset_index(drop=True)
+
+def import_header(head):
+    """Dò dòng header trong tối đa 20 dòng đầu theo từ khóa. Trả về (vị trí dòng header, tên cột theo vị trí)."""
+    import pandas as pd
+    header_idx = 0
+    max_matches = 0
+    for i in range(min(20, len(head))):
+        row_vals = [remove_accents(str(v)).lower() for v in head.iloc[i].values if pd.notna(v)]
+        matches = sum(1 for k in IMPORT_HEADER_KEYWORDS if any(k in val for val in row_vals))
+        if matches > max_matches:
+            max_matches = matches
+            header_idx = i
+    if max_matches == 0: return 0, ['nan' if pd.isna(c) else str(c) for c in head.iloc[0].values] if len(head) else []
+
+    raw_cols = ['nan' if pd.isna(c) else str(c).strip() for c in head.iloc[header_idx].values]
+    seen = {}
+    for j, c in enumerate(raw_cols):
+        if c in seen:
+            seen[c] += 1
+            raw_cols[j] = f"{c}_{seen[c]}"
+        else: seen[c] = 0
+    return header_idx, raw_cols
+
+def unique_map(values, fn):
+    """Áp fn một lần cho mỗi giá trị khác nhau của mảng (factorize) rồi trải lại theo vị trí; NaN/None -> fn(None). Trả về mảng object."""
+    import pandas as pd, numpy as np
+    codes, uniques = pd.factorize(values, use_na_sentinel=True)
+    out = np.empty(len(uniques) + 1, dtype=object)
+    out[:-1] = [fn(u) for u in uniques]
+    out[-1] = fn(None)
+    return out[codes]
+
+def clean_text(value):
+    if value is None: return None
+    s = str(value).strip()
+    return None if s.lower() in NULL_TOKENS else s
+
+def coerce_import_chunk(df_valid, float_cols, int_cols, key_col):
+    """Ép kiểu một chunk thành các mảng cột (numpy object: int/float/str Python, NULL là None), đã bỏ dòng không có khóa và thêm cell_key."""
+    import pandas as pd, numpy as np
+    data = {}
+    for c in df_valid.columns:
+        if c in float_cols or c in int_cols:
+            v = pd.to_numeric(df_valid[c].astype(str).str.replace(',', '.', regex=False).str.replace(' ', '', regex=False), errors='coerce').to_numpy(dtype=float)
+            ok = np.isfinite(v) if c in int_cols else ~np.isnan(v)
+            col = np.full(len(v), None, dtype=object)
+            col[ok] = (np.floor(v[ok]).astype(np.int64) if c in int_cols else v[ok]).astype(object)
+            data[c] = col
+        else: data[c] = unique_map(df_valid[c].to_numpy(dtype=object), clean_text)
+
+    if 'cell_code' not in data:
+        if 'cell_name' in data: data['cell_code'] = data['cell_name']
+        elif 'site_code' in data: data['cell_code'] = data['site_code']
+    if key_col not in data: return {}
+
+    # Cột khóa đã strip và NULL hóa ở trên: chỉ còn bỏ dòng rỗng rồi tính cell_key ngay trong worker
+    keep = pd.notna(data[key_col])
+    if not keep.all(): data = {c: v[keep] for c, v in data.items()}
+    data['cell_key'] = unique_map(data[key_col], normalize_cell_key)
+    return data
+
+def iter_import_chunks(itype, filename, file_bytes):
+    """Parse một file RF/KPI/POI thành các chunk mảng cột đã ép kiểu theo model, sinh (dict cột -> mảng, cột gốc, cột khóa); None nếu không có cột nào khớp.
+    CSV đọc một lần bằng pandas; XLSX đọc streaming: dò header trên 20 dòng đầu rồi ép kiểu từng IMPORT_CHUNK_ROWS dòng, bộ nhớ không phụ thuộc kích thước file."""
+    import pandas as pd
+    Model = IMPORT_MODELS[itype]
+    valid_cols = set(c.key for c in Model.__table__.columns if c.key not in INTERNAL_COLUMNS)
+    float_cols = {c.key for c in Model.__table__.columns if 'FLOAT' in str(c.type).upper()}
+    int_cols = {c.key for c in Model.__table__.columns if 'INTEGER' in str(c.type).upper() and c.key != 'id'}
+    # Bảng KPI không có cột cell_code: khóa của mỗi dòng là ten_cell
+    key_col = 'cell_code' if 'cell_code' in valid_cols else 'ten_cell'
+
+    if filename.lower().endswith('.csv'):
+        df_raw = read_import_frame(filename, file_bytes)
+        df_raw.columns = range(df_raw.shape[1])
+        header_idx, original_columns = import_header(df_raw.iloc[:20])
+        body = [df_raw.iloc[header_idx + 1:]]
+    else:
+        rows = iter_xlsx_rows(file_bytes)
+        head = list(itertools.islice(rows, 20))
+        header_idx, original_columns = import_header(pd.DataFrame(head, dtype=object))
+        def xlsx_chunks():
+            batch = head[header_idx + 1:]
+            while batch:
+                yield pd.DataFrame(batch, dtype=object)
+                batch = list(itertools.islice(rows, IMPORT_CHUNK_ROWS))
+        body = xlsx_chunks()
+
+    # Vị trí các cột giữ lại sau khi map tên (trùng tên thì lấy cột đầu tiên)
+    positions, cols = [], []
+    for j, c in enumerate(clean_header(c) for c in original_columns):
+        if c in valid_cols and c not in cols: positions.append(j); cols.append(c)
+    if not cols:
+        yield None, original_columns, key_col
+        return
+
+    empty = True
+    for chunk in body:
+        # reindex theo vị trí: dòng XLSX ngắn hơn header được bù None
+        df_valid = chunk.reindex(columns=positions)
+        df_valid.columns = cols
+        yield coerce_import_chunk(df_valid, float_cols, int_cols, key_col), original_columns, key_col
+        empty = False
+    if empty: yield {}, original_columns, key_col
+
+def insert_rows(Model, columns, rows):
+    """INSERT nhiều dòng bằng executemany với tuple tham số theo thứ tự `columns` (bỏ qua dict/ORM).
+    Chỉ driver dùng qmark (sqlite) hoặc format/pyformat (pymysql, psycopg2) đi đường tuple; paramstyle khác dùng Core insert() để dialect tự sinh placeholder."""
+    conn = db.session.connection()
+    mark = {'qmark': '?', 'format': '%s', 'pyformat': '%s'}.get(conn.dialect.paramstyle)
+    if mark is None:
+        conn.execute(Model.__table__.insert(), [dict(zip(columns, r)) for r in rows])
+        return
+    quote = conn.dialect.identifier_preparer.quote
+    conn.exec_driver_sql(f"INSERT INTO {quote(Model.__tablename__)} ({', '.join(quote(c) for c in columns)}) VALUES ({', '.join([mark] * len(columns))})", rows)
+
+def parse_import_file(itype, filename, file_bytes):
+    # Bản chạy trong process pool: gom các chunk thành list để trả về cho writer
+    return list(iter_import_chunks(itype, filename, file_bytes))
+
+def parse_qoe_file(itype, filename, file_bytes):
+    """Parse một file QoE/QoS 4G. Trả về (headers, cells, scores, percents, detail_jsons) hoặc None nếu không thấy cột Cell Name."""
+    import pandas as pd, numpy as np
+    df = read_import_frame(filename, file_bytes)
+    # Chỉ ép kiểu chuỗi cho vùng dò header, phần dữ liệu xử lý theo cột bên dưới
+    head = df.iloc[:20].astype(str)
+    header_row_idx, cell_col_idx = -1, -1
+    for i in range(len(head)):
+        row_vals = [str(v).lower().strip() for v in head.iloc[i].values]
+        for j, val in enumerate(row_vals):
+            if val in ['cell name', 'tên cell', 'cell_name']:
+                header_row_idx, cell_col_idx = i, j
+                break
+        if header_row_idx != -1: break
+    if header_row_idx == -1: return None
+
+    headers = [" - ".join([str(head.iloc[i, j]).strip() for i in range(header_row_idx + 1) if str(head.iloc[i, j]).strip() not in ['nan', 'None', '']]) or f"Col_{j}" for j in range(len(df.columns))]
+    df_data = df.iloc[header_row_idx + 1:].copy()
+    df_data.columns = headers
+    del df, head
+    df_data = df_data.loc[:, ~df_data.columns.duplicated()].copy()
+    schema_headers = list(df_data.columns)
+    cell_col_name = headers[cell_col_idx]
+    val1_col_name = headers[cell_col_idx + 2] if cell_col_idx + 2 < len(headers) else None
+    val2_col_name = headers[cell_col_idx + 3] if cell_col_idx + 3 < len(headers) else None
+
+    # Chuẩn hóa toàn bộ cột một lần: strip, đánh dấu rỗng/nan/none là NULL
+    for col in schema_headers:
+        vals = df_data[col].astype(str).str.strip()
+        df_data[col] = vals.mask(vals.str.lower().isin(['nan', 'none', '']))
+    # Lọc cell rác (rỗng, null, < 5 ký tự, toàn chữ số)
+    c_names = df_data[cell_col_name].fillna('')
+    keep = ~c_names.str.lower().isin(['nan', 'none', 'null', '']) & (c_names.str.len() >= 5) & ~c_names.str.isdigit()
+    df_data = df_data[keep]
+
+    def to_values(col_name):
+        if col_name is None: return np.zeros(len(df_data))
+        return pd.to_numeric(df_data[col_name].str.replace(',', '.', regex=False), errors='coerce').fillna(0.0).to_numpy(dtype=float)
+    val1, val2 = to_values(val1_col_name), to_values(val2_col_name)
+    return schema_headers, df_data[cell_col_name].tolist(), np.minimum(val1, val2), np.maximum(val1, val2), json_array_rows(df_data)
+
+def scan_kpi_days(filename, file_bytes):
+    """Các ngày trong cột thoi_gian của file KPI (vị trí cột theo header dò như lúc import), đọc trước khi parse/ghi để báo trùng ngày."""
+    import pandas as pd
+    if filename.lower().endswith('.csv'):
+        df = read_import_frame(filename, file_bytes)
+        header_idx, columns = import_header(df.iloc[:20])
+    else:
+        rows = iter_xlsx_rows(file_bytes)
+        head = list(itertools.islice(rows, 20))
+        header_idx, columns = import_header(pd.DataFrame(head, dtype=object))
+    names = [clean_header(c) for c in columns]
+    if 'thoi_gian' not in names: return set()
+    pos = names.index('thoi_gian')
+    if filename.lower().endswith('.csv'): values = set(df.iloc[header_idx + 1:, pos].dropna().unique().tolist())
+    else: values = {r[pos] for r in itertools.chain(head[header_idx + 1:], rows) if pos < len(r)}
+    return {d for d in map(parse_kpi_day, values) if d}
+
+def screen_uploads(itype, files, accepted, force=False):
+    """Sinh job (itype, tên file, bytes) cho các file cần import; file rỗng, file y hệt đã import, file KPI có ngày (cột thoi_gian) đã có dữ liệu
+    thì flash và bỏ qua cả file trước khi parse (force: vẫn import). Các file trong cùng lần upload không tính là trùng nhau (vd. tách theo vendor/tỉnh).
+    `accepted` nhận (hash, tên file, kích thước) theo đúng thứ tự job để writer ghi manifest."""
+    tech = itype[3:] if IMPORT_MODELS.get(itype) in KPI_MODELS.values() else None
+    # Chưa có ngày nào của công nghệ này thì không cần quét file
+    check_days = bool(tech) and not force and db.session.query(KPIRollup.id).filter(KPIRollup.tech == tech).first() is not None
+    batch_hashes = set()
+    for f in files:
+        file_bytes = f.read()
+        if not file_bytes: continue
+        content_hash = hashlib.sha256(file_bytes).hexdigest()
+        if not force:
+            seen = ImportManifest.query.filter_by(content_hash=content_hash, import_type=itype).order_by(ImportManifest.id.desc()).first()
+            if seen or content_hash in batch_hashes:
+                when = f" lúc {seen.imported_at:%d/%m/%Y %H:%M} ({seen.rows} dòng)" if seen else " trong cùng lần upload"
+                flash(f'File {f.filename} đã được import{when}: bỏ qua.', 'info')
+                continue
+            if check_days:
+                days = scan_kpi_days(f.filename, file_bytes)
+                overlap = sorted(r[0] for r in db.session.query(KPIRollup.day).filter(KPIRollup.tech == tech, KPIRollup.day.in_(sorted(days))).distinct()) if days else []
+                if overlap:
+                    flash(f'File {f.filename}: ngày {", ".join(d.strftime("%d/%m/%Y") for d in overlap[:10])}{" ..." if len(overlap) > 10 else ""} đã có dữ liệu {itype.upper()}: chưa import file này. Chọn "Import lại" để ghi cả file.', 'warning')
+                    continue
+        batch_hashes.add(content_hash)
+        accepted.append((content_hash, f.filename, len(file_bytes)))
+        yield itype, f.filename, file_bytes
+
+def forget_imports(*models):
+    # Dữ liệu bị xóa/thay (reset, restore): cho phép import lại các file cũ của các bảng đó
+    types = [t for t, M in IMPORT_MODELS.items() if M in models]
+    if types: db.session.query(ImportManifest).filter(ImportManifest.import_type.in_(types)).delete(synchronize_session=False)
+
+def parallel_jobs(fn, jobs, workers=None, inline=None):
+    """Chạy fn(*args) cho từng job trong process pool, trả về (args, result_fn) đúng thứ tự gửi vào.
+    Chỉ giữ tối đa `workers` job đang chạy trước writer để không nạp toàn bộ file vào RAM cùng lúc; 1 worker hoặc 1 job thì chạy ngay trong request
+    bằng `inline` (nếu có, vd. generator đọc theo chunk) thay cho fn.
+    Process con tạo qua forkserver (spawn nếu hệ điều hành không có) để không fork worker web đang giữ kết nối DB và thread."""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    from collections import deque
+    from functools import partial
+    jobs = iter(jobs)
+    first = list(itertools.islice(jobs, 2))
+    workers = IMPORT_WORKERS if workers is None else workers
+    if workers <= 1 or len(first) <= 1:
+        for args in itertools.chain(first, jobs): yield args, partial(inline or fn, *args)
+        return
+    mp_context = multiprocessing.get_context('forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context) as pool:
+        pending = deque((args, pool.submit(fn, *args)) for args in itertools.chain(first, itertools.islice(jobs, workers - 2)))
+        while pending:
+            args, future = pending.popleft()
+            nxt = next(jobs, None)
+            if nxt is not None: pending.append((nxt, pool.submit(fn, *nxt)))
+            yield args, future.result
 
 # ==============================================================================
 # 4. TELEGRAM BOT
@@ -208,6 +1974,7 @@ def send_telegram_photo(chat_id, photo_url, caption=""):
     url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendPhoto"
     requests.post(url, json={"chat_id": chat_id, "photo": photo_url, "caption": caption, "parse_mode": "HTML"})
 
+@track_bot_latency
 def process_bot_command(text):
     text = str(text).strip().upper()
     parts = text.split()
@@ -223,12 +1990,15 @@ Vui lòng gõ theo các cú pháp sau (không phân biệt hoa/thường):
 👉 <code>KPI [Mã_Cell]</code>: Tra cứu thông số KPI ngày mới nhất (VD: KPI THA001_1).
 👉 <code>CHARTKPI [Mã_Cell]</code>: Tra cứu biểu đồ KPI 7 ngày gần nhất.
 👉 <code>RF [Mã_Cell]</code>: Tra cứu tất cả thông số cấu hình trạm.
+👉 <code>PCI [Mã_Cell]</code>: Tra cứu xung đột PCI (trùng PCI, mod 3, mod 30) của cell/trạm (4G/5G).
 👉 <code>CTS [Mã_Cell]</code>: Tra cứu thông số QoE, QoS tuần mới nhất.
 👉 <code>CHARTCTS [Mã_Cell]</code>: Tra cứu biểu đồ QoE, QoS 4 tuần mới nhất.
 
 <i>*Lưu ý: Mặc định tra cứu mạng 4G. Có thể thêm 3G/5G vào giữa câu lệnh (VD: KPI 3G THA001).</i>"""
     
     with app.app_context():
+        use_read_replica()
+        g.metrics_endpoint = 'bot'
         if cmd == 'DASHBOARD':
             records = db.session.query(
                 KPI4G.thoi_gian,
@@ -257,8 +2027,8 @@ Vui lòng gõ theo các cú pháp sau (không phân biệt hoa/thường):
         target = parts[-1] 
         
         if cmd == 'CTS':
-            qoe = QoE4G.query.filter(QoE4G.cell_name.ilike(f"%{target}%")).order_by(QoE4G.id.desc()).first()
-            qos = QoS4G.query.filter(QoS4G.cell_name.ilike(f"%{target}%")).order_by(QoS4G.id.desc()).first()
+            qoe = QoE4G.query.filter(cell_index.match(QoE4G.cell_name, target)).order_by(QoE4G.id.desc()).first()
+            qos = QoS4G.query.filter(cell_index.match(QoS4G.cell_name, target)).order_by(QoS4G.id.desc()).first()
             if not qoe and not qos: return f"❌ Không tìm thấy dữ liệu QoE/QoS cho Cell: <b>{target}</b>"
             msg = f"🌟 <b>THÔNG SỐ QoE / QoS - {target}</b>\n\n"
             if qoe: msg += f"📅 <b>{qoe.week_name}</b>\n- Điểm QoE: {qoe.qoe_score} ⭐\n- Tỷ lệ QoE: {qoe.qoe_percent} %\n\n"
@@ -268,8 +2038,8 @@ Vui lòng gõ theo các cú pháp sau (không phân biệt hoa/thường):
             return msg
 
         if cmd == 'CHARTCTS':
-            qoe_records = QoE4G.query.filter(QoE4G.cell_name.ilike(f"%{target}%")).order_by(QoE4G.id.desc()).limit(4).all()
-            qos_records = QoS4G.query.filter(QoS4G.cell_name.ilike(f"%{target}%")).order_by(QoS4G.id.desc()).limit(4).all()
+            qoe_records = QoE4G.query.filter(cell_index.match(QoE4G.cell_name, target)).order_by(QoE4G.id.desc()).limit(4).all()
+            qos_records = QoS4G.query.filter(cell_index.match(QoS4G.cell_name, target)).order_by(QoS4G.id.desc()).limit(4).all()
             if not qoe_records and not qos_records: return f"❌ Không tìm thấy dữ liệu QoE/QoS cho Cell: <b>{target}</b>"
             all_weeks = sorted(list(set([r.week_name for r in qoe_records] + [r.week_name for r in qos_records])))[-4:]
 
@@ -293,7 +2063,7 @@ Vui lòng gõ theo các cú pháp sau (không phân biệt hoa/thường):
         if cmd == 'KPI':
             Model = {'3g': KPI3G, '4g': KPI4G, '5g': KPI5G}.get(tech)
             if not Model: return "❌ Công nghệ không hợp lệ"
-            record = Model.query.filter(Model.ten_cell.ilike(f"%{target}%")).order_by(Model.id.desc()).first()
+            record = Model.query.filter(cell_index.match(Model.ten_cell, target)).order_by(Model.id.desc()).first()
             if record:
                 if tech == '4g': return f"📊 <b>KPI 4G - {record.ten_cell}</b>\n📅 Ngày: {record.thoi_gian}\n- Traffic: {record.traffic} GB\n- Avg Thput: {record.user_dl_avg_thput} Mbps\n- PRB: {record.res_blk_dl}%\n- CQI: {record.cqi_4g}\n- Drop Rate: {record.service_drop_all}%"
                 elif tech == '3g': return f"📊 <b>KPI 3G - {record.ten_cell}</b>\n📅 Ngày: {record.thoi_gian}\n- CS Traffic: {record.traffic} Erl\n- PS Traffic: {record.pstraffic} GB\n- CS Conges: {record.csconges}%\n- PS Conges: {record.psconges}%"
@@ -303,17 +2073,27 @@ Vui lòng gõ theo các cú pháp sau (không phân biệt hoa/thường):
         elif cmd == 'RF':
             Model = {'3g': RF3G, '4g': RF4G, '5g': RF5G}.get(tech)
             if not Model: return "❌ Công nghệ không hợp lệ"
-            record = Model.query.filter(Model.cell_code.ilike(f"%{target}%")).first()
+            record = Model.query.filter(cell_index.match(Model.cell_code, target)).first()
             if record:
                 if tech == '4g': return f"📡 <b>RF 4G - {record.cell_code}</b>\n📍 Trạm: {record.site_code}\n- Tọa độ: {record.latitude}, {record.longitude}\n- Azimuth: {record.azimuth}\n- Tilt: {record.total_tilt}\n- Tần số: {record.frequency}\n- ENodeB: {record.enodeb_id}\n- LCRID: {record.lcrid}"
                 elif tech == '3g': return f"📡 <b>RF 3G - {record.cell_code}</b>\n📍 Trạm: {record.site_code}\n- Tọa độ: {record.latitude}, {record.longitude}\n- Azimuth: {record.azimuth}\n- Tần số: {record.frequency}\n- BSC_LAC: {record.bsc_lac}\n- CI: {record.ci}"
                 elif tech == '5g': return f"📡 <b>RF 5G - {record.cell_code}</b>\n📍 Trạm: {record.site_code}\n- Tọa độ: {record.latitude}, {record.longitude}\n- Azimuth: {record.azimuth}\n- Tần số: {record.frequency}\n- GNodeB: {record.gnodeb_id}\n- LCRID: {record.lcrid}"
             return f"❌ Không tìm thấy cấu hình RF cho Cell: <b>{target}</b>"
             
+        elif cmd == 'PCI':
+            if tech not in PCI_TECHS: return "❌ Kiểm tra PCI chỉ áp dụng cho 4G/5G"
+            Model = PCI_TECHS[tech][0]
+            keys = [r[0] for r in db.session.query(Model.cell_key).filter(cell_index.match(Model.cell_code, target)).all() if r[0]]
+            if not keys: return f"❌ Không tìm thấy cấu hình RF cho Cell: <b>{target}</b>"
+            rows = pci_query(tech).filter(or_(PCIConflict.cell_key.in_(keys), PCIConflict.other_key.in_(keys))).limit(15).all()
+            if not rows: return f"✅ <b>PCI {tech.upper()} - {target}</b>\nKhông có xung đột PCI (trùng PCI ≤ {PCI_COLLISION_DISTANCE:.0f} m, mod 3/mod 30 ≤ {PCI_NEIGHBOR_DISTANCE:.0f} m)."
+            lines = [f"- {PCI_KIND_LABELS[r.kind]}: {r.cell_code} (PCI {r.pci}) ↔ {r.other_cell} (PCI {r.other_pci}), {r.distance:.0f} m, lớp {r.layer}" for r in rows]
+            return f"⚠️ <b>PCI {tech.upper()} - {target}</b>\n" + "\n".join(lines)
+
         elif cmd in ['CHARTKPI', 'CHART', 'BIEUDO']:
             Model = {'3g': KPI3G, '4g': KPI4G, '5g': KPI5G}.get(tech)
             if not Model: return "❌ Công nghệ không hợp lệ"
-            records = db.session.query(Model).filter(Model.ten_cell.ilike(f"%{target}%")).order_by(Model.id.desc()).limit(7).all()
+            records = db.session.query(Model).filter(cell_index.match(Model.ten_cell, target)).order_by(Model.id.desc()).limit(7).all()
             if not records: return f"❌ Không tìm thấy dữ liệu KPI cho Cell: <b>{target}</b>"
             
             records.reverse()
@@ -382,22 +2162,18 @@ def logout():
 
 @app.route('/')
 @login_required
+@conditional_report(KPIRollup)
 def index():
     dashboard_data = {'labels': [], 'traffic': [], 'thput': [], 'prb': [], 'cqi': []}
     try:
-        records = db.session.query(KPI4G.thoi_gian, func.sum(KPI4G.traffic).label('traffic'), func.avg(KPI4G.user_dl_avg_thput).label('user_dl_avg_thput'), func.avg(KPI4G.res_blk_dl).label('res_blk_dl'), func.avg(KPI4G.cqi_4g).label('cqi_4g')).group_by(KPI4G.thoi_gian).all()
-        if records:
-            agg_data = {}
+        # Đọc từ cube kpi_rollup (vài trăm dòng/ngày) thay vì GROUP BY toàn bộ kpi_4g; chỉ hiển thị KPI_RETENTION_DAYS ngày gần nhất
+        last_day = db.session.query(func.max(KPIRollup.day)).filter(KPIRollup.tech == '4g').scalar()
+        if last_day:
+            records = db.session.query(KPIRollup.day, *rollup_columns()).filter(KPIRollup.tech == '4g', KPIRollup.day > last_day - timedelta(days=KPI_RETENTION_DAYS)).group_by(KPIRollup.day).order_by(KPIRollup.day).all()
             for r in records:
-                if not r[0]: continue
-                agg_data[r[0]] = {'traffic_sum': r[1] or 0, 'thput_avg': r[2] or 0, 'prb_avg': r[3] or 0, 'cqi_avg': r[4] or 0}
-            sorted_dates = sorted(agg_data.keys(), key=lambda x: datetime.strptime(x, '%d/%m/%Y'))
-            dashboard_data['labels'] = sorted_dates
-            for d in sorted_dates:
-                dashboard_data['traffic'].append(round(agg_data[d]['traffic_sum'], 2))
-                dashboard_data['thput'].append(round(agg_data[d]['thput_avg'], 2))
-                dashboard_data['prb'].append(round(agg_data[d]['prb_avg'], 2))
-                dashboard_data['cqi'].append(round(agg_data[d]['cqi_avg'], 2))
+                v = rollup_values(r, 1)
+                dashboard_data['labels'].append(r[0].strftime('%d/%m/%Y'))
+                for key, m in (('traffic', 'traffic'), ('thput', 'thput'), ('prb', 'prb'), ('cqi', 'cqi')): dashboard_data[key].append(v[m] or 0)
     except Exception as e: pass
     gc.collect()
     return render_template('content.html', title="Dashboard", active_page='dashboard', dashboard_data=dashboard_data)
@@ -409,102 +2185,42 @@ def azimuth():
 
 @app.route('/optimize')
 @login_required
+@read_replica
 def optimize():
     action = request.args.get('action')
-    qoe_weeks = [r[0] for r in db.session.query(QoE4G.week_name).distinct().all()]
-    qos_weeks = [r[0] for r in db.session.query(QoS4G.week_name).distinct().all()]
-    all_weeks = sorted(list(set([w for w in qoe_weeks + qos_weeks if w])), reverse=True)
+    all_weeks = sorted([r[0] for r in db.session.query(NPOWeek.week_name).all()], reverse=True)
+    # Trang chạy trên read replica: chỉ báo chưa tính, việc tính bù nằm ở `flask migrate` / import QoE-QoS / lưu ngưỡng
+    npo_pending = not all_weeks and bool(db.session.query(QoE4G.id).first() or db.session.query(QoS4G.id).first())
     
     selected_week = request.args.get('week_name')
     if not selected_week and all_weeks:
         selected_week = all_weeks[0]
     
-    bad_cells_dict = {}
-    
+    optimized_data = []
     if selected_week:
-        l900_cells = {c[0] for c in db.session.query(RF4G.cell_code).filter(RF4G.frequency.ilike('%L900%')).all()}
+        for r in NPODiagnosis.query.filter(NPODiagnosis.week_name == selected_week).order_by(NPODiagnosis.id).all():
+            row = {c: (getattr(r, c) if getattr(r, c) is not None else '-') for c in ['cell_name', 'qoe_score', 'qoe_percent', 'qos_score', 'qos_percent', 'prb', 'thput', 'cqi', 'drop']}
+            row.update({'issues': (r.issues or '').split(' | '), 'actions': (r.actions or '').split(' | ')})
+            optimized_data.append(row)
+
+    # Bổ sung chẩn đoán hình học RF (tính sẵn theo version bảng RF) cho các cell NPO 4G và bảng vấn đề RF theo công nghệ chọn
+    rf_tech = request.args.get('rf_tech', '4g')
+    if rf_tech not in RF_MODELS: rf_tech = '4g'
+    rf_state = get_rf_analysis(rf_tech)
+    if optimized_data:
+        keys = {normalize_cell_key(row['cell_name']) for row in optimized_data}
+        rf_by_cell = defaultdict(list)
+        for r in RFSectorIssue.query.filter(RFSectorIssue.tech == '4g', or_(RFSectorIssue.cell_key.in_(keys), RFSectorIssue.other_key.in_(keys))).order_by(RFSectorIssue.distance).all():
+            for key, other in ((r.cell_key, r.other_cell), (r.other_key, r.cell_code)):
+                if key in keys: rf_by_cell[key].append((r.issue, f"{RF_ISSUE_LABELS[r.issue]} với {other} ({r.distance:.0f} m)"))
+        for row in optimized_data:
+            found = rf_by_cell.get(normalize_cell_key(row['cell_name']), [])
+            row['rf_issues'] = [label for _, label in found]
+            row['rf_actions'] = list(dict.fromkeys(RF_ISSUE_ACTIONS[kind] for kind, _ in found))
+    rf_summary = {k: 0 for k in RF_ISSUE_LABELS}
+    rf_summary.update({issue: n for issue, n in db.session.query(RFSectorIssue.issue, func.count(RFSectorIssue.id)).filter(RFSectorIssue.tech == rf_tech).group_by(RFSectorIssue.issue)})
+    rf_query = RFSectorIssue.query.filter(RFSectorIssue.tech == rf_tech).order_by(RFSectorIssue.issue.desc(), RFSectorIssue.distance)
 
-        qoe_bad = QoE4G.query.filter((QoE4G.week_name == selected_week) & ((QoE4G.qoe_score <= 2) | (QoE4G.qoe_percent < 80))).all()
-        qos_bad = QoS4G.query.filter((QoS4G.week_name == selected_week) & ((QoS4G.qos_score <= 3) | (QoS4G.qos_percent < 90))).all()
-        
-        def is_trash(c_name):
-            c_str = str(c_name).strip().upper()
-            if not c_str or c_str in ['NAN', 'NONE', 'NULL']: return True
-            if len(c_str) < 5: return True
-            if c_str.replace('.', '', 1).isdigit(): return True
-            if c_str in l900_cells: return True
-            if c_str.startswith('VNP-4G') or c_str.startswith('MBF_TH'): return True
-            return False
-
-        for r in qoe_bad:
-            if is_trash(r.cell_name): continue
-            bad_cells_dict[r.cell_name] = {'qoe_score': r.qoe_score, 'qoe_percent': r.qoe_percent, 'qos_score': '-', 'qos_percent': '-'}
-            
-        for r in qos_bad:
-            if is_trash(r.cell_name): continue
-            if r.cell_name not in bad_cells_dict:
-                bad_cells_dict[r.cell_name] = {'qoe_score': '-', 'qoe_percent': '-', 'qos_score': r.qos_score, 'qos_percent': r.qos_percent}
-            else:
-                bad_cells_dict[r.cell_name]['qos_score'] = r.qos_score
-                bad_cells_dict[r.cell_name]['qos_percent'] = r.qos_percent
-        
-        if bad_cells_dict:
-            cell_names = list(bad_cells_dict.keys())
-            latest_dates = [d[0] for d in db.session.query(KPI4G.thoi_gian).distinct().order_by(KPI4G.thoi_gian.desc()).limit(3).all()]
-            
-            if latest_dates:
-                kpi_records = db.session.query(
-                    KPI4G.ten_cell,
-                    func.avg(KPI4G.res_blk_dl).label('avg_prb'),
-                    func.avg(KPI4G.user_dl_avg_thput).label('avg_thput'),
-                    func.avg(KPI4G.cqi_4g).label('avg_cqi'),
-                    func.avg(KPI4G.service_drop_all).label('avg_drop')
-                ).filter(
-                    KPI4G.ten_cell.in_(cell_names),
-                    KPI4G.thoi_gian.in_(latest_dates)
-                ).group_by(KPI4G.ten_cell).all()
-                
-                for r in kpi_records:
-                    c = r.ten_cell
-                    if c in bad_cells_dict:
-                        prb = r.avg_prb or 0
-                        thput = r.avg_thput or 0
-                        cqi = r.avg_cqi or 0
-                        drop = r.avg_drop or 0
-                        
-                        issues = []
-                        actions = []
-                        
-                        if prb > 20 and thput < 10:
-                            issues.append("Nghẽn (Congestion)")
-                            actions.append("Cân bằng tải L1800->L2100 / Thêm Carrier")
-                        if cqi < 93:
-                            issues.append("Vô tuyến kém / Nhiễu")
-                            actions.append("Chỉnh Tx Power / Tối ưu Tilt, Azimuth")
-                        if drop > 0.3 and prb <= 20:
-                            issues.append("Lỗi Thiết bị / Truyền dẫn")
-                            actions.append("NOC reset Card / UCTT đo kiểm Quang, VSWR")
-                            
-                        if not issues:
-                            issues.append("Chưa rõ nguyên nhân")
-                            actions.append("Theo dõi sâu / Phân tích tham số")
-                            
-                        bad_cells_dict[c].update({
-                            'prb': round(prb, 2),
-                            'thput': round(thput, 2),
-                            'cqi': round(cqi, 2),
-                            'drop': round(drop, 2),
-                            'issues': issues,
-                            'actions': actions
-                        })
-                    
-    optimized_data = []
-    for cell, data in bad_cells_dict.items():
-        data['cell_name'] = cell
-        if 'issues' not in data:
-             data.update({'prb': '-', 'thput': '-', 'cqi': '-', 'drop': '-', 'issues': ['Thiếu dữ liệu KPI ngày'], 'actions': ['Cần Import KPI']})
-        optimized_data.append(data)
-        
     if action == 'export':
         export_list = []
         for data in optimized_data:
@@ -519,18 +2235,40 @@ def optimize():
                 'CQI (%)': data.get('cqi', ''),
                 'Drop (%)': data.get('drop', ''),
                 'Chẩn đoán': " | ".join(data.get('issues', [])),
-                'Giải pháp': " | ".join(data.get('actions', []))
+                'Giải pháp': " | ".join(data.get('actions', [])),
+                'Chẩn đoán RF': " | ".join(data.get('rf_issues', [])),
+                'Giải pháp RF': " | ".join(data.get('rf_actions', []))
             })
+        import pandas as pd
         df = pd.DataFrame(export_list)
+        rf_df = pd.DataFrame([{'Vấn đề': RF_ISSUE_LABELS[r.issue], 'Cell': r.cell_code, 'Site': r.site_code, 'Cell liên quan': r.other_cell, 'Khoảng cách (m)': r.distance, 'Tầm phủ (m)': r.reach, 'Chi tiết': r.detail, 'Giải pháp': RF_ISSUE_ACTIONS[r.issue]} for r in rf_query.all()])
         output = BytesIO()
         with pd.ExcelWriter(output, engine='openpyxl') as writer:
             df.to_excel(writer, index=False, sheet_name='Toi_Uu')
+            rf_df.to_excel(writer, index=False, sheet_name=f'RF_{rf_tech.upper()}')
         output.seek(0)
         safe_week_name = re.sub(r'[^a-zA-Z0-9_\-]', '_', selected_week) if selected_week else 'Week'
         return send_file(output, download_name=f'ToiUu_{safe_week_name}.xlsx', as_attachment=True)
         
-    gc.collect()
-    return render_template('content.html', title="Tối ưu QoE/QoS (NPO)", active_page='optimize', optimized_data=optimized_data, latest_week=selected_week, all_weeks=all_weeks)
+    return render_template('content.html', title="Tối ưu QoE/QoS (NPO)", active_page='optimize', optimized_data=optimized_data, latest_week=selected_week, all_weeks=all_weeks, npo_pending=npo_pending, npo_cfg=get_npo_config(), npo_labels=NPO_LABELS,
+                           rf_tech=rf_tech, rf_state=rf_state, rf_stale=rf_stale(rf_state, rf_tech), rf_summary=rf_summary, rf_issues=rf_query.limit(RF_ISSUE_PAGE).all(), rf_labels=RF_ISSUE_LABELS, rf_actions=RF_ISSUE_ACTIONS)
+
+@app.route('/optimize/config', methods=['POST'])
+@login_required
+def optimize_config():
+    if current_user.role != 'admin': return redirect(url_for('optimize'))
+    try:
+        for key in NPO_DEFAULTS:
+            raw = request.form.get(key, '').strip().replace(',', '.')
+            if not raw: continue
+            row = NPOConfig.query.filter_by(key=key).first()
+            if row: row.value = float(raw)
+            else: db.session.add(NPOConfig(key=key, value=float(raw)))
+        db.session.commit()
+        refresh_npo_diagnosis()
+        flash('Đã cập nhật ngưỡng và tính lại chẩn đoán cho tất cả các tuần!', 'success')
+    except ValueError as e: db.session.rollback(); flash(f'Ngưỡng không hợp lệ: {e}', 'danger')
+    return redirect(url_for('optimize', week_name=request.form.get('week_name', '')))
 
 @app.route('/import', methods=['GET', 'POST'])
 @login_required
@@ -539,217 +2277,112 @@ def import_data():
     if request.method == 'POST':
         files = request.files.getlist('file')
         itype = request.form.get('type')
-        # Gộp tất cả các thao tác nhập RF 3G trực tiếp vào RF3G
-        cfg = {'3g': RF3G, '4g': RF4G, '5g': RF5G, 'kpi3g': KPI3G, 'kpi4g': KPI4G, 'kpi5g': KPI5G, 'poi4g': POI4G, 'poi5g': POI5G}
-        Model = cfg.get(itype)
+        Model = IMPORT_MODELS.get(itype)
         
         if Model:
-            valid_cols = set(c.key for c in Model.__table__.columns if c.key not in ['id', 'extra_data'])
-            float_cols = {c.key for c in Model.__table__.columns if 'FLOAT' in str(c.type).upper()}
-            int_cols = {c.key for c in Model.__table__.columns if 'INTEGER' in str(c.type).upper() and c.key != 'id'}
-            
-            for file in files:
+            # Đọc byte + lọc file đã import / trùng ngày KPI ngay khi gửi vào pool, trước khi parse
+            accepted = []
+            uploads = screen_uploads(itype, files, accepted, force=request.form.get('reimport') == '1')
+            for (_, filename, file_bytes), parsed in parallel_jobs(parse_import_file, uploads, inline=iter_import_chunks):
+                content_hash = accepted.pop(0)[0]
                 try:
-                    file_bytes = file.read()
-                    if not file_bytes: continue
-                    
-                    if file.filename.lower().endswith('.csv'):
-                        sample = file_bytes[:4096].decode('utf-8-sig', errors='ignore')
-                        first_line = sample.split('\n')[0] if '\n' in sample else sample
-                        sep = ',' if first_line.count(',') >= first_line.count(';') else ';'
-                        df_raw = pd.read_csv(BytesIO(file_bytes), encoding='utf-8-sig', on_bad_lines='skip', sep=sep, header=None, dtype=str, low_memory=False, engine='c')
-                    else:
-                        df_raw = pd.read_excel(BytesIO(file_bytes), header=None, dtype=str)
-                    
-                    df_raw.dropna(how='all', inplace=True)
-                    df_raw.dropna(axis=1, how='all', inplace=True)
-                    df_raw = df_raw.reset_index(drop=True)
-
-                    header_idx = 0
-                    max_matches = 0
-                    kw_clean = ['cell', 'site', 'tram', 'uarfcn', 'he thong', 'quan ly', 'thiet bi', 'lat', 'long', 'stt', 'node', 'bsc', 'rnc', 'azimuth', 'tilt', 'power', 'gain', 'csht']
-                    
-                    if len(df_raw) > 0:
-                        for i in range(min(20, len(df_raw))):
-                            row_vals = [remove_accents(str(v)).lower() for v in df_raw.iloc[i].values if pd.notna(v)]
-                            matches = sum(1 for k in kw_clean if any(k in val for val in row_vals))
-                            if matches > max_matches:
-                                max_matches = matches
-                                header_idx = i
-                    
-                    if max_matches > 0:
-                        raw_cols = [str(c).strip() for c in df_raw.iloc[header_idx].values]
-                        seen = {}
-                        for j, c in enumerate(raw_cols):
-                            if c in seen:
-                                seen[c] += 1
-                                raw_cols[j] = f"{c}_{seen[c]}"
-                            else: seen[c] = 0
-                        df_raw.columns = raw_cols
-                        df_raw = df_raw.iloc[header_idx + 1:].reset_index(drop=True)
-                    else:
-                        df_raw.columns = [str(c) for c in df_raw.iloc[0].values]
-                        df_raw = df_raw.iloc[1:].reset_index(drop=True)
-
-                    original_columns = list(df_raw.columns)
-                    df_raw.columns = [clean_header(c) for c in df_raw.columns]
-                    
-                    # Loại bỏ các cột trùng tên sau khi map
-                    df_raw = df_raw.loc[:, ~df_raw.columns.duplicated()].copy()
-                    
-                    header_mapping = dict(zip(df_raw.columns, original_columns))
-                    
-                    cols_to_keep = [c for c in df_raw.columns if c in valid_cols]
-                    if not cols_to_keep:
-                        flash(f'Không tìm thấy cột dữ liệu khớp cho {itype.upper()} trong file {file.filename}.', 'warning')
-                        continue
-                        
-                    df_valid = df_raw[cols_to_keep].copy()
-                    del df_raw
-                    gc.collect()
-                    
-                    for c in df_valid.columns:
-                        if c in float_cols:
-                            df_valid[c] = df_valid[c].astype(str).str.replace(',', '.', regex=False).str.replace(' ', '', regex=False)
-                            df_valid[c] = pd.to_numeric(df_valid[c], errors='coerce')
-                        elif c in int_cols:
-                            df_valid[c] = df_valid[c].astype(str).str.replace(',', '.', regex=False).str.replace(' ', '', regex=False)
-                            df_valid[c] = pd.to_numeric(df_valid[c], errors='coerce').apply(lambda x: int(math.floor(x)) if pd.notnull(x) else None)
-                        else:
-                            df_valid[c] = df_valid[c].astype(str).str.strip()
-                            mask = df_valid[c].str.lower().isin(['', '-', 'nan', 'none', 'n/a', 'null', '?'])
-                            df_valid.loc[mask, c] = None
-                            
-                    if 'cell_code' not in df_valid.columns:
-                        if 'cell_name' in df_valid.columns: df_valid['cell_code'] = df_valid['cell_name']
-                        elif 'site_code' in df_valid.columns: df_valid['cell_code'] = df_valid['site_code']
-                        
-                    if 'cell_code' in df_valid.columns:
-                        df_valid.dropna(subset=['cell_code'], inplace=True)
-                        
-                    df_valid = df_valid.where(pd.notnull(df_valid), None)
-                    dict_records = df_valid.to_dict('records')
-                    del df_valid
-                    gc.collect()
-                    
+                    file_t0 = time.perf_counter()
                     inserted_count = 0
                     BATCH_SIZE = 1000
-                    records = []
-                    
-                    for row in dict_records:
-                        c_code = row.get('cell_code')
-                        if c_code and str(c_code).strip().lower() not in ['', 'nan', 'none', 'null']:
-                            row['cell_code'] = str(c_code).strip()
-                            records.append(row)
-                            
-                        if len(records) >= BATCH_SIZE:
-                            db.session.bulk_insert_mappings(Model, records)
-                            db.session.commit()
-                            inserted_count += len(records)
-                            records = []
-                            gc.collect()
+                    rollup = RollupAccumulator(itype[3:]) if Model in KPI_MODELS.values() else None
+                    matched = True
                     
-                    if records:
-                        db.session.bulk_insert_mappings(Model, records)
-                        db.session.commit()
-                        inserted_count += len(records)
+                    # Cả file ghi trong một transaction (dòng dữ liệu + kpi_rollup + manifest): chunk sau lỗi thì rollback hết, không để lại dòng dở dang
+                    for data, original_columns, key_col in parsed():
+                        if data is None:
+                            matched = False
+                            break
+                        if rollup: rollup.add_columns(data)
+                        # Mảng cột -> tuple tham số cho executemany, không dựng dict từng dòng
+                        columns = list(data)
+                        rows = list(zip(*(data[c].tolist() for c in columns)))
+                        del data
+                        for start_idx in range(0, len(rows), BATCH_SIZE):
+                            batch = rows[start_idx:start_idx + BATCH_SIZE]
+                            insert_rows(Model, columns, batch)
+                            inserted_count += len(batch)
+                        del rows
+                        gc.collect()
+                    if not matched:
+                        db.session.rollback()
+                        flash(f'Không tìm thấy cột dữ liệu khớp cho {itype.upper()} trong file {filename}.', 'warning')
+                        continue
+                    days = sorted({k[0] for k in rollup.groups}) if rollup else []
+                    if inserted_count > 0:
+                        db.session.add(ImportManifest(content_hash=content_hash, import_type=itype, filename=filename, day_from=days[0] if days else None, day_to=days[-1] if days else None, rows=inserted_count, size=len(file_bytes)))
+                    if rollup: rollup.apply()
+                    db.session.commit()
                         
+                    cell_index.invalidate()
+                    record_import(itype, inserted_count, len(file_bytes), time.perf_counter() - file_t0)
                     if inserted_count > 0:
                         flash(f'Đã Import siêu tốc {inserted_count} dòng vào {itype.upper()}!', 'success')
                     else:
                         found_cols = ", ".join([str(c) for c in original_columns[:10]])
-                        flash(f'Lỗi file {file.filename}: Không tìm thấy dữ liệu hợp lệ. Các cột tìm thấy: {found_cols}', 'warning')
+                        flash(f'Lỗi file {filename}: Không tìm thấy dữ liệu hợp lệ. Các cột tìm thấy: {found_cols}', 'warning')
                         
                 except Exception as e: 
                     err_msg = str(e)
                     db.session.rollback()
+                    # Chưa có gì của file này được commit: rollback bỏ cả các dòng đã insert, file có thể import lại trọn vẹn
+                    undo_note = f' (đã hủy {inserted_count} dòng chưa commit)' if inserted_count else ''
                     if 'Unknown column' in err_msg or 'DataError' in err_msg:
-                        flash('CẤU TRÚC DB BỊ LỖI: Cột dữ liệu không khớp. Hãy vào tab "Reset Data" (màu đỏ) và bấm "Reset Toàn Bộ Dữ Liệu RF" để làm mới hệ thống!', 'danger')
+                        flash('CẤU TRÚC DB BỊ LỖI: Cột dữ liệu không khớp. Hãy vào tab "Reset Data" (màu đỏ) và bấm "Reset Toàn Bộ Dữ Liệu RF" để làm mới hệ thống!' + undo_note, 'danger')
                     else:
-                        flash(f'Lỗi file {file.filename}: {err_msg}', 'danger')
+                        flash(f'Lỗi file {filename}: {err_msg}{undo_note}', 'danger')
+        
+            bump_data_version(Model.__tablename__, *([KPIRollup.__tablename__] if Model in KPI_MODELS.values() else []))
+            # Bảng RF đổi: tính lại phân tích RF/PCI ở đây để trang xem chỉ đọc
+            if Model in RF_MODELS.values():
+                try: refresh_rf_derived(*[t for t, M in RF_MODELS.items() if M is Model])
+                except Exception as e: db.session.rollback(); flash(f'Lỗi cập nhật phân tích RF/PCI: {e}', 'danger')
+            # KPI 4G (ngày gần nhất) và RF 4G (danh sách L900) là đầu vào của chẩn đoán NPO
+            if Model in (KPI4G, RF4G):
+                # Dữ liệu đã commit: lỗi khi tính lại chẩn đoán chỉ báo, không trả 500
+                try: refresh_npo_diagnosis()
+                except Exception as e: db.session.rollback(); flash(f'Lỗi cập nhật chẩn đoán NPO: {e}', 'danger')
         
         elif itype in ['qoe4g', 'qos4g']:
             week_name = request.form.get('week_name', 'Tuần')
             TargetModel = QoE4G if itype == 'qoe4g' else QoS4G
-            for file in files:
+            # Đọc byte từng file khi được gửi vào pool (file rỗng bỏ qua)
+            uploads = ((itype, f.filename, data) for f in files for data in [f.read()] if data)
+            for (_, filename, file_bytes), parsed in parallel_jobs(parse_qoe_file, uploads):
                 try:
-                    file_bytes = file.read()
-                    if not file_bytes: continue
-                    
-                    if file.filename.lower().endswith('.csv'):
-                        sample = file_bytes[:4096].decode('utf-8-sig', errors='ignore')
-                        first_line = sample.split('\n')[0] if '\n' in sample else sample
-                        sep = ',' if first_line.count(',') >= first_line.count(';') else ';'
-                        df = pd.read_csv(BytesIO(file_bytes), encoding='utf-8-sig', on_bad_lines='skip', sep=sep, header=None, dtype=str, low_memory=False, engine='c')
-                    else:
-                        df = pd.read_excel(BytesIO(file_bytes), header=None, dtype=str)
-                    
-                    df.dropna(how='all', inplace=True)
-                    df.dropna(axis=1, how='all', inplace=True)
-                    df = df.reset_index(drop=True)
-                    df = df.astype(str)
-                    
-                    header_row_idx, cell_col_idx = -1, -1
-                    
-                    for i in range(min(20, len(df))):
-                        row_vals = [str(v).lower().strip() for v in df.iloc[i].values if pd.notna(v)]
-                        for j, val in enumerate(row_vals):
-                            if val in ['cell name', 'tên cell', 'cell_name']:
-                                header_row_idx, cell_col_idx = i, j
-                                break
-                        if header_row_idx != -1: break
-                        
-                    if header_row_idx != -1 and cell_col_idx != -1:
-                        headers = [" - ".join([str(df.iloc[i, j]).strip() for i in range(header_row_idx + 1) if str(df.iloc[i, j]).strip() not in ['nan', 'None', '']]) or f"Col_{j}" for j in range(len(df.columns))]
-                        
-                        df_data = df.iloc[header_row_idx + 1:].copy()
-                        df_data.columns = headers
-                        
-                        df_data = df_data.loc[:, ~df_data.columns.duplicated()].copy()
-                        
-                        dict_records = df_data.to_dict('records')
-                        del df
-                        del df_data
-                        gc.collect()
+                    file_t0 = time.perf_counter()
+                    result = parsed()
+                    if result is None: continue
+                    schema_headers, cells, scores, percents, detail_jsons = result
+                    kind = 'qoe' if itype == 'qoe4g' else 'qos'
+                    schema_json = json.dumps(schema_headers, ensure_ascii=False)
+                    schema = QoEQoSSchema.query.filter_by(kind=kind, week_name=week_name, headers=schema_json).first()
+                    if not schema:
+                        schema = QoEQoSSchema(kind=kind, week_name=week_name, headers=schema_json)
+                        db.session.add(schema); db.session.commit()
 
-                        inserted_count = 0
-                        BATCH_SIZE = 2000
-                        
-                        cell_col_name = headers[cell_col_idx]
-                        val1_col_name = headers[cell_col_idx + 2] if cell_col_idx + 2 < len(headers) else None
-                        val2_col_name = headers[cell_col_idx + 3] if cell_col_idx + 3 < len(headers) else None
+                    inserted_count = 0
+                    BATCH_SIZE = 2000
+                    score_key, percent_key = ('qoe_score', 'qoe_percent') if itype == 'qoe4g' else ('qos_score', 'qos_percent')
+                    
+                    for start_idx in range(0, len(cells), BATCH_SIZE):
+                        end_idx = start_idx + BATCH_SIZE
+                        records = [{'cell_name': c, 'cell_key': normalize_cell_key(c), 'week_name': week_name, score_key: sc, percent_key: pc, 'schema_id': schema.id, 'detail_values': dj} for c, sc, pc, dj in zip(cells[start_idx:end_idx], scores[start_idx:end_idx].tolist(), percents[start_idx:end_idx].tolist(), detail_jsons[start_idx:end_idx])]
+                        db.session.bulk_insert_mappings(TargetModel, records)
+                        db.session.commit()
+                        inserted_count += len(records)
                         
-                        for start_idx in range(0, len(dict_records), BATCH_SIZE):
-                            chunk_records = dict_records[start_idx:start_idx+BATCH_SIZE]
-                            records = []
-                            
-                            for row_data in chunk_records:
-                                c_name = str(row_data.get(cell_col_name, '')).strip()
-                                if not c_name or c_name.lower() in ['nan', 'none', 'null', ''] or len(c_name) < 5 or c_name.isdigit(): continue
-                                
-                                try: val1 = float(str(row_data.get(val1_col_name, 0)).replace(',','.'))
-                                except: val1 = 0.0
-                                try: val2 = float(str(row_data.get(val2_col_name, 0)).replace(',','.'))
-                                except: val2 = 0.0
-                                
-                                if math.isnan(val1): val1 = 0.0
-                                if math.isnan(val2): val2 = 0.0
-                                    
-                                percent, score = max(val1, val2), min(val1, val2)
-                                details_dict = {k: str(v).strip() for k, v in row_data.items() if str(v).strip().lower() not in ['nan', 'none', '']}
-                                details_json = json.dumps(details_dict, ensure_ascii=False)
-                                
-                                records.append({'cell_name': c_name, 'week_name': week_name, 'qoe_score' if itype == 'qoe4g' else 'qos_score': score, 'qoe_percent' if itype == 'qoe4g' else 'qos_percent': percent, 'details': details_json})
-                                
-                            if records:
-                                db.session.bulk_insert_mappings(TargetModel, records)
-                                db.session.commit()
-                                inserted_count += len(records)
-                            
-                            gc.collect()
-                            
-                        flash(f'Import siêu tốc thành công {inserted_count} dòng.', 'success')
+                    cell_index.invalidate()
+                    record_import(itype, inserted_count, len(file_bytes), time.perf_counter() - file_t0)
+                    flash(f'Import siêu tốc thành công {inserted_count} dòng.', 'success')
                 except Exception as e: flash(f'Lỗi: {e}', 'danger')
+            bump_data_version(TargetModel.__tablename__, QoEQoSSchema.__tablename__)
+            try: refresh_npo_diagnosis([week_name])
+            except Exception as e: db.session.rollback(); flash(f'Lỗi cập nhật chẩn đoán NPO: {e}', 'danger')
 
         return redirect(url_for('import_data'))
     
@@ -775,17 +2408,23 @@ def reset_data():
             db.session.execute(text("DROP TABLE IF EXISTS rf_3g"))
             db.session.execute(text("DROP TABLE IF EXISTS rf_4g"))
             db.session.execute(text("DROP TABLE IF EXISTS rf_5g"))
+            forget_imports(RF3G, RF4G, RF5G)
             db.session.commit()
             db.create_all()
+            bump_data_version(RF3G.__tablename__, RF4G.__tablename__, RF5G.__tablename__)
+            refresh_rf_derived(*RF_MODELS)
+            refresh_npo_diagnosis()
             flash('Đã Reset và cập nhật cấu trúc bảng RF thành công!', 'success')
         elif target == 'poi':
-            db.session.query(POI4G).delete(); db.session.query(POI5G).delete()
-            db.session.commit(); flash('Đã reset dữ liệu POI!', 'success')
+            db.session.query(POI4G).delete(); db.session.query(POI5G).delete(); forget_imports(POI4G, POI5G)
+            db.session.commit(); bump_data_version(POI4G.__tablename__, POI5G.__tablename__); flash('Đã reset dữ liệu POI!', 'success')
+        cell_index.invalidate()
     except Exception as e: db.session.rollback(); flash(f'Lỗi: {e}', 'danger')
     return redirect(url_for('import_data'))
 
 @app.route('/gis', methods=['GET', 'POST'])
 @login_required
+@read_replica
 def gis():
     action_type = request.form.get('action', 'search') if request.method == 'POST' else 'search'
     tech = request.form.get('tech', '4g') if request.method == 'POST' else request.args.get('tech', '4g')
@@ -796,16 +2435,9 @@ def gis():
     its_data = []
     matched_sites = set()
     gis_data = []
-
-    def clean_val(v):
-        if v is None: return None
-        s = str(v).strip()
-        if s == '-' or s == '' or s.lower() in ['nan', 'null', 'none']: return None
-        try:
-            f = float(s)
-            if f.is_integer(): return str(int(f))
-            return str(f)
-        except ValueError: return s.upper()
+    its_stats, its_summary = [], None
+    # Cột mẫu đo dùng để gán cell phục vụ (chỉ các mẫu cùng công nghệ đang chọn)
+    sample_lat, sample_lon, sample_level, sample_id = [], [], [], []
 
     def safe_float(val, default=0.0):
         if val is None: return default
@@ -815,24 +2447,6 @@ def gis():
         except ValueError: return default
 
     Model = {'3g': RF3G, '4g': RF4G, '5g': RF5G}.get(tech)
-    db_mapping = {}
-    
-    if Model and action_type == 'show_log':
-        if tech == '4g' and hasattr(Model, 'enodeb_id') and hasattr(Model, 'lcrid'):
-            res = db.session.query(Model.site_code, Model.enodeb_id, Model.lcrid).all()
-            for sc, en, lc in res:
-                c_en, c_lc = clean_val(en), clean_val(lc)
-                if sc and c_en and c_lc: db_mapping[f"{c_en}_{c_lc}"] = sc
-        elif tech == '3g' and hasattr(Model, 'ci'):
-            res = db.session.query(Model.site_code, Model.ci).all()
-            for sc, ci in res:
-                c_ci = clean_val(ci)
-                if sc and c_ci: db_mapping[c_ci] = sc
-        elif tech == '5g' and hasattr(Model, 'gnodeb_id') and hasattr(Model, 'lcrid'):
-            res = db.session.query(Model.site_code, Model.gnodeb_id, Model.lcrid).all()
-            for sc, gn, lc in res:
-                c_gn, c_lc = clean_val(gn), clean_val(lc)
-                if sc and c_gn and c_lc: db_mapping[f"{c_gn}_{c_lc}"] = sc
     
     if request.method == 'POST' and 'its_file' in request.files:
         files = request.files.getlist('its_file')
@@ -875,25 +2489,27 @@ def gis():
                                     if not lat_str or lat_str == '-' or not lon_str or lon_str == '-': continue
                                     lat, lon = float(lat_str), float(lon_str)
                                     
-                                    n = clean_val(parts[node_idx]) if node_idx >= 0 and len(parts) > node_idx else None
-                                    c = clean_val(parts[cell_idx]) if cell_idx >= 0 and len(parts) > cell_idx else None
+                                    n = clean_cell_id(parts[node_idx]) if node_idx >= 0 and len(parts) > node_idx else None
+                                    c = clean_cell_id(parts[cell_idx]) if cell_idx >= 0 and len(parts) > cell_idx else None
                                     
-                                    if action_type == 'show_log':
-                                        if tech == '4g' and n and c:
-                                            if f"{n}_{c}" in db_mapping: matched_sites.add(db_mapping[f"{n}_{c}"])
-                                        elif tech == '3g' and c:
-                                            if c in db_mapping: matched_sites.add(db_mapping[c])
-                                        elif tech == '5g' and n and c:
-                                            if f"{n}_{c}" in db_mapping: matched_sites.add(db_mapping[f"{n}_{c}"])
-                                                
                                     lvl = safe_float(parts[level_idx] if level_idx >= 0 and len(parts) > level_idx else '')
                                     qual_str = parts[qual_idx].strip() if qual_idx >= 0 and len(parts) > qual_idx else ''
                                     tech_str = parts[tech_idx].strip().upper() if tech_idx >= 0 and len(parts) > tech_idx else tech.upper()
                                     
+                                    if action_type == 'show_log' and Model and any(name in tech_str for name in ITS_TECH_NAMES[tech]):
+                                        sample_lat.append(lat); sample_lon.append(lon); sample_id.append(its_sample_id(tech, n, c))
+                                        sample_level.append(safe_float(parts[level_idx] if level_idx >= 0 and len(parts) > level_idx else '', float('nan')))
                                     its_data.append({'lat': lat, 'lon': lon, 'level': lvl, 'qual': qual_str, 'tech': tech_str, 'cellid': c or '', 'node': n or ''})
                                 except ValueError: pass
                 except Exception as e: flash(f'Lỗi xử lý file {file.filename}: {e}', 'danger')
         
+        if sample_lat:
+            import numpy as np
+            lat_arr, lon_arr = np.asarray(sample_lat), np.asarray(sample_lon)
+            cells, serving, by_id = associate_its_samples(tech, lat_arr, lon_arr, np.asarray(sample_id, dtype=object))
+            its_stats, its_summary = its_cell_stats(tech, cells, serving, by_id, lat_arr, lon_arr, np.asarray(sample_level))
+            matched_sites = {r['site_code'] for r in its_stats if r['site_code']}
+
         if len(its_data) > 20000:
             its_data = random.sample(its_data, 20000)
             flash(f'Đã giới hạn hiển thị ngẫu nhiên 20,000 điểm đo từ tổng số để chống treo trình duyệt.', 'warning')
@@ -911,10 +2527,10 @@ def gis():
             
             if site_code_input or cell_name_input:
                 search_q = db.session.query(Model)
-                if site_code_input: search_q = search_q.filter(Model.site_code.ilike(f"%{site_code_input}%"))
+                if site_code_input: search_q = search_q.filter(cell_index.match(Model.site_code, site_code_input))
                 if cell_name_input:
-                    filters = [Model.cell_code.ilike(f"%{cell_name_input}%")]
-                    if hasattr(Model, 'cell_name'): filters.append(Model.cell_name.ilike(f"%{cell_name_input}%"))
+                    filters = [cell_index.match(Model.cell_code, cell_name_input)]
+                    if hasattr(Model, 'cell_name'): filters.append(cell_index.match(Model.cell_name, cell_name_input))
                     search_q = search_q.filter(or_(*filters))
                 
                 for r in search_q.limit(50).all():
@@ -938,190 +2554,252 @@ def gis():
                 
             records = list(records_dict.values())
 
-        cols = [c.key for c in Model.__table__.columns if c.key not in ['id', 'extra_data']]
+        cols = [c.key for c in Model.__table__.columns if c.key not in INTERNAL_COLUMNS]
+        sectors = sector_cache.get(tech)
         for r in records:
             try:
                 lat, lon = float(r.latitude), float(r.longitude)
                 azi = int(r.azimuth) if getattr(r, 'azimuth', None) is not None else 0
                 if 8 <= lat <= 24 and 102 <= lon <= 110:
-                    gis_data.append({'cell_name': getattr(r, 'cell_name', getattr(r, 'site_name', str(r.cell_code))), 'site_code': r.site_code, 'lat': lat, 'lon': lon, 'azi': azi, 'tech': tech, 'info': {c: getattr(r, c) or '' for c in cols}})
+                    gis_data.append({'cell_name': getattr(r, 'cell_name', getattr(r, 'site_name', str(r.cell_code))), 'site_code': r.site_code, 'lat': lat, 'lon': lon, 'azi': azi, 'tech': tech, 'info': {c: getattr(r, c) or '' for c in cols}, 'sector': sector_cache.sector(sectors, r.id)})
             except: pass
     gc.collect()
-    return render_template('content.html', title="Bản đồ Trực quan (GIS)", active_page='gis', selected_tech=tech, site_code_input=site_code_input, cell_name_input=cell_name_input, gis_data=gis_data, its_data=its_data, show_its=show_its, action_type=action_type)
+    return stream_page('content.html', title="Bản đồ Trực quan (GIS)", active_page='gis', selected_tech=tech, site_code_input=site_code_input, cell_name_input=cell_name_input, gis_data=gis_data, its_data=its_data, show_its=show_its, action_type=action_type, sector_base_radius=SECTOR_BASE_RADIUS,
+                       its_stats=its_stats, its_summary=its_summary)
+
+@app.route('/api/gis/sectors')
+@login_required
+@read_replica
+@conditional_report(RF3G, RF4G, RF5G)
+def api_gis_sectors():
+    # GeoJSON hình quạt của toàn bộ bảng RF (tọa độ [lon, lat], bán kính chuẩn SECTOR_BASE_RADIUS theo băng tần)
+    tech = request.args.get('tech', '4g')
+    if tech not in RF_MODELS: return jsonify({'error': 'invalid tech'}), 400
+    return Response(sector_cache.geojson(tech), mimetype='application/json')
+
+KPI_CHART_METRICS = {
+    '3g': [{'key': 'pstraffic', 'label': 'PSTRAFFIC (GB)'}, {'key': 'traffic', 'label': 'TRAFFIC (Erl)'}, {'key': 'psconges', 'label': 'PS CONGESTION (%)'}, {'key': 'csconges', 'label': 'CS CONGESTION (%)'}],
+    '4g': [{'key': 'traffic', 'label': 'TOTAL TRAFFIC (GB)'}, {'key': 'user_dl_avg_thput', 'label': 'USER DL AVG THPUT (Mbps)'}, {'key': 'res_blk_dl', 'label': 'RES BLOCK DL (%)'}, {'key': 'cqi_4g', 'label': 'CQI 4G'}],
+    '5g': [{'key': 'traffic', 'label': 'TOTAL TRAFFIC (GB)'}, {'key': 'user_dl_avg_throughput', 'label': 'USER DL AVG THPUT (Mbps)'}, {'key': 'cqi_5g', 'label': 'CQI 5G'}]
+}
+# (id, tiêu đề, trường dữ liệu) cho biểu đồ POI và (id, tiêu đề, nhãn series, màu, trường) cho QoE/QoS
+POI_CHARTS = {'4g': [('4g_traf', 'Total 4G Traffic (GB)', 'traffic'), ('4g_thp', 'Avg 4G Thput (Mbps)', 'thput')], '5g': [('5g_traf', 'Total 5G Traffic (GB)', 'traffic'), ('5g_thp', 'Avg 5G Thput (Mbps)', 'thput')]}
+POI_CHART_COLORS = {'4g': ['blue', 'green'], '5g': ['orange', 'purple']}
+QOE_QOS_CHARTS = {
+    'qoe': [('qoe_score_chart', 'Biểu đồ Điểm QoE', 'Điểm QoE (1-5)', '#0078d4', 'score'), ('qoe_percent_chart', 'Biểu đồ Tỷ lệ QoE (%)', '% QoE', '#107c10', 'percent')],
+    'qos': [('qos_score_chart', 'Biểu đồ Điểm QoS', 'Điểm QoS (1-5)', '#ffaa44', 'score'), ('qos_percent_chart', 'Biểu đồ Tỷ lệ QoS (%)', '% QoS', '#e3008c', 'percent')]
+}
 
 @app.route('/kpi')
 @login_required
+@read_replica
+@conditional_report(KPI3G, KPI4G, KPI5G, POI4G, POI5G, RF3G, RF4G, RF5G)
 def kpi():
     selected_tech = request.args.get('tech', '4g')
     cell_name_input = request.args.get('cell_name', '').strip()
     poi_input = request.args.get('poi_name', '').strip()
-    charts = {} 
+    kpi_range = request.args.get('range', '')
+    # Trang chỉ render khung biểu đồ; dữ liệu từng chỉ số được tải song song qua /api/charts/kpi
+    chart_cards = []
+    if cell_name_input or poi_input:
+        chart_cards = [{'id': f"chart_{m['key']}", 'title': m['label'], 'src': url_for('api_chart_kpi', tech=selected_tech, cell_name=cell_name_input, poi_name=poi_input, metric=m['key'], range=kpi_range)} for m in KPI_CHART_METRICS.get(selected_tech, [])]
+
+    poi_list = []
+    try:
+        p4 = [r[0] for r in db.session.query(POI4G.poi_name).distinct()]
+        p5 = [r[0] for r in db.session.query(POI5G.poi_name).distinct()]
+        poi_list = sorted(list(set(p4 + p5)))
+    except: pass
+
+    return render_template('content.html', title="Báo cáo KPI", active_page='kpi', selected_tech=selected_tech, cell_name_input=cell_name_input, selected_poi=poi_input, poi_list=poi_list, chart_cards=chart_cards, kpi_range=kpi_range, kpi_ranges=KPI_RANGES)
 
-    colors = generate_colors(20)
-    target_cells = []
+def kpi_target_cells(selected_tech, cell_name_input, poi_input):
+    # Trả về danh sách cell_key (đã chuẩn hóa, không trùng) theo thứ tự tìm thấy
+    target_keys = []
     KPI_Model = {'3g': KPI3G, '4g': KPI4G, '5g': KPI5G}.get(selected_tech)
     RF_Model = {'3g': RF3G, '4g': RF4G, '5g': RF5G}.get(selected_tech)
 
     if poi_input:
         POI_Model = {'4g': POI4G, '5g': POI5G}.get(selected_tech)
-        if POI_Model: target_cells = [r.cell_code for r in POI_Model.query.filter(POI_Model.poi_name == poi_input).all()]
+        if POI_Model: target_keys = [r[0] for r in db.session.query(POI_Model.cell_key).filter(POI_Model.poi_name == poi_input)]
     elif cell_name_input:
         if RF_Model:
-            matched_rf = RF_Model.query.filter(or_(RF_Model.site_code.ilike(f"%{cell_name_input}%"), RF_Model.cell_code.ilike(f"%{cell_name_input}%"))).all()
-            if matched_rf: target_cells.extend([r.cell_code for r in matched_rf])
+            target_keys.extend(r[0] for r in db.session.query(RF_Model.cell_key).filter(or_(cell_index.match(RF_Model.site_code, cell_name_input), cell_index.match(RF_Model.cell_key, cell_name_input))))
         if KPI_Model:
-            matched_kpi = KPI_Model.query.filter(KPI_Model.ten_cell.ilike(f"%{cell_name_input}%")).with_entities(KPI_Model.ten_cell).distinct().all()
-            if matched_kpi: target_cells.extend([r[0] for r in matched_kpi])
-        if not target_cells: target_cells = [c.strip() for c in re.split(r'[,\s;]+', cell_name_input) if c.strip()]
-            
-    if target_cells:
-        unique_cells = []
-        seen = set()
-        for c in target_cells:
-            if not c: continue
-            c_clean = str(c).strip().upper()
-            if c_clean not in seen:
-                seen.add(c_clean)
-                unique_cells.append(str(c).strip())
-        target_cells = unique_cells
-
-    if target_cells and KPI_Model:
-        data = KPI_Model.query.filter(KPI_Model.ten_cell.in_(target_cells)).all()
-        try: data.sort(key=lambda x: datetime.strptime(x.thoi_gian, '%d/%m/%Y'))
-        except: pass 
-
-        if data:
-            all_labels = sorted(list(set([x.thoi_gian for x in data])), key=lambda d: datetime.strptime(d, '%d/%m/%Y'))
-            data_by_cell = defaultdict(list)
-            for x in data: data_by_cell[str(x.ten_cell).strip().upper()].append(x)
-
-            metrics_config = {
-                '3g': [{'key': 'pstraffic', 'label': 'PSTRAFFIC (GB)'}, {'key': 'traffic', 'label': 'TRAFFIC (Erl)'}, {'key': 'psconges', 'label': 'PS CONGESTION (%)'}, {'key': 'csconges', 'label': 'CS CONGESTION (%)'}],
-                '4g': [{'key': 'traffic', 'label': 'TOTAL TRAFFIC (GB)'}, {'key': 'user_dl_avg_thput', 'label': 'USER DL AVG THPUT (Mbps)'}, {'key': 'res_blk_dl', 'label': 'RES BLOCK DL (%)'}, {'key': 'cqi_4g', 'label': 'CQI 4G'}],
-                '5g': [{'key': 'traffic', 'label': 'TOTAL TRAFFIC (GB)'}, {'key': 'user_dl_avg_throughput', 'label': 'USER DL AVG THPUT (Mbps)'}, {'key': 'cqi_5g', 'label': 'CQI 5G'}]
-            }
-            
-            current_metrics = metrics_config.get(selected_tech, [])
-            for metric in current_metrics:
-                datasets = []
-                for i, cell_code in enumerate(target_cells):
-                    cell_data = data_by_cell.get(cell_code.upper(), [])
-                    data_map = {item.thoi_gian: (getattr(item, metric['key'], 0) or 0) for item in cell_data}
-                    datasets.append({'label': cell_code, 'data': [data_map.get(lbl, None) for lbl in all_labels], 'borderColor': colors[i % len(colors)], 'fill': False, 'spanGaps': True})
-                charts[f"chart_{metric['key']}"] = {'title': metric['label'], 'labels': all_labels, 'datasets': datasets}
-
-    poi_list = []
-    with app.app_context():
-        try:
-            p4 = [r[0] for r in db.session.query(POI4G.poi_name).distinct()]
-            p5 = [r[0] for r in db.session.query(POI5G.poi_name).distinct()]
-            poi_list = sorted(list(set(p4 + p5)))
-        except: pass
+            target_keys.extend(cell_index.lookup(KPI_Model.cell_key, cell_name_input))
+        if not target_keys: target_keys = [normalize_cell_key(c) for c in re.split(r'[,\s;]+', cell_name_input)]
+    return [k for k in dict.fromkeys(target_keys) if k]
 
-    gc.collect()
-    return render_template('content.html', title="Báo cáo KPI", active_page='kpi', selected_tech=selected_tech, cell_name_input=cell_name_input, selected_poi=poi_input, poi_list=poi_list, charts=charts)
+@app.route('/api/charts/kpi')
+@login_required
+@read_replica
+@conditional_report(KPI3G, KPI4G, KPI5G, POI4G, POI5G, RF3G, RF4G, RF5G, *KPI_ARCHIVE_MODELS, by_day=True)
+def api_chart_kpi():
+    selected_tech = request.args.get('tech', '4g')
+    KPI_Model = {'3g': KPI3G, '4g': KPI4G, '5g': KPI5G}.get(selected_tech)
+    metric = next((m for m in KPI_CHART_METRICS.get(selected_tech, []) if m['key'] == request.args.get('metric')), None)
+    if not KPI_Model or not metric: return jsonify({'error': 'invalid tech/metric'}), 400
+    target_cells = kpi_target_cells(selected_tech, request.args.get('cell_name', '').strip(), request.args.get('poi_name', '').strip())
+    payload = {'labels': [], 'charts': []}
+    kpi_range = request.args.get('range', '')
+    range_days = 0 if kpi_range == 'all' else (int(kpi_range) if kpi_range.isdigit() else None)
+    if target_cells:
+        # Chỉ lấy cột của chỉ số cần vẽ; khoảng dài hơn KPI_RETENTION_DAYS đọc từ archive tuần/tháng
+        all_labels, data_by_cell = kpi_series(selected_tech, metric['key'], target_cells, range_days)
+        if all_labels:
+            colors = generate_colors(20)
+            series = []
+            cell_names = kpi_cell_names(selected_tech, target_cells)
+            for i, cell_code in enumerate(target_cells):
+                data_map = data_by_cell.get(cell_code, {})
+                series.append({'label': cell_names.get(cell_code, cell_code), 'color': colors[i % len(colors)], 'data': round_series([data_map.get(lbl) for lbl in all_labels])})
+            payload = {'labels': all_labels, 'charts': [{'id': f"chart_{metric['key']}", 'title': metric['label'], 'series': series}]}
+    return jsonify(payload)
+
+@app.route('/api/rollup')
+@login_required
+@read_replica
+@conditional_report(KPIRollup, KPI3G, KPI4G, KPI5G)
+def api_rollup():
+    """Drill-down network → tỉnh → RNC/gNodeB → cell. Tham số: tech, tinh, controller, vendor, days (mặc định 30, 'all' = toàn bộ)."""
+    tech = request.args.get('tech', '4g')
+    if tech not in KPI_MODELS: return jsonify({'error': 'invalid tech'}), 400
+    tinh, controller, vendor = (request.args.get(k, '').strip() for k in ('tinh', 'controller', 'vendor'))
+    days_arg = request.args.get('days', '30')
+    level = 'controller' if tinh and controller else ('province' if tinh else 'network')
+    child_level, child_col = ROLLUP_LEVELS[level]
+
+    filters = [KPIRollup.tech == tech]
+    if tinh: filters.append(KPIRollup.tinh == tinh)
+    if controller: filters.append(KPIRollup.controller == controller)
+    if vendor: filters.append(KPIRollup.nha_cung_cap == vendor)
+    last_day = db.session.query(func.max(KPIRollup.day)).filter(*filters).scalar()
+    if last_day and days_arg.isdigit() and int(days_arg) > 0: filters.append(KPIRollup.day > last_day - timedelta(days=int(days_arg)))
+
+    series_rows = db.session.query(KPIRollup.day, *rollup_columns()).filter(*filters).group_by(KPIRollup.day).order_by(KPIRollup.day).all()
+    labels = [r[0].strftime('%d/%m/%Y') for r in series_rows]
+    points = [rollup_values(r, 1) for r in series_rows]
+    series = {m: [p[m] for p in points] for m in ['cells'] + list(ROLLUP_MEASURES)}
+
+    if child_col:
+        col = getattr(KPIRollup, child_col)
+        children = [dict(rollup_values(r, 1), name=r[0]) for r in db.session.query(col, *rollup_columns()).filter(*filters).group_by(col).all()]
+    else:
+        # Cấp cuối: đọc bảng KPI per-cell nhưng chỉ trong phạm vi một RNC/gNodeB và các ngày của khoảng đang xem
+        Model = KPI_MODELS[tech]
+        cols = [func.count(Model.id)]
+        for m, mcols in ROLLUP_MEASURES.items():
+            c = getattr(Model, mcols[tech]) if tech in mcols else None
+            cols += [func.sum(c), func.count(c)] if c is not None else [literal(0), literal(0)]
+        q = db.session.query(Model.ten_cell, *cols).filter(Model.tinh == tinh, getattr(Model, ROLLUP_CONTROLLER[tech]) == controller)
+        if vendor: q = q.filter(Model.nha_cung_cap == vendor)
+        if labels: q = q.filter(Model.thoi_gian.in_(labels))
+        children = [dict(rollup_values(r, 1), name=r[0]) for r in q.group_by(Model.ten_cell).all()]
+    children.sort(key=lambda x: x['traffic'] or 0, reverse=True)
+    return jsonify({'tech': tech, 'level': level, 'child_level': child_level, 'path': {'tinh': tinh, 'controller': controller, 'vendor': vendor},
+                    'labels': labels, 'series': series, 'children': children})
 
 @app.route('/qoe-qos')
 @login_required
+@conditional_report(QoE4G, QoS4G, QoEQoSSchema)
 def qoe_qos():
     cell_name_input = request.args.get('cell_name', '').strip()
-    charts = {}
-    has_data = False
-    qoe_details, qos_details, qoe_headers, qos_headers = [], [], [], []
-    
+    chart_cards = []
+    has_qoe_details, has_qos_details = False, False
+
     if cell_name_input:
-        qoe_records = QoE4G.query.filter(QoE4G.cell_name.ilike(f"%{cell_name_input}%")).order_by(QoE4G.id.asc()).all()
-        qos_records = QoS4G.query.filter(QoS4G.cell_name.ilike(f"%{cell_name_input}%")).order_by(QoS4G.id.asc()).all()
-        
-        if qoe_records or qos_records:
-            has_data = True
-            all_weeks = sorted(list(set([r.week_name for r in qoe_records] + [r.week_name for r in qos_records])))
-            
-            if qoe_records:
-                qoe_score_map = {r.week_name: (r.qoe_score or 0) for r in qoe_records}
-                qoe_percent_map = {r.week_name: (r.qoe_percent or 0) for r in qoe_records}
-                charts['qoe_score_chart'] = {'title': 'Biểu đồ Điểm QoE', 'labels': all_weeks, 'datasets': [{'label': 'Điểm QoE (1-5)', 'data': [qoe_score_map.get(w, None) for w in all_weeks], 'borderColor': '#0078d4', 'fill': False, 'borderWidth': 3}]}
-                charts['qoe_percent_chart'] = {'title': 'Biểu đồ Tỷ lệ QoE (%)', 'labels': all_weeks, 'datasets': [{'label': '% QoE', 'data': [qoe_percent_map.get(w, None) for w in all_weeks], 'borderColor': '#107c10', 'fill': False, 'borderWidth': 3}]}
-                for r in qoe_records:
-                    if r.details:
-                        try:
-                            d = json.loads(r.details)
-                            if not qoe_headers: qoe_headers = list(d.keys())
-                            qoe_details.append({'week': r.week_name, 'data': d})
-                        except: pass
-            
-            if qos_records:
-                qos_score_map = {r.week_name: (r.qos_score or 0) for r in qos_records}
-                qos_percent_map = {r.week_name: (r.qos_percent or 0) for r in qos_records}
-                charts['qos_score_chart'] = {'title': 'Biểu đồ Điểm QoS', 'labels': all_weeks, 'datasets': [{'label': 'Điểm QoS (1-5)', 'data': [qos_score_map.get(w, None) for w in all_weeks], 'borderColor': '#ffaa44', 'fill': False, 'borderWidth': 3}]}
-                charts['qos_percent_chart'] = {'title': 'Biểu đồ Tỷ lệ QoS (%)', 'labels': all_weeks, 'datasets': [{'label': '% QoS', 'data': [qos_percent_map.get(w, None) for w in all_weeks], 'borderColor': '#e3008c', 'fill': False, 'borderWidth': 3}]}
-                for r in qos_records:
-                    if r.details:
-                        try:
-                            d = json.loads(r.details)
-                            if not qos_headers: qos_headers = list(d.keys())
-                            qos_details.append({'week': r.week_name, 'data': d})
-                        except: pass
-    gc.collect()
-    return render_template('content.html', title="QoE & QoS Analytics", active_page='qoe_qos', cell_name_input=cell_name_input, charts=charts, has_data=has_data, qoe_details=qoe_details, qos_details=qos_details, qoe_headers=qoe_headers, qos_headers=qos_headers)
+        # Chỉ kiểm tra có dữ liệu hay không; biểu đồ tải qua /api/charts/qoe-qos, bảng gốc qua /api/qoe-qos/details
+        has_qoe_details = db.session.query(QoE4G.id).filter(cell_index.match(QoE4G.cell_name, cell_name_input)).first() is not None
+        has_qos_details = db.session.query(QoS4G.id).filter(cell_index.match(QoS4G.cell_name, cell_name_input)).first() is not None
+        for kind, enabled in (('qoe', has_qoe_details), ('qos', has_qos_details)):
+            if enabled: chart_cards += [{'id': cid, 'title': title, 'src': url_for('api_chart_qoe_qos', kind=kind, cell_name=cell_name_input)} for cid, title, _, _, _ in QOE_QOS_CHARTS[kind]]
+    has_data = has_qoe_details or has_qos_details
+    return render_template('content.html', title="QoE & QoS Analytics", active_page='qoe_qos', cell_name_input=cell_name_input, chart_cards=chart_cards, has_data=has_data, has_qoe_details=has_qoe_details, has_qos_details=has_qos_details)
+
+@app.route('/api/charts/qoe-qos')
+@login_required
+@conditional_report(QoE4G, QoS4G, QoEQoSSchema)
+def api_chart_qoe_qos():
+    cell_name_input = request.args.get('cell_name', '').strip()
+    kind = request.args.get('kind', 'qoe')
+    Model = {'qoe': QoE4G, 'qos': QoS4G}.get(kind)
+    if not Model: return jsonify({'error': 'invalid kind'}), 400
+    score_col, percent_col = (Model.qoe_score, Model.qoe_percent) if kind == 'qoe' else (Model.qos_score, Model.qos_percent)
+    payload = {'labels': [], 'charts': []}
+    if cell_name_input:
+        records = db.session.query(Model.week_name, score_col, percent_col).filter(cell_index.match(Model.cell_name, cell_name_input)).order_by(Model.id.asc()).all()
+        if records:
+            all_weeks = sorted({r[0] for r in records})
+            values = {'score': {r[0]: (r[1] or 0) for r in records}, 'percent': {r[0]: (r[2] or 0) for r in records}}
+            payload = {'labels': all_weeks, 'charts': [{'id': cid, 'title': title, 'series': [{'label': label, 'color': color, 'width': 3, 'data': round_series([values[field].get(w) for w in all_weeks])}]} for cid, title, label, color, field in QOE_QOS_CHARTS[kind]]}
+    return jsonify(payload)
+
+@app.route('/api/qoe-qos/details')
+@login_required
+def api_qoe_qos_details():
+    cell_name_input = request.args.get('cell_name', '').strip()
+    Model = {'qoe': QoE4G, 'qos': QoS4G}.get(request.args.get('kind', 'qoe'))
+    if not Model or not cell_name_input: return jsonify({'headers': [], 'rows': []})
+    records = db.session.query(Model.week_name, Model.schema_id, Model.detail_values, Model.details).filter(cell_index.match(Model.cell_name, cell_name_input)).order_by(Model.id.asc()).all()
+    schema_ids = {r.schema_id for r in records if r.schema_id}
+    schemas = {sc.id: json.loads(sc.headers) for sc in QoEQoSSchema.query.filter(QoEQoSSchema.id.in_(schema_ids)).all()} if schema_ids else {}
+    headers, header_pos, rows = [], {}, []
+    for r in records:
+        try:
+            if r.schema_id and r.detail_values: d = dict(zip(schemas.get(r.schema_id, []), json.loads(r.detail_values)))
+            elif r.details: d = json.loads(r.details)
+            else: continue
+        except (ValueError, TypeError): continue
+        for k, v in d.items():
+            if k not in header_pos and v is not None:
+                header_pos[k] = len(headers); headers.append(k)
+        rows.append((r.week_name, d))
+    return jsonify({'headers': headers, 'rows': [[week] + [d.get(k) for k in headers] for week, d in rows]})
 
 @app.route('/poi')
 @login_required
+@read_replica
+@conditional_report(POI4G, POI5G, KPI4G, KPI5G)
 def poi():
     pname = request.args.get('poi_name', '').strip()
-    charts = {}
     pois = []
     try:
         p4 = [r[0] for r in db.session.query(POI4G.poi_name).distinct()]
         p5 = [r[0] for r in db.session.query(POI5G.poi_name).distinct()]
         pois = sorted(list(set(p4 + p5)))
     except: pass
-    
+    chart_cards = []
     if pname:
-        c4 = [r[0] for r in db.session.query(POI4G.cell_code).filter_by(poi_name=pname).all()]
-        c5 = [r[0] for r in db.session.query(POI5G.cell_code).filter_by(poi_name=pname).all()]
-        
-        if c4:
-            k4 = db.session.query(KPI4G.thoi_gian, KPI4G.traffic, KPI4G.user_dl_avg_thput).filter(KPI4G.ten_cell.in_(c4)).all()
-            if k4:
-                try: k4.sort(key=lambda x: datetime.strptime(x.thoi_gian, '%d/%m/%Y'))
-                except: pass
-                dates4 = sorted(list(set(x.thoi_gian for x in k4)), key=lambda x: datetime.strptime(x, '%d/%m/%Y'))
-                agg_traf, agg_thput = defaultdict(float), defaultdict(list)
-                for r in k4:
-                    if r.thoi_gian in dates4:
-                        agg_traf[r.thoi_gian] += (r.traffic or 0)
-                        if r.user_dl_avg_thput is not None: agg_thput[r.thoi_gian].append(r.user_dl_avg_thput)
-
-                ds_traf_agg = [{'label': 'Total 4G Traffic (GB)', 'data': [agg_traf[d] for d in dates4], 'borderColor': 'blue', 'fill': False, 'borderWidth': 3, 'spanGaps': True}]
-                ds_thput_agg = [{'label': 'Avg 4G Thput (Mbps)', 'data': [(sum(agg_thput[d])/len(agg_thput[d])) if agg_thput[d] else 0 for d in dates4], 'borderColor': 'green', 'fill': False, 'borderWidth': 3, 'spanGaps': True}]
-
-                charts['4g_traf'] = {'title': 'Total 4G Traffic (GB)', 'labels': dates4, 'datasets': ds_traf_agg}
-                charts['4g_thp'] = {'title': 'Avg 4G Thput (Mbps)', 'labels': dates4, 'datasets': ds_thput_agg}
-        
-        if c5:
-            k5 = db.session.query(KPI5G.thoi_gian, KPI5G.traffic, KPI5G.user_dl_avg_throughput).filter(KPI5G.ten_cell.in_(c5)).all()
-            if k5:
-                try: k5.sort(key=lambda x: datetime.strptime(x.thoi_gian, '%d/%m/%Y'))
-                except: pass
-                dates5 = sorted(list(set(x.thoi_gian for x in k5)), key=lambda x: datetime.strptime(x, '%d/%m/%Y'))
-                agg_traf5, agg_thput5 = defaultdict(float), defaultdict(list)
-                for r in k5:
-                    if r.thoi_gian in dates5:
-                        agg_traf5[r.thoi_gian] += (r.traffic or 0)
-                        if r.user_dl_avg_throughput is not None: agg_thput5[r.thoi_gian].append(r.user_dl_avg_throughput)
-                
-                ds_traf_agg5 = [{'label': 'Total 5G Traffic (GB)', 'data': [agg_traf5[d] for d in dates5], 'borderColor': 'orange', 'fill': False, 'borderWidth': 3, 'spanGaps': True}]
-                ds_thput_agg5 = [{'label': 'Avg 5G Thput (Mbps)', 'data': [(sum(agg_thput5[d])/len(agg_thput5[d])) if agg_thput5[d] else 0 for d in dates5], 'borderColor': 'purple', 'fill': False, 'borderWidth': 3, 'spanGaps': True}]
-                
-                charts['5g_traf'] = {'title': 'Total 5G Traffic (GB)', 'labels': dates5, 'datasets': ds_traf_agg5}
-                charts['5g_thp'] = {'title': 'Avg 5G Thput (Mbps)', 'labels': dates5, 'datasets': ds_thput_agg5}
+        chart_cards = [{'id': cid, 'title': title, 'src': url_for('api_chart_poi', poi_name=pname, tech=tech)} for tech, charts in POI_CHARTS.items() for cid, title, _ in charts]
+    return render_template('content.html', title="POI Report", active_page='poi', poi_list=pois, selected_poi=pname, chart_cards=chart_cards)
 
-    gc.collect()
-    return render_template('content.html', title="POI Report", active_page='poi', poi_list=pois, selected_poi=pname, poi_charts=charts)
+@app.route('/api/charts/poi')
+@login_required
+@read_replica
+@conditional_report(POI4G, POI5G, KPI4G, KPI5G)
+def api_chart_poi():
+    pname = request.args.get('poi_name', '').strip()
+    tech = request.args.get('tech', '4g')
+    POI_Model, KPI_Model = {'4g': (POI4G, KPI4G), '5g': (POI5G, KPI5G)}.get(tech, (None, None))
+    if not POI_Model: return jsonify({'error': 'invalid tech'}), 400
+    thput_col = KPI_Model.user_dl_avg_thput if tech == '4g' else KPI_Model.user_dl_avg_throughput
+    payload = {'labels': [], 'charts': []}
+    if pname:
+        # Nối POI → KPI qua cell_key (semi-join có index) và gộp theo ngày ngay trong SQL
+        poi_keys = select(POI_Model.cell_key).where(POI_Model.poi_name == pname)
+        records = db.session.query(KPI_Model.thoi_gian, func.sum(KPI_Model.traffic), func.avg(thput_col)).filter(KPI_Model.cell_key.in_(poi_keys)).group_by(KPI_Model.thoi_gian).all()
+        agg = {day: (traffic or 0, thput or 0) for day, traffic, thput in records if day}
+        try: dates = sorted(agg, key=lambda x: datetime.strptime(x, '%d/%m/%Y'))
+        except ValueError: dates = sorted(agg)
+        if dates:
+            values = {'traffic': [agg[d][0] for d in dates], 'thput': [agg[d][1] for d in dates]}
+            payload = {'labels': dates, 'charts': [{'id': cid, 'title': title, 'series': [{'label': title, 'color': color, 'width': 3, 'data': round_series(values[field])}]} for (cid, title, field), color in zip(POI_CHARTS[tech], POI_CHART_COLORS[tech])]}
+    return jsonify(payload)
 
 @app.route('/conges-3g')
 @login_required
+@read_replica
+@conditional_report(KPI3G)
 def conges_3g():
     conges_data, target_dates = [], []
     action = request.args.get('action')
@@ -1150,6 +2828,7 @@ def conges_3g():
     gc.collect()
 
     if action == 'export':
+        import pandas as pd
         df = pd.DataFrame(conges_data)
         output = BytesIO()
         with pd.ExcelWriter(output, engine='openpyxl') as writer: df.to_excel(writer, index=False, sheet_name='Congestion 3G')
@@ -1159,6 +2838,8 @@ def conges_3g():
 
 @app.route('/worst-cell')
 @login_required
+@read_replica
+@conditional_report(KPI4G, RF4G)
 def worst_cell():
     duration = int(request.args.get('duration', 1))
     action = request.args.get('action')
@@ -1169,18 +2850,19 @@ def worst_cell():
     results = []
     if target_dates:
         latest_date = target_dates[0]
-        l900_cells = {c[0] for c in db.session.query(RF4G.cell_code).filter(RF4G.frequency.ilike('%L900%')).all()}
+        # Loại cell L900 bằng anti-join RF4G trên cell_key trong SQL
+        l900_keys = select(RF4G.cell_key).where(RF4G.frequency.ilike('%L900%'), RF4G.cell_key.isnot(None))
         active_latest_cells = {c[0] for c in db.session.query(KPI4G.ten_cell).filter(KPI4G.thoi_gian == latest_date).all()}
 
         records = db.session.query(KPI4G.ten_cell, KPI4G.user_dl_avg_thput, KPI4G.res_blk_dl, KPI4G.cqi_4g, KPI4G.service_drop_all).filter(
             KPI4G.thoi_gian.in_(target_dates),
-            ~KPI4G.ten_cell.startswith('MBF_TH'), ~KPI4G.ten_cell.startswith('VNP-4G'),
+            ~KPI4G.ten_cell.startswith('MBF_TH'), ~KPI4G.ten_cell.startswith('VNP-4G'), ~KPI4G.cell_key.in_(l900_keys),
             ((KPI4G.user_dl_avg_thput < 7000) | (KPI4G.res_blk_dl > 20) | (KPI4G.cqi_4g < 93) | (KPI4G.service_drop_all > 0.3))
         ).all()
     
         groups = defaultdict(list)
         for r in records: 
-            if r.ten_cell in active_latest_cells and r.ten_cell not in l900_cells:
+            if r.ten_cell in active_latest_cells:
                 groups[r.ten_cell].append(r)
         
         for cell, rows in groups.items():
@@ -1196,6 +2878,7 @@ def worst_cell():
     gc.collect()
     
     if action == 'export':
+        import pandas as pd
         df = pd.DataFrame(results)
         output = BytesIO()
         with pd.ExcelWriter(output, engine='openpyxl') as writer: df.to_excel(writer, index=False, sheet_name='Worst Cells')
@@ -1206,6 +2889,8 @@ def worst_cell():
 
 @app.route('/traffic-down')
 @login_required
+@read_replica
+@conditional_report(KPI3G, KPI4G, KPI5G, POI4G, POI5G, RF3G, RF4G, RF5G)
 def traffic_down():
     tech = request.args.get('tech', '4g')
     action = request.args.get('action')
@@ -1242,13 +2927,11 @@ def traffic_down():
                         degraded.append({'cell_name': cell, 'traffic_today': round(t0,3), 'traffic_last_week': round(t_last,3), 'degrade_percent': round((1-t0/t_last)*100, 1)})
                 
                 if POI_Model:
-                    poi_map = {r.cell_code: r.poi_name for r in db.session.query(POI_Model).all()}
+                    # Tổng traffic theo POI: nối POI ↔ KPI trên cell_key trong SQL
                     poi_traffic = defaultdict(lambda: {'today': 0, 'last_week': 0})
-                    for cell, d_map in data_map.items():
-                        if cell in poi_map:
-                            p_name = poi_map[cell]
-                            poi_traffic[p_name]['today'] += d_map.get(latest, 0)
-                            poi_traffic[p_name]['last_week'] += d_map.get(last_week, 0)
+                    day_keys = {latest.strftime('%d/%m/%Y'): 'today', last_week.strftime('%d/%m/%Y'): 'last_week'}
+                    poi_rows = db.session.query(POI_Model.poi_name, Model.thoi_gian, func.sum(Model.traffic)).join(Model, Model.cell_key == POI_Model.cell_key).filter(Model.thoi_gian.in_(list(day_keys)), ~Model.ten_cell.startswith('MBF_TH'), ~Model.ten_cell.startswith('VNP-4G')).group_by(POI_Model.poi_name, Model.thoi_gian).all()
+                    for p_name, day, traffic in poi_rows: poi_traffic[p_name][day_keys[day]] += traffic or 0
                     for pname, traf in poi_traffic.items():
                         t0 = traf['today']
                         t_last = traf['last_week']
@@ -1257,6 +2940,7 @@ def traffic_down():
 
         gc.collect()
 
+        if action in ('export_zero', 'export_degraded', 'export_poi_degraded'): import pandas as pd
         if action == 'export_zero':
             df = pd.DataFrame(zero_traffic)
             output = BytesIO()
@@ -1278,49 +2962,70 @@ def traffic_down():
 
     return render_template('content.html', title="Traffic Down", active_page='traffic_down', zero_traffic=zero_traffic, degraded=degraded, degraded_pois=degraded_pois, tech=tech, analysis_date=analysis_date)
 
+def rf_query(tech, search_query=''):
+    # Mỗi cell_code chỉ lấy bản ghi đầu tiên (MIN(id)), khử trùng lặp ngay trong SQL thay vì bằng set Python
+    Model = {'3g': RF3G, '4g': RF4G, '5g': RF5G}.get(tech)
+    first_ids = select(func.min(Model.id)).group_by(Model.cell_code)
+    if search_query: first_ids = first_ids.where(or_(cell_index.match(Model.cell_code, search_query), cell_index.match(Model.site_code, search_query)))
+    return Model, Model.query.filter(Model.id.in_(first_ids))
+
+def rf_page_args(Model):
+    cols = [c.key for c in Model.__table__.columns if c.key not in INTERNAL_COLUMNS]
+    sort_key = request.args.get('sort', 'id')
+    if sort_key not in cols: sort_key = 'id'
+    order = 'desc' if request.args.get('order') == 'desc' else 'asc'
+    try: limit = max(1, min(int(request.args.get('limit', 100)), 1000))
+    except ValueError: limit = 100
+    return cols, sort_key, order, limit
+
 @app.route('/rf')
 @login_required
 def rf():
     tech = request.args.get('tech', '4g')
     action = request.args.get('action')
     search_query = request.args.get('cell_search', '').strip()
-    Model = {'3g': RF3G, '4g': RF4G, '5g': RF5G}.get(tech)
-    
-    query = Model.query
-    if search_query:
-        query = query.filter(or_(Model.cell_code.ilike(f"%{search_query}%"), Model.site_code.ilike(f"%{search_query}%")))
+    Model, query = rf_query(tech, search_query)
+    cols, sort_key, order, limit = rf_page_args(Model)
         
     if action == 'export':
         def generate():
             yield '\ufeff'.encode('utf-8')
-            cols = [c.key for c in Model.__table__.columns if c.key not in ['id', 'extra_data']]
-            yield (','.join(cols) + '\n').encode('utf-8')
-            seen_export = set()
-            for row in query.all():
-                if row.cell_code not in seen_export:
-                    seen_export.add(row.cell_code)
-                    yield (','.join([str(getattr(row, c) or '').replace(',', ';') for c in cols]) + '\n').encode('utf-8')
+            buf = StringIO()
+            writer = csv.writer(buf)
+            writer.writerow(cols)
+            stmt = query.with_entities(*[getattr(Model, c) for c in cols]).order_by(Model.id).statement
+            # Server-side cursor: đọc từng lô 1000 dòng, không nạp toàn bộ bảng vào RAM
+            result = db.session.execute(stmt.execution_options(stream_results=True, yield_per=1000))
+            for chunk in result.partitions():
+                writer.writerows([['' if v is None else v for v in row] for row in chunk])
+                yield buf.getvalue().encode('utf-8')
+                buf.seek(0); buf.truncate(0)
+            result.close()
         return Response(stream_with_context(generate()), mimetype='text/csv', headers={"Content-Disposition": f"attachment; filename=RF_{tech}.csv"})
 
-    rows = query.limit(100 if not search_query else 1000).all()
-    cols = [c.key for c in Model.__table__.columns if c.key not in ['id', 'extra_data']]
-    data = []
-    seen_cells = set()
-    
-    for r in rows:
-        if r.cell_code not in seen_cells:
-            seen_cells.add(r.cell_code)
-            data.append({c: getattr(r, c) for c in cols} | {'id': r.id})
-                
-    return render_template('content.html', title="RF Database", active_page='rf', current_tech=tech, rf_columns=cols, rf_data=data, search_query=search_query)
+    rows, next_cursor = keyset_page(query, Model, sort_key, order, request.args.get('cursor'), limit)
+    data = [{c: getattr(r, c) for c in cols} | {'id': r.id} for r in rows]
+    return render_template('content.html', title="RF Database", active_page='rf', current_tech=tech, rf_columns=cols, rf_data=data, search_query=search_query, sort_key=sort_key, sort_order=order, page_limit=limit, next_cursor=next_cursor, is_first_page=not request.args.get('cursor'))
+
+@app.route('/api/rf')
+@login_required
+def api_rf():
+    tech = request.args.get('tech', '4g')
+    if tech not in ['3g', '4g', '5g']: return jsonify({'error': 'invalid tech'}), 400
+    Model, query = rf_query(tech, request.args.get('cell_search', '').strip())
+    cols, sort_key, order, limit = rf_page_args(Model)
+    rows, next_cursor = keyset_page(query, Model, sort_key, order, request.args.get('cursor'), limit)
+    return jsonify({'columns': ['id'] + cols, 'rows': [[r.id] + [getattr(r, c) for c in cols] for r in rows], 'sort': sort_key, 'order': order, 'next_cursor': next_cursor})
 
 @app.route('/rf/delete/<tech>/<int:id>')
 @login_required
 def rf_delete(tech, id):
     if current_user.role != 'admin': return redirect(url_for('rf', tech=tech))
     Model = {'3g': RF3G, '4g': RF4G, '5g': RF5G}.get(tech)
-    db.session.delete(db.session.get(Model, id))
-    db.session.commit()
+    obj, prev_version = db.session.get(Model, id), rf_version(tech)
+    old_key, old_point = obj.cell_key, (obj.latitude, obj.longitude)
+    db.session.delete(obj)
+    db.session.commit(); cell_index.invalidate(); bump_data_version(Model.__tablename__); update_pci_cell(tech, id, {old_key}, prev_version); update_rf_cell(tech, id, {old_key}, [old_point], prev_version)
     flash('Đã xóa', 'success')
     return redirect(url_for('rf', tech=tech))
 
@@ -1329,7 +3034,7 @@ def rf_delete(tech, id):
 def rf_detail(tech, id):
     Model = {'3g': RF3G, '4g': RF4G, '5g': RF5G}.get(tech)
     obj = db.session.get(Model, id)
-    clean_obj = {k: v for k, v in obj.__dict__.items() if not k.startswith('_')}
+    clean_obj = {k: v for k, v in obj.__dict__.items() if not k.startswith('_') and k != 'cell_key'}
     return render_template('rf_detail.html', obj=clean_obj, tech=tech)
 
 @app.route('/rf/add', methods=['GET', 'POST'])
@@ -1339,10 +3044,11 @@ def rf_add():
     tech = request.args.get('tech', '3g')
     Model = {'3g': RF3G, '4g': RF4G, '5g': RF5G}.get(tech)
     if request.method == 'POST':
-        data = {k: v for k, v in request.form.items() if k in Model.__table__.columns.keys()}
-        db.session.add(Model(**data)); db.session.commit(); flash('Added', 'success')
+        data = {k: v for k, v in request.form.items() if k in Model.__table__.columns.keys() and k != 'cell_key'}
+        obj, prev_version = Model(**data), rf_version(tech)
+        db.session.add(obj); db.session.commit(); cell_index.invalidate(); bump_data_version(Model.__tablename__); update_pci_cell(tech, obj.id, set(), prev_version); update_rf_cell(tech, obj.id, set(), [], prev_version); flash('Added', 'success')
         return redirect(url_for('rf', tech=tech))
-    cols = [c.key for c in Model.__table__.columns if c.key != 'id']
+    cols = [c.key for c in Model.__table__.columns if c.key not in ('id', 'cell_key')]
     return render_template('rf_form.html', title=f"Add RF {tech}", columns=cols, tech=tech, obj={})
 
 @app.route('/rf/edit/<tech>/<int:id>', methods=['GET', 'POST'])
@@ -1352,11 +3058,128 @@ def rf_edit(tech, id):
     Model = {'3g': RF3G, '4g': RF4G, '5g': RF5G}.get(tech)
     obj = db.session.get(Model, id)
     if request.method == 'POST':
+        old_key, old_point, prev_version = obj.cell_key, (obj.latitude, obj.longitude), rf_version(tech)
         for k,v in request.form.items(): setattr(obj, k, v)
-        db.session.commit(); flash('Updated', 'success'); return redirect(url_for('rf', tech=tech))
-    cols = [c.key for c in Model.__table__.columns if c.key != 'id']
+        db.session.commit(); cell_index.invalidate(); bump_data_version(Model.__tablename__); update_pci_cell(tech, id, {old_key}, prev_version); update_rf_cell(tech, id, {old_key}, [old_point], prev_version); flash('Updated', 'success'); return redirect(url_for('rf', tech=tech))
+    cols = [c.key for c in Model.__table__.columns if c.key not in ('id', 'cell_key')]
     return render_template('rf_form.html', title=f"Edit RF {tech}", columns=cols, tech=tech, obj=obj.__dict__)
 
+@app.route('/pci')
+@login_required
+@read_replica
+@conditional_report(RF4G, RF5G)
+def pci():
+    tech = request.args.get('tech', '4g')
+    if tech not in PCI_TECHS: tech = '4g'
+    kind = request.args.get('kind', '')
+    search_query = request.args.get('cell_search', '').strip()
+    state = get_pci_conflicts(tech)
+    summary = {k: 0 for k in PCI_KIND_LABELS}
+    summary.update({k: n for k, n in db.session.query(PCIConflict.kind, func.count(PCIConflict.id)).filter(PCIConflict.tech == tech).group_by(PCIConflict.kind)})
+    query = pci_query(tech)
+    if kind in PCI_KIND_LABELS: query = query.filter(PCIConflict.kind == kind)
+    if search_query:
+        key = normalize_cell_key(search_query)
+        query = query.filter(or_(PCIConflict.cell_key.startswith(key), PCIConflict.other_key.startswith(key)))
+
+    if request.args.get('action') == 'export':
+        import pandas as pd
+        df = pd.DataFrame([{'Loại': PCI_KIND_LABELS[r.kind], 'Lớp tần số': r.layer, 'Cell': r.cell_code, 'Site': r.site_code, 'PCI': r.pci, 'Cell xung đột': r.other_cell, 'Site xung đột': r.other_site, 'PCI xung đột': r.other_pci, 'Khoảng cách (m)': r.distance} for r in query.all()])
+        output = BytesIO()
+        with pd.ExcelWriter(output, engine='openpyxl') as writer: df.to_excel(writer, index=False, sheet_name=f'PCI_{tech.upper()}')
+        output.seek(0)
+        return send_file(output, download_name=f'PCI_{tech.upper()}.xlsx', as_attachment=True)
+
+    return render_template('content.html', title="Kiểm tra PCI", active_page='pci', tech=tech, kind=kind, search_query=search_query, pci_state=state, pci_stale=rf_stale(state, tech), pci_summary=summary, pci_labels=PCI_KIND_LABELS,
+                           pci_rows=query.limit(PCI_PAGE).all(), pci_page=PCI_PAGE, collision_distance=PCI_COLLISION_DISTANCE, neighbor_distance=PCI_NEIGHBOR_DISTANCE)
+
+# Mặc định của từng loại script (giống giá trị sẵn trên form): SRN gốc, slot (HSN), số RX/TX
+SCRIPT_TECHS = {'3g900': {'srn': 70, 'hsn': 2, 'rxnum': 2, 'txnum': 1}, '4g': {'srn': 60, 'hsn': 3, 'rxnum': 4, 'txnum': 4}, '3g2100': {'srn': 80, 'hsn': 3, 'rxnum': 2, 'txnum': 1}}
+SCRIPT_FIELDS = ['rn', 'srn', 'hsn', 'hpn', 'rcn', 'sectorid', 'rxnum', 'txnum']
+# Tên cột chấp nhận trong file kế hoạch (đã bỏ dấu, chữ thường, bỏ ký tự đặc biệt)
+SCRIPT_PLAN_COLUMNS = {'site': 'site', 'sitecode': 'site', 'manode': 'site', 'tram': 'site', 'tech': 'tech', 'congnghe': 'tech', 'rn': 'rn', 'rruname': 'rn', 'rru': 'rn',
+                       'srn': 'srn', 'hsn': 'hsn', 'slot': 'hsn', 'hpn': 'hpn', 'port': 'hpn', 'rcn': 'rcn', 'sectorid': 'sectorid', 'sector': 'sectorid',
+                       'rx': 'rxnum', 'rxnum': 'rxnum', 'tx': 'txnum', 'txnum': 'txnum'}
+
+def mml_rru_lines(tech, rn, srn, hsn, hpn, rcn, sectorid, rxnum, txnum):
+    lines = [f"ADD RRUCHAIN: RCN={rcn}, TT=CHAIN, BM=COLD, AT=LOCALPORT, HSRN=0, HSN={hsn}, HPN={hpn}, CR=AUTO, USERDEFRATENEGOSW=OFF;"]
+    rs_mode = "GU" if "900" in tech else "UO" if "2100" in tech else "LO"
+    if tech == '4g': rs_mode = "LO"
+    lines.append(f"ADD RRU: CN=0, SRN={srn}, SN=0, TP=TRUNK, RCN={rcn}, PS=0, RT=MRRU, RS={rs_mode}, RN={rn}, RXNUM={rxnum}, TXNUM={txnum}, MNTMODE=NORMAL, RFDCPWROFFALMDETECTSW=OFF, RFTXSIGNDETECTSW=OFF;")
+    
+    ant_num = rxnum
+    ant_str = f"ANT1CN=0, ANT1SRN={srn}, ANT1SN=0, ANT1N=R0A"
+    if int(ant_num) >= 2: ant_str += f", ANT2CN=0, ANT2SRN={srn}, ANT2SN=0, ANT2N=R0B"
+    if int(ant_num) >= 4: ant_str += f", ANT3CN=0, ANT3SRN={srn}, ANT3SN=0, ANT3N=R0C, ANT4CN=0, ANT4SRN={srn}, ANT4SN=0, ANT4N=R0D"
+    lines.append(f"ADD SECTOR: SECTORID={sectorid}, ANTNUM={ant_num}, {ant_str}, CREATESECTOREQM=FALSE;")
+    
+    ant_type_str = "ANTTYPE1=RXTX_MODE"
+    if int(ant_num) >= 2: ant_type_str += ", ANTTYPE2=RXTX_MODE"
+    if int(ant_num) >= 4: ant_type_str += ", ANTTYPE3=RXTX_MODE, ANTTYPE4=RXTX_MODE"
+    lines.append(f"ADD SECTOREQM: SECTOREQMID={sectorid}, SECTORID={sectorid}, ANTCFGMODE=ANTENNAPORT, ANTNUM={ant_num}, {ant_str.replace(f'ANT1SRN={srn}', 'ANT1SRN=0').replace(f'ANT2SRN={srn}', 'ANT2SRN=0').replace(f'ANT3SRN={srn}', 'ANT3SRN=0').replace(f'ANT4SRN={srn}', 'ANT4SRN=0')}, {ant_type_str};")
+    lines.append("")
+    return lines
+
+def read_script_plan(file_bytes, filename, default_tech):
+    """Đọc file kế hoạch (CSV/Excel, mỗi dòng một RRU) thành {(site, tech): [rru, ...]}; cột thiếu lấy mặc định theo thứ tự RRU trong site."""
+    import pandas as pd
+    if filename.lower().endswith('.csv'):
+        sample = file_bytes[:4096].decode('utf-8-sig', errors='ignore').split('\n')[0]
+        df = pd.read_csv(BytesIO(file_bytes), encoding='utf-8-sig', sep=',' if sample.count(',') >= sample.count(';') else ';', dtype=str)
+    else: df = pd.read_excel(BytesIO(file_bytes), dtype=str)
+    df = df.rename(columns=lambda c: SCRIPT_PLAN_COLUMNS.get(re.sub(r'[^a-z0-9]', '', remove_accents(str(c)).lower()), c))
+    if 'site' not in df.columns: raise ValueError('File kế hoạch thiếu cột Site')
+    sites = defaultdict(list)
+    for rec in df.where(df.notna(), None).to_dict('records'):
+        site = str(rec.get('site') or '').strip()
+        if not site: continue
+        tech = str(rec.get('tech') or default_tech).strip().lower()
+        sites[(site, tech)].append({f: rec.get(f) for f in SCRIPT_FIELDS})
+    return sites
+
+def rf_script_plan(site_codes, default_tech):
+    """Kế hoạch từ bảng RF: mỗi cell của site là một RRU (3G tách 900/2100 theo băng tần, 4G lấy RX/TX từ MIMO)."""
+    sites = defaultdict(list)
+    Model = RF4G if default_tech == '4g' else RF3G
+    mimo = Model.mimo if Model is RF4G else literal(None)
+    rows = db.session.query(Model.site_code, Model.cell_code, Model.frequency, mimo).filter(Model.site_code.in_(site_codes)).order_by(Model.site_code, Model.cell_code).all()
+    for site, cell, freq, mimo_val in rows:
+        tech = '4g' if Model is RF4G else ('3g900' if '900' in str(freq or '') else '3g2100')
+        rru = {'rn': cell}
+        m = re.match(r'(\d+)T(\d+)R', str(mimo_val or '').upper())
+        if m: rru.update({'txnum': m.group(1), 'rxnum': m.group(2)})
+        sites[(site, tech)].append(rru)
+    return sites
+
+def site_script(tech, rrus):
+    # RRU thứ k của site: SRN = SRN gốc + k, HPN = RCN = SECTORID = k nếu file/RF không ghi rõ
+    d = SCRIPT_TECHS[tech]
+    lines = []
+    for k, rru in enumerate(rrus):
+        vals = {'rn': rru.get('rn') or f'RRU{k + 1}', 'srn': d['srn'] + k, 'hsn': d['hsn'], 'hpn': k, 'rcn': k, 'sectorid': k, 'rxnum': d['rxnum'], 'txnum': d['txnum']}
+        vals.update({f: str(v).strip() for f, v in rru.items() if v is not None and str(v).strip() != ''})
+        for f in SCRIPT_FIELDS[1:]: vals[f] = int(float(vals[f]))
+        lines += mml_rru_lines(tech, **vals)
+    return "\n".join(lines)
+
+class ZipChunkSink:
+    # Đích ghi không seek được cho ZipFile: mỗi lần take() trả phần byte đã nén để stream ngay
+    def __init__(self): self._parts = []
+    def write(self, b): self._parts.append(bytes(b)); return len(b)
+    def flush(self): pass
+    def take(self):
+        data = b''.join(self._parts); self._parts = []
+        return data
+
+def stream_zip(files):
+    """files: iterable (tên, nội dung); sinh từng khối ZIP ngay sau mỗi file, không giữ cả archive trong RAM."""
+    sink = ZipChunkSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, content in files:
+            zf.writestr(name, content)
+            yield sink.take()
+    yield sink.take()
+
 @app.route('/script', methods=['GET', 'POST'])
 @login_required
 def script():
@@ -1374,26 +3197,63 @@ def script():
 
         lines = []
         for i in range(len(rns)):
-            lines.append(f"ADD RRUCHAIN: RCN={rcns[i]}, TT=CHAIN, BM=COLD, AT=LOCALPORT, HSRN=0, HSN={hsns[i]}, HPN={hpns[i]}, CR=AUTO, USERDEFRATENEGOSW=OFF;")
-            rs_mode = "GU" if "900" in tech else "UO" if "2100" in tech else "LO"
-            if tech == '4g': rs_mode = "LO"
-            lines.append(f"ADD RRU: CN=0, SRN={srns[i]}, SN=0, TP=TRUNK, RCN={rcns[i]}, PS=0, RT=MRRU, RS={rs_mode}, RN={rns[i]}, RXNUM={rxnums[i]}, TXNUM={txnums[i]}, MNTMODE=NORMAL, RFDCPWROFFALMDETECTSW=OFF, RFTXSIGNDETECTSW=OFF;")
-            
-            ant_num = rxnums[i]
-            ant_str = f"ANT1CN=0, ANT1SRN={srns[i]}, ANT1SN=0, ANT1N=R0A"
-            if int(ant_num) >= 2: ant_str += f", ANT2CN=0, ANT2SRN={srns[i]}, ANT2SN=0, ANT2N=R0B"
-            if int(ant_num) >= 4: ant_str += f", ANT3CN=0, ANT3SRN={srns[i]}, ANT3SN=0, ANT3N=R0C, ANT4CN=0, ANT4SRN={srns[i]}, ANT4SN=0, ANT4N=R0D"
-            lines.append(f"ADD SECTOR: SECTORID={secids[i]}, ANTNUM={ant_num}, {ant_str}, CREATESECTOREQM=FALSE;")
-            
-            ant_type_str = "ANTTYPE1=RXTX_MODE"
-            if int(ant_num) >= 2: ant_type_str += ", ANTTYPE2=RXTX_MODE"
-            if int(ant_num) >= 4: ant_type_str += ", ANTTYPE3=RXTX_MODE, ANTTYPE4=RXTX_MODE"
-            lines.append(f"ADD SECTOREQM: SECTOREQMID={secids[i]}, SECTORID={secids[i]}, ANTCFGMODE=ANTENNAPORT, ANTNUM={ant_num}, {ant_str.replace(f'ANT1SRN={srns[i]}', 'ANT1SRN=0').replace(f'ANT2SRN={srns[i]}', 'ANT2SRN=0').replace(f'ANT3SRN={srns[i]}', 'ANT3SRN=0').replace(f'ANT4SRN={srns[i]}', 'ANT4SRN=0')}, {ant_type_str};")
-            lines.append("") 
+            lines += mml_rru_lines(tech, rns[i], srns[i], hsns[i], hpns[i], rcns[i], secids[i], rxnums[i], txnums[i])
 
         script_result = "\n".join(lines)
 
-    return render_template('content.html', title="Generate Script", active_page='script', script_result=script_result)
+    return render_template('content.html', title="Generate Script", active_page='script', script_result=script_result, script_techs=SCRIPT_TECHS)
+
+@app.route('/script/batch', methods=['POST'])
+@login_required
+def script_batch():
+    # Tạo script cho nhiều site một lần (từ file kế hoạch hoặc danh sách site trong RF), trả về ZIP mỗi site một file
+    tech = request.form.get('tech', '4g')
+    if tech not in SCRIPT_TECHS: tech = '4g'
+    file = request.files.get('plan_file')
+    try:
+        if request.form.get('source') == 'rf':
+            site_codes = sorted({c.strip().upper() for c in re.split(r'[\s,;]+', request.form.get('sites', '')) if c.strip()})
+            plan = rf_script_plan(site_codes, '4g' if tech == '4g' else '3g') if site_codes else {}
+        elif file and file.filename: plan = read_script_plan(file.read(), file.filename, tech)
+        else: plan = {}
+    except Exception as e:
+        flash(f'Lỗi đọc kế hoạch: {e}', 'danger'); return redirect(url_for('script'))
+    if not plan:
+        flash('Không có site nào để tạo script.', 'warning'); return redirect(url_for('script'))
+
+    def files():
+        errors = []
+        for (site, site_tech), rrus in sorted(plan.items()):
+            if site_tech not in SCRIPT_TECHS: errors.append(f"{site}: loại script '{site_tech}' không hợp lệ ({', '.join(SCRIPT_TECHS)})"); continue
+            try: content = site_script(site_tech, rrus)
+            except (TypeError, ValueError) as e: errors.append(f"{site} ({site_tech}): {e}"); continue
+            yield f"{re.sub(r'[^A-Za-z0-9_-]', '_', site)}_{site_tech}.txt", content
+        if errors: yield '_errors.txt', "\n".join(errors)
+    download = f"Scripts_{tech}_{datetime.now():%Y%m%d_%H%M%S}.zip"
+    return Response(stream_with_context(stream_zip(files())), mimetype='application/zip', headers={'Content-Disposition': f'attachment; filename={download}'})
+
+@app.route('/admin/profiles', methods=['GET', 'POST'])
+@login_required
+def admin_profiles():
+    if current_user.role != 'admin': return redirect(url_for('index'))
+    if request.method == 'POST':
+        if request.form.get('action') == 'clear':
+            for item in list_profiles(): os.remove(os.path.join(PROFILE_DIR, item['name']))
+            flash('Đã xóa toàn bộ profile.', 'success')
+        else:
+            try: profiling['every_n'] = max(0, int(request.form.get('every_n', 0) or 0))
+            except ValueError: flash('N không hợp lệ.', 'danger')
+            if request.form.get('mode') in PROFILE_MODES: profiling['mode'] = request.form['mode']
+            flash(f"Lấy mẫu: {'tắt' if not profiling['every_n'] else 'mỗi %d request' % profiling['every_n']} ({profiling['mode']}), áp dụng cho worker hiện tại.", 'success')
+        return redirect(url_for('admin_profiles'))
+    return render_template('profiles.html', title="Profiling", active_page='profiles', profiles=list_profiles(), profiling=profiling, profile_modes=PROFILE_MODES, profile_dir=PROFILE_DIR)
+
+@app.route('/admin/profiles/<name>')
+@login_required
+def admin_profile_download(name):
+    if current_user.role != 'admin': return redirect(url_for('index'))
+    if not PROFILE_FILE_RE.match(name) or not os.path.exists(os.path.join(PROFILE_DIR, name)): return "Not found", 404
+    return send_file(os.path.join(PROFILE_DIR, name), as_attachment=True, download_name=name)
 
 @app.route('/backup', methods=['POST'])
 @login_required
@@ -1401,8 +3261,9 @@ def backup_db():
     if current_user.role != 'admin': return redirect(url_for('index'))
     selected_tables = request.form.getlist('tables')
     if not selected_tables: return redirect(url_for('backup_restore'))
+    import pandas as pd
     stream = BytesIO()
-    models_map = {'users.csv': User, 'rf3g.csv': RF3G, 'rf4g.csv': RF4G, 'rf5g.csv': RF5G, 'poi4g.csv': POI4G, 'poi5g.csv': POI5G, 'kpi3g.csv': KPI3G, 'kpi4g.csv': KPI4G, 'kpi5g.csv': KPI5G, 'qoe_4g.csv': QoE4G, 'qos_4g.csv': QoS4G}
+    models_map = {'users.csv': User, 'rf3g.csv': RF3G, 'rf4g.csv': RF4G, 'rf5g.csv': RF5G, 'poi4g.csv': POI4G, 'poi5g.csv': POI5G, 'kpi3g.csv': KPI3G, 'kpi4g.csv': KPI4G, 'kpi5g.csv': KPI5G, 'qoe_4g.csv': QoE4G, 'qos_4g.csv': QoS4G, 'qoe_qos_schema.csv': QoEQoSSchema, 'npo_config.csv': NPOConfig}
     with zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED) as zf:
         for fname in selected_tables:
             if fname in models_map:
@@ -1420,10 +3281,12 @@ def restore_db():
     if current_user.role != 'admin': return redirect(url_for('index'))
     file = request.files['file']
     if file:
+        import pandas as pd
         try:
             file_bytes = BytesIO(file.read())
             with zipfile.ZipFile(file_bytes) as zf:
-                models = {'users.csv': User, 'rf3g.csv': RF3G, 'rf4g.csv': RF4G, 'rf5g.csv': RF5G, 'poi4g.csv': POI4G, 'poi5g.csv': POI5G, 'kpi3g.csv': KPI3G, 'kpi4g.csv': KPI4G, 'kpi5g.csv': KPI5G, 'qoe_4g.csv': QoE4G, 'qos_4g.csv': QoS4G}
+                models = {'users.csv': User, 'rf3g.csv': RF3G, 'rf4g.csv': RF4G, 'rf5g.csv': RF5G, 'poi4g.csv': POI4G, 'poi5g.csv': POI5G, 'kpi3g.csv': KPI3G, 'kpi4g.csv': KPI4G, 'kpi5g.csv': KPI5G, 'qoe_4g.csv': QoE4G, 'qos_4g.csv': QoS4G, 'qoe_qos_schema.csv': QoEQoSSchema, 'npo_config.csv': NPOConfig}
+                restored = [models[fname] for fname in zf.namelist() if fname in models]
                 for fname in zf.namelist():
                     if fname in models:
                         Model = models[fname]
@@ -1431,7 +3294,15 @@ def restore_db():
                         db.session.query(Model).delete()
                         records = [{k: (v if not pd.isna(v) else None) for k, v in r.items() if k in [c.key for c in Model.__table__.columns]} for r in df.to_dict('records')]
                         if records: db.session.bulk_insert_mappings(Model, records)
-                db.session.commit(); flash('Restore Success', 'success')
+                backfill_cell_keys(*[m for m in restored if m in CELL_KEY_SOURCES])
+                forget_imports(*restored)
+                # Bảng KPI raw bị thay toàn bộ: dựng lại cube kpi_rollup của công nghệ đó từ dữ liệu vừa restore
+                kpi_techs = [t for t, M in KPI_MODELS.items() if M in restored]
+                for t in kpi_techs: db.session.query(KPIRollup).filter(KPIRollup.tech == t).delete(synchronize_session=False)
+                db.session.commit()
+                for t in kpi_techs: rebuild_kpi_rollup(t)
+                cell_index.invalidate(); bump_data_version(*[m.__tablename__ for m in restored], *([KPIRollup.__tablename__] if kpi_techs else []))
+                refresh_rf_derived(*[t for t, M in RF_MODELS.items() if M in restored]); refresh_npo_diagnosis(); flash('Restore Success', 'success')
         except Exception as e: db.session.rollback(); flash(f'Error: {e}', 'danger')
     return redirect(url_for('backup_restore'))
 
@@ -1464,4 +3335,5 @@ def change_password():
     return redirect(url_for('profile'))
 
 if __name__ == '__main__':
+    init_database()
     app.run(debug=True)
@@ -0,0 +1,203 @@
+"""Sinh dữ liệu giả lập (RF, KPI, POI, QoE/QoS, ITS) đúng định dạng mà trang Import và GIS chấp nhận.
+
+Ví dụ:
+    python bench/generate_data.py --cells 30000 --days 365 --out bench/data
+
+Thư mục đầu ra có manifest.json mô tả từng file (loại import, tuần QoE/QoS, cell mẫu) để
+bench/run_benchmarks.py nạp lại theo đúng thứ tự.
+"""
+import os
+import json
+import argparse
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+VENDORS = ['Ericsson', 'Huawei', 'Nokia', 'ZTE']
+PROVINCE = 'Thanh Hoa'
+LAT_RANGE, LON_RANGE = (19.30, 20.60), (104.40, 106.10)
+BANDS_4G = ['L1800', 'L2100', 'L900', 'L2600']
+BANDS_3G = ['U2100', 'U900']
+
+
+def make_sites(rng, n_cells):
+    n_sites = max(1, int(np.ceil(n_cells / 3)))
+    sites = pd.DataFrame({
+        'site_code': [f'THA{i:05d}' for i in range(1, n_sites + 1)],
+        'lat': rng.uniform(*LAT_RANGE, n_sites).round(6),
+        'lon': rng.uniform(*LON_RANGE, n_sites).round(6),
+        'vendor': rng.choice(VENDORS, n_sites),
+        'site_idx': np.arange(1, n_sites + 1),
+    })
+    return sites
+
+
+def make_cells(sites, n_cells, suffix):
+    # 3 sector mỗi trạm, azimuth 0/120/240 có nhiễu nhỏ
+    cells = sites.loc[sites.index.repeat(3)].reset_index(drop=True).iloc[:n_cells].copy()
+    cells['sector'] = np.tile([1, 2, 3], len(sites))[:n_cells]
+    cells['cell_code'] = cells['site_code'] + f'_{suffix}' + cells['sector'].astype(str)
+    return cells
+
+
+def write_rf(rng, cells, tech, path):
+    n = len(cells)
+    azimuth = ((cells['sector'].to_numpy() - 1) * 120 + rng.integers(-15, 16, n)) % 360
+    m_t, e_t = rng.integers(0, 6, n), rng.integers(0, 10, n)
+    common = {
+        'Mã Node': cells['site_code'], 'Mã Cell': cells['cell_code'],
+        'Latitude': cells['lat'], 'Longitude': cells['lon'],
+        'Tên thiết bị': cells['vendor'] + ' ' + tech.upper(),
+        'Antenna high': rng.integers(18, 45, n), 'Azimuth': azimuth,
+        'Mechanical tilt': m_t, 'Electrical tilt': e_t, 'Total tilt': m_t + e_t,
+        'Loại anten': rng.choice(['Kathrein 80010', 'Huawei ATR4518', 'Commscope RV4'], n),
+        'Hãng SX': cells['vendor'],
+    }
+    if tech == '3g':
+        extra = {'Băng tần': rng.choice(BANDS_3G, n), 'DL PSC': rng.integers(0, 512, n), 'DL UARFCN': rng.choice([10562, 10587, 3011], n),
+                 'BSC/LAC': rng.integers(10000, 10100, n), 'CI': cells['site_idx'] * 10 + cells['sector']}
+    elif tech == '4g':
+        extra = {'Băng tần': rng.choice(BANDS_4G, n, p=[0.5, 0.2, 0.2, 0.1]), 'DL UARFCN': rng.choice([1300, 100, 3650, 3050], n), 'PCI': rng.integers(0, 504, n),
+                 'TAC': rng.integers(20000, 20100, n), 'ENodeB ID': cells['site_idx'] + 100000, 'LCRID': cells['sector'], 'MIMO': rng.choice(['2T2R', '4T4R'], n)}
+    else:
+        extra = {'Băng tần': 'N78', 'NRARFCN': 636666, 'PCI': rng.integers(0, 1008, n), 'TAC': rng.integers(20000, 20100, n),
+                 'gNodeB ID': cells['site_idx'] + 500000, 'LCRID': cells['sector'], 'MIMO': '64T64R', 'Đồng bộ': 'GPS'}
+    pd.DataFrame({**common, **extra}).to_csv(path, index=False, encoding='utf-8-sig')
+
+
+def kpi_day(rng, cells, tech, day, bad_mask, zero_mask):
+    n = len(cells)
+    base = {'Thời gian': day.strftime('%d/%m/%Y'), 'Nhà cung cấp': cells['vendor'].to_numpy(), 'Tỉnh': PROVINCE, 'Tên cell': cells['cell_code'].to_numpy()}
+    if tech == '3g':
+        cs = rng.lognormal(3.5, 0.6, n)
+        vals = {'Tên RNC': 'RNC_THA_' + (cells['site_idx'] % 4).astype(str).to_numpy(), 'TRAFFIC': cs, 'PSTRAFFIC': rng.lognormal(1.5, 0.7, n),
+                'CSSR': rng.uniform(98, 100, n), 'DCR': rng.uniform(0, 1, n), 'PS_CSSR': rng.uniform(97, 100, n), 'PS_DCR': rng.uniform(0, 1.5, n),
+                'HSDPA_THROUGHPUT': rng.normal(3000, 600, n), 'HSUPA_THROUGHPUT': rng.normal(800, 200, n),
+                'CS_SO_ATT': rng.integers(100, 5000, n), 'PS_SO_ATT': rng.integers(500, 20000, n),
+                'CSCONGES': np.where(bad_mask, rng.uniform(2, 10, n), rng.uniform(0, 0.5, n)), 'PSCONGES': np.where(bad_mask, rng.uniform(2, 10, n), rng.uniform(0, 0.5, n))}
+    elif tech == '4g':
+        traffic = rng.lognormal(2.7, 0.6, n)
+        vals = {'Tên RNC': 'ENB_THA', 'TRAFFIC': traffic, 'TRAFFIC_VOL_DL': traffic * 0.9, 'TRAFFIC_VOL_UL': traffic * 0.1,
+                'CELL_DL_AVG_THPUTS': rng.normal(40, 10, n), 'CELL_UL_AVG_THPUT': rng.normal(8, 2, n),
+                'USER_DL_AVG_THPUT': np.where(bad_mask, rng.uniform(2, 8, n), rng.normal(25, 6, n)), 'USER_UL_AVG_THPUT': rng.normal(4, 1, n),
+                'ERAB_SSRATE_ALL': rng.uniform(98.5, 100, n), 'SERVICE_DROP_ALL': np.where(bad_mask, rng.uniform(0.4, 2, n), rng.uniform(0, 0.25, n)),
+                'UNVAILABLE': rng.uniform(0, 0.2, n), 'RES_BLK_DL': np.where(bad_mask, rng.uniform(20, 95, n), rng.uniform(3, 18, n)),
+                'CQI_4G': np.where(bad_mask, rng.uniform(80, 92, n), rng.uniform(93, 99, n)), 'ENodeB ID': (cells['site_idx'] + 100000).to_numpy()}
+    else:
+        traffic = rng.lognormal(2.0, 0.7, n)
+        vals = {'Tên gNodeB': 'GNB_' + cells['site_code'].to_numpy(), 'TRAFFIC': traffic, 'DL_TRAFFIC_VOLUME_GB': traffic * 0.92, 'UL_TRAFFIC_VOLUME_GB': traffic * 0.08,
+                'CELL_DOWNLINK_AVERAGE_THROUGHPUT': rng.normal(300, 60, n), 'CELL_UPLINK_AVERAGE_THROUGHPUT': rng.normal(40, 10, n),
+                'USER_DL_AVG_THROUGHPUT': rng.normal(150, 40, n), 'CQI_5G': rng.uniform(9, 14, n), 'CELL_AVAIBILITY_RATE': rng.uniform(99, 100, n),
+                'SGNB_ADDITION_SUCCESS_RATE': rng.uniform(97, 100, n), 'SGNB_ABNORMAL_RELEASE_RATE': rng.uniform(0, 1, n),
+                'gNodeB ID': (cells['site_idx'] + 500000).to_numpy()}
+    df = pd.DataFrame({**base, **vals})
+    df['TRAFFIC'] = np.where(zero_mask, 0.0, df['TRAFFIC'])
+    return df
+
+
+def write_kpi(rng, cells, tech, start, days, days_per_file, out_dir):
+    # Một nhóm nhỏ cell xấu cố định (cho worst cell / conges / NPO) và cell mất traffic ở ngày cuối (traffic down)
+    n = len(cells)
+    bad_mask = rng.random(n) < 0.05
+    files = []
+    for chunk_start in range(0, days, days_per_file):
+        chunk_days = [start + timedelta(days=d) for d in range(chunk_start, min(days, chunk_start + days_per_file))]
+        path = os.path.join(out_dir, f'kpi{tech}_{chunk_days[0]:%Y%m%d}_{chunk_days[-1]:%Y%m%d}.csv')
+        for i, day in enumerate(chunk_days):
+            zero_mask = (rng.random(n) < 0.01) if day == start + timedelta(days=days - 1) else np.zeros(n, dtype=bool)
+            df = kpi_day(rng, cells, tech, day, bad_mask, zero_mask)
+            df.insert(0, 'STT', np.arange(1, n + 1))
+            df.round(3).to_csv(path, index=False, mode='w' if i == 0 else 'a', header=(i == 0), encoding='utf-8-sig' if i == 0 else 'utf-8')
+        files.append(os.path.basename(path))
+    return files
+
+
+def write_poi(rng, cells, tech, n_pois, path):
+    picked = cells.sample(frac=0.1, random_state=int(rng.integers(1 << 31))) if len(cells) >= 10 else cells
+    pd.DataFrame({'POI': [f'POI {tech.upper()} {i % n_pois + 1:03d}' for i in range(len(picked))], 'Mã Cell': picked['cell_code'].to_numpy(),
+                  'Mã Node': picked['site_code'].to_numpy()}).to_csv(path, index=False, encoding='utf-8-sig')
+
+
+def write_qoe_qos(rng, cells, kind, path):
+    n = len(cells)
+    a, b = rng.uniform(1, 5, n).round(2), rng.uniform(40, 100, n).round(1)
+    if kind == 'qoe':
+        extra = {'Video Start Delay (ms)': rng.integers(300, 3000, n), 'Video Stall Ratio (%)': rng.uniform(0, 5, n).round(2), 'Web Page Load (ms)': rng.integers(500, 6000, n)}
+    else:
+        extra = {'DL Thput (Mbps)': rng.uniform(2, 60, n).round(1), 'UL Thput (Mbps)': rng.uniform(0.5, 15, n).round(1), 'Latency (ms)': rng.integers(15, 120, n)}
+    pd.DataFrame({'STT': np.arange(1, n + 1), 'Cell name': cells['cell_code'].to_numpy(), 'Site': cells['site_code'].to_numpy(),
+                  f'{kind.upper()} Score': a, f'{kind.upper()} %': b, **extra}).to_csv(path, index=False, encoding='utf-8-sig')
+
+
+def write_its(rng, cells, n_samples, start, path):
+    # Log đo kiểm dạng "|" như file ITS xuất từ máy đo: node/cellid khớp ENodeB ID/LCRID của RF 4G
+    idx = rng.integers(0, len(cells), n_samples)
+    picked = cells.iloc[idx]
+    ts = [(start + timedelta(seconds=int(s))).strftime('%Y-%m-%d %H:%M:%S') for s in np.sort(rng.integers(0, 8 * 3600, n_samples))]
+    pd.DataFrame({'timestamp': ts, 'latitude': (picked['lat'].to_numpy() + rng.normal(0, 0.004, n_samples)).round(6),
+                  'longitude': (picked['lon'].to_numpy() + rng.normal(0, 0.004, n_samples)).round(6), 'networktech': 'LTE',
+                  'level': rng.normal(-95, 12, n_samples).round(1), 'qual': rng.normal(-10, 3, n_samples).round(1),
+                  'node': (picked['site_idx'].to_numpy() + 100000), 'cellid': picked['sector'].to_numpy()}).to_csv(path, index=False, sep='|')
+
+
+def week_label(day):
+    _, week_num, _ = day.isocalendar()
+    start = day - timedelta(days=day.weekday())
+    return f"Tuần {week_num:02d} ({start:%d/%m}-{start + timedelta(days=6):%d/%m})"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cells', type=int, default=3000, help='Số cell 4G (mặc định 3000)')
+    parser.add_argument('--cells-3g', type=int, default=None, help='Số cell 3G (mặc định 60%% số cell 4G)')
+    parser.add_argument('--cells-5g', type=int, default=None, help='Số cell 5G (mặc định 20%% số cell 4G)')
+    parser.add_argument('--days', type=int, default=30, help='Số ngày KPI')
+    parser.add_argument('--days-per-file', type=int, default=7, help='Số ngày KPI trong mỗi file')
+    parser.add_argument('--weeks', type=int, default=4, help='Số tuần QoE/QoS')
+    parser.add_argument('--its-samples', type=int, default=50000, help='Số điểm đo ITS')
+    parser.add_argument('--end-date', default=None, help='Ngày KPI cuối cùng (dd/mm/YYYY, mặc định hôm qua)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--out', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    os.makedirs(args.out, exist_ok=True)
+    end = datetime.strptime(args.end_date, '%d/%m/%Y') if args.end_date else datetime.combine(datetime.now().date() - timedelta(days=1), datetime.min.time())
+    start = end - timedelta(days=args.days - 1)
+    n3, n5 = args.cells_3g if args.cells_3g is not None else int(args.cells * 0.6), args.cells_5g if args.cells_5g is not None else int(args.cells * 0.2)
+
+    sites = make_sites(rng, max(args.cells, n3, n5))
+    cells = {'3g': make_cells(sites, n3, 'U'), '4g': make_cells(sites, args.cells, ''), '5g': make_cells(sites, n5, 'N')}
+    manifest = {'generated_at': datetime.now().isoformat(timespec='seconds'), 'args': vars(args), 'imports': [], 'its': [], 'samples': {}}
+
+    for tech, tc in cells.items():
+        if tc.empty: continue
+        write_rf(rng, tc, tech, os.path.join(args.out, f'rf{tech}.csv'))
+        manifest['imports'].append({'type': tech, 'files': [f'rf{tech}.csv']})
+        manifest['samples'][tech] = {'cell': tc['cell_code'].iloc[0], 'site': tc['site_code'].iloc[0]}
+    for tech in ('4g', '5g'):
+        if cells[tech].empty: continue
+        write_poi(rng, cells[tech], tech, max(1, len(cells[tech]) // 200), os.path.join(args.out, f'poi{tech}.csv'))
+        manifest['imports'].append({'type': f'poi{tech}', 'files': [f'poi{tech}.csv']})
+        manifest['samples'][f'poi{tech}'] = f'POI {tech.upper()} 001'
+    for tech, tc in cells.items():
+        if tc.empty: continue
+        print(f'KPI {tech.upper()}: {len(tc)} cell x {args.days} ngày ...')
+        manifest['imports'].append({'type': f'kpi{tech}', 'files': write_kpi(rng, tc, tech, start, args.days, args.days_per_file, args.out)})
+    for w in range(args.weeks):
+        week_day = end - timedelta(weeks=args.weeks - 1 - w)
+        for kind in ('qoe', 'qos'):
+            fname = f'{kind}_w{w + 1:02d}.csv'
+            write_qoe_qos(rng, cells['4g'], kind, os.path.join(args.out, fname))
+            manifest['imports'].append({'type': f'{kind}4g', 'week_name': week_label(week_day), 'files': [fname]})
+    if args.its_samples and not cells['4g'].empty:
+        write_its(rng, cells['4g'], args.its_samples, end, os.path.join(args.out, 'its_4g.txt'))
+        manifest['its'].append({'tech': '4g', 'file': 'its_4g.txt'})
+
+    with open(os.path.join(args.out, 'manifest.json'), 'w', encoding='utf-8') as f: json.dump(manifest, f, ensure_ascii=False, indent=2)
+    print(f'Đã sinh dữ liệu vào {args.out}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""Đo hiệu năng import, các trang báo cáo và lệnh bot trên một DB SQLite cục bộ (Flask test client).
+
+Ví dụ:
+    python bench/generate_data.py --cells 3000 --days 30
+    python bench/run_benchmarks.py --data bench/data --out bench/results/$(git rev-parse --short HEAD).json
+
+Kết quả JSON gồm thời gian từng bước (min/median/max ms), số câu SQL, kích thước response và tốc độ
+import (dòng/giây) để so sánh giữa các phiên bản.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import statistics
+from io import BytesIO
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def git_revision():
+    try: return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError): return None
+
+
+class SQLCounter:
+    def __init__(self, engine, event):
+        self.count = 0
+        event.listen(engine, 'after_cursor_execute', self)
+
+    def __call__(self, *args, **kwargs): self.count += 1
+
+
+def timed(fn, repeat, sql):
+    samples, status, size, statements = [], None, 0, 0
+    for _ in range(repeat):
+        before = sql.count
+        t0 = time.perf_counter()
+        status, size = fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+        statements = sql.count - before
+    return {'min_ms': round(min(samples), 2), 'median_ms': round(statistics.median(samples), 2), 'max_ms': round(max(samples), 2),
+            'repeat': repeat, 'status': status, 'bytes': size, 'sql_statements': statements}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--data', default=os.path.join(ROOT, 'bench', 'data'), help='Thư mục do generate_data.py sinh ra')
+    parser.add_argument('--db', default=os.path.join(ROOT, 'bench', 'bench.db'), help='File SQLite dùng để đo (bị xóa trước khi chạy)')
+    parser.add_argument('--keep-db', action='store_true', help='Giữ DB hiện có và bỏ qua bước import')
+    parser.add_argument('--repeat', type=int, default=3, help='Số lần lặp mỗi trang/lệnh')
+    parser.add_argument('--out', default=None, help='File JSON kết quả (mặc định bench/results/<git-rev>-<thời gian>.json)')
+    args = parser.parse_args()
+
+    with open(os.path.join(args.data, 'manifest.json'), encoding='utf-8') as f: manifest = json.load(f)
+    if not args.keep_db:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.db + suffix): os.remove(args.db + suffix)
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.abspath(args.db)
+    sys.path.insert(0, ROOT)
+
+    t0 = time.perf_counter()
+    import app as kpi_app
+    from sqlalchemy import event
+    startup_ms = (time.perf_counter() - t0) * 1000
+    kpi_app.init_database()
+    flask_app = kpi_app.app
+    client = flask_app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+    with flask_app.app_context(): sql = SQLCounter(kpi_app.db.engine, event)
+
+    results = {'revision': git_revision(), 'started_at': datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+               'platform': platform.platform(), 'dataset': manifest.get('args', {}), 'startup_import_ms': round(startup_ms, 1),
+               'imports': [], 'pages': {}, 'bot': {}}
+
+    if not args.keep_db:
+        for item in manifest['imports']:
+            for fname in item['files']:
+                path = os.path.join(args.data, fname)
+                with open(path, 'rb') as f: payload = f.read()
+                form = {'type': item['type'], 'file': (BytesIO(payload), fname)}
+                if 'week_name' in item: form['week_name'] = item['week_name']
+                before = sql.count
+                t0 = time.perf_counter()
+                resp = client.post('/import', data=form, content_type='multipart/form-data')
+                seconds = time.perf_counter() - t0
+                rows = max(payload.count(b'\n') - 1, 0)
+                results['imports'].append({'type': item['type'], 'file': fname, 'status': resp.status_code, 'bytes': len(payload), 'rows': rows,
+                                           'seconds': round(seconds, 3), 'rows_per_second': round(rows / seconds, 1) if seconds else None,
+                                           'sql_statements': sql.count - before})
+                print(f"import {item['type']:<7} {fname:<32} {rows:>9} dòng  {seconds:8.2f}s")
+
+    samples = manifest.get('samples', {})
+    cell4, site4 = samples.get('4g', {}).get('cell', ''), samples.get('4g', {}).get('site', '')
+    its = next((x for x in manifest.get('its', []) if x['tech'] == '4g'), None)
+    its_bytes = open(os.path.join(args.data, its['file']), 'rb').read() if its else None
+
+    def get(url):
+        def run():
+            r = client.get(url, headers={'Accept-Encoding': 'gzip'})
+            return r.status_code, len(r.get_data())
+        return run
+
+    def post_its():
+        r = client.post('/gis', data={'action': 'show_log', 'tech': '4g', 'its_file': (BytesIO(its_bytes), its['file'])}, content_type='multipart/form-data')
+        return r.status_code, len(r.get_data())
+
+    pages = {
+        'index': get('/'),
+        'kpi_cell': get(f'/kpi?tech=4g&cell_name={cell4}'),
+        'kpi_poi': get(f"/kpi?tech=4g&poi_name={samples.get('poi4g', '')}"),
+        'poi': get(f"/poi?poi_name={samples.get('poi4g', '')}"),
+        'chart_kpi_cell': get(f'/api/charts/kpi?tech=4g&cell_name={cell4}&metric=traffic'),
+        'chart_kpi_site': get(f'/api/charts/kpi?tech=4g&cell_name={site4}&metric=user_dl_avg_thput'),
+        'chart_poi': get(f"/api/charts/poi?tech=4g&poi_name={samples.get('poi4g', '')}"),
+        'worst_cell': get('/worst-cell?tech=4g&duration=3'),
+        'traffic_down': get('/traffic-down?tech=4g&action=execute'),
+        'conges_3g': get('/conges-3g?action=execute'),
+        'optimize': get('/optimize'),
+        'gis_search': get(f'/gis?tech=4g&site_code={site4}'),
+    }
+    if its_bytes: pages['gis_show_log'] = post_its
+    for name, fn in pages.items():
+        results['pages'][name] = timed(fn, args.repeat, sql)
+        print(f"page {name:<14} median {results['pages'][name]['median_ms']:9.1f} ms  sql {results['pages'][name]['sql_statements']}")
+
+    commands = {'HELP': 'HELP', 'DASHBOARD': 'DASHBOARD', 'KPI': f'KPI {cell4}', 'CHARTKPI': f'CHARTKPI {cell4}', 'RF': f'RF {cell4}',
+                'PCI': f'PCI {cell4}', 'CTS': f'CTS {cell4}', 'CHARTCTS': f'CHARTCTS {cell4}'}
+    for name, text in commands.items():
+        def run(text=text):
+            reply = kpi_app.process_bot_command(text)
+            return 'ok', len(json.dumps(reply, ensure_ascii=False))
+        results['bot'][name] = timed(run, args.repeat, sql)
+        print(f"bot  {name:<14} median {results['bot'][name]['median_ms']:9.1f} ms  sql {results['bot'][name]['sql_statements']}")
+
+    out = args.out or os.path.join(ROOT, 'bench', 'results', f"{results['revision'] or 'local'}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as f: json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f'Kết quả: {out}')
+
+
+if __name__ == '__main__':
+    main()
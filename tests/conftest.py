@@ -0,0 +1,30 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# DATABASE_URL phải có trước khi import app (engine được tạo lúc import)
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as kpi_app
+
+
+@pytest.fixture
+def app():
+    # Mỗi test chạy trên DB trống (chỉ có bảng, data_version và tài khoản admin)
+    with kpi_app.app.app_context():
+        kpi_app.db.drop_all()
+    kpi_app.init_database()
+    kpi_app.cell_index.invalidate()
+    with kpi_app.app.app_context():
+        yield kpi_app.app
+        kpi_app.db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+    return client
@@ -0,0 +1,95 @@
+import io
+from datetime import date
+
+import openpyxl
+import pytest
+
+import app as kpi_app
+from app import KPI4G, ImportManifest, KPIRollup, scan_kpi_days
+
+HEADER = ['STT', 'Thời gian', 'Nhà cung cấp', 'Tỉnh', 'Tên cell', 'Tên RNC', 'TRAFFIC', 'CQI_4G']
+
+
+def kpi_rows(days, cells=20, vendor='Ericsson'):
+    return [[n, day, vendor, 'Thanh Hoa', f'THA{vendor[0]}{i:04d}_1', 'ENB_THA', 1.5 + i, 90.0]
+            for n, (day, i) in enumerate(((d, i) for d in days for i in range(cells)), 1)]
+
+
+def kpi_file(rows, fmt='csv'):
+    if fmt == 'csv':
+        return '\n'.join(','.join(str(v) for v in line) for line in [HEADER] + rows).encode('utf-8-sig')
+    # XLSX xuất từ OSS có dòng tiêu đề báo cáo phía trên header
+    wb = openpyxl.Workbook()
+    for line in [['Báo cáo KPI 4G'], []] + [HEADER] + rows: wb.active.append(line)
+    out = io.BytesIO()
+    wb.save(out)
+    return out.getvalue()
+
+
+def upload(client, files, **form):
+    form.update({'type': 'kpi4g', 'file': [(io.BytesIO(data), name) for name, data in files]})
+    client.post('/import', data=form, content_type='multipart/form-data')
+    with client.session_transaction() as s: return s.pop('_flashes', [])
+
+
+@pytest.fixture
+def inline_import(monkeypatch):
+    # Parse ngay trong request (không qua process pool) để monkeypatch có hiệu lực
+    monkeypatch.setattr(kpi_app, 'IMPORT_WORKERS', 1)
+    monkeypatch.setattr(kpi_app, 'IMPORT_CHUNK_ROWS', 50)
+
+
+def test_failed_chunk_rolls_back_whole_file(client, inline_import, monkeypatch):
+    data = kpi_file(kpi_rows(['01/10/2026', '02/10/2026'], cells=100), 'xlsx')
+    insert_rows, written = kpi_app.insert_rows, []
+    def flaky(Model, columns, rows):
+        if len(written) == 2: raise RuntimeError('disk full')
+        insert_rows(Model, columns, rows)
+        written.append(len(rows))
+    monkeypatch.setattr(kpi_app, 'insert_rows', flaky)
+    (category, message), = upload(client, [('k.xlsx', data)])
+    assert category == 'danger' and 'disk full' in message and f'đã hủy {sum(written)} dòng' in message
+    assert (KPI4G.query.count(), KPIRollup.query.count(), ImportManifest.query.count()) == (0, 0, 0)
+
+    # File lỗi không được ghi manifest nên import lại được trọn vẹn
+    monkeypatch.setattr(kpi_app, 'insert_rows', insert_rows)
+    assert upload(client, [('k.xlsx', data)])[0][0] == 'success'
+    assert KPI4G.query.count() == 200
+    assert sum(r.cell_count for r in KPIRollup.query) == 200
+    m, = ImportManifest.query.all()
+    assert (m.rows, m.day_from, m.day_to) == (200, date(2026, 10, 1), date(2026, 10, 2))
+
+
+def test_unmatched_file_writes_nothing(client, inline_import):
+    (category, message), = upload(client, [('x.csv', b'a,b\n1,2\n3,4\n')])
+    assert category == 'warning'
+    assert (KPI4G.query.count(), ImportManifest.query.count()) == (0, 0)
+
+
+@pytest.mark.parametrize('fmt', ['csv', 'xlsx'])
+def test_scan_kpi_days(fmt):
+    rows = kpi_rows(['01/10/2026', '02/10/2026'], cells=40) + [[0, 'Tổng', '', '', '', '', 0, 0]]
+    assert scan_kpi_days(f'k.{fmt}', kpi_file(rows, fmt)) == {date(2026, 10, 1), date(2026, 10, 2)}
+
+
+def test_overlapping_file_refused_until_reimport(client, inline_import):
+    assert upload(client, [('a.csv', kpi_file(kpi_rows(['01/10/2026', '02/10/2026'])))])[0][0] == 'success'
+    overlap = kpi_file(kpi_rows(['02/10/2026', '03/10/2026']), 'xlsx')
+    (category, message), = upload(client, [('b.xlsx', overlap)])
+    assert category == 'warning' and '02/10/2026' in message and '03/10/2026' not in message and 'Import lại' in message
+    # Cả file bị từ chối trước khi ghi: ngày mới 03/10 cũng chưa được import
+    assert KPI4G.query.count() == 40 and ImportManifest.query.count() == 1
+
+    assert upload(client, [('b.xlsx', overlap)], reimport='1')[0][0] == 'success'
+    assert KPI4G.query.count() == 80
+    m = ImportManifest.query.filter_by(filename='b.xlsx').one()
+    assert (m.rows, m.day_from, m.day_to) == (40, date(2026, 10, 2), date(2026, 10, 3))
+
+
+def test_day_split_across_files_in_one_upload(client, inline_import):
+    upload(client, [('a.csv', kpi_file(kpi_rows(['01/10/2026'])))])
+    # Cùng một ngày tách theo vendor thành hai file trong một lần upload: không file nào bị coi là trùng
+    flashes = upload(client, [('eri.csv', kpi_file(kpi_rows(['02/10/2026']))), ('nsn.csv', kpi_file(kpi_rows(['02/10/2026'], vendor='Nokia')))])
+    assert [c for c, _ in flashes] == ['success', 'success']
+    assert KPI4G.query.filter_by(thoi_gian='02/10/2026').count() == 40
+    assert sum(r.cell_count for r in KPIRollup.query.filter_by(day=date(2026, 10, 2))) == 40
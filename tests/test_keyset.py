@@ -0,0 +1,62 @@
+import pytest
+
+from app import RF4G, db, decode_cursor, encode_cursor, keyset_page
+
+
+@pytest.mark.parametrize('val', ['LHA001', 'Cell "Hà Nội"/1', 12.5, 0, None])
+def test_cursor_round_trip(val):
+    assert decode_cursor(encode_cursor(val, 42)) == (val, 42)
+
+
+@pytest.mark.parametrize('token', ['', 'not-base64!', encode_cursor('x', 1)[:-4], 'WzEsMiwzXQ=='])
+def test_decode_cursor_rejects_garbage(token):
+    assert decode_cursor(token) is None
+
+
+@pytest.fixture
+def rf_rows(app):
+    # Nhiều dòng trùng azimuth và có NULL để kiểm tra thứ tự theo (cột, id)
+    azimuths = [120, 0, 120, None, 240, 0, None, 120, 360, 240, 0, None, 120]
+    db.session.add_all(RF4G(cell_code=f'C{i:02d}', site_code=f'S{i // 3}', azimuth=az) for i, az in enumerate(azimuths))
+    db.session.commit()
+    return RF4G.query.all()
+
+
+def expected_order(rows, sort_key, desc):
+    values = [r for r in rows if getattr(r, sort_key) is not None]
+    nulls = [r for r in rows if getattr(r, sort_key) is None]
+    values.sort(key=lambda r: (getattr(r, sort_key), r.id), reverse=desc)
+    nulls.sort(key=lambda r: r.id, reverse=desc)
+    return [r.id for r in values + nulls]
+
+
+def walk(sort_key, order, limit, query=None):
+    ids, cursor, pages = [], None, 0
+    while True:
+        rows, cursor = keyset_page(query or RF4G.query, RF4G, sort_key, order, cursor, limit)
+        ids += [r.id for r in rows]
+        pages += 1
+        if not cursor: return ids, pages
+        assert pages < 50
+
+
+@pytest.mark.parametrize('sort_key', ['id', 'azimuth', 'cell_code'])
+@pytest.mark.parametrize('order', ['asc', 'desc'])
+@pytest.mark.parametrize('limit', [1, 2, 3, 5, 13, 100])
+def test_keyset_pages_cover_rows_once(rf_rows, sort_key, order, limit):
+    ids, pages = walk(sort_key, order, limit)
+    assert ids == expected_order(rf_rows, sort_key, order == 'desc')
+    assert len(set(ids)) == len(rf_rows)
+    assert pages == max(1, -(-len(rf_rows) // limit))
+
+
+def test_keyset_cursor_inside_null_tail(rf_rows):
+    # Trang bắt đầu giữa nhóm NULL chỉ trả các dòng NULL còn lại
+    nulls = sorted(r.id for r in rf_rows if r.azimuth is None)
+    rows, cursor = keyset_page(RF4G.query, RF4G, 'azimuth', 'asc', encode_cursor(None, nulls[0]), 10)
+    assert [r.id for r in rows] == nulls[1:] and cursor is None
+
+
+def test_keyset_respects_query_filter(rf_rows):
+    ids, pages = walk('azimuth', 'asc', 2, RF4G.query.filter(RF4G.azimuth == 120))
+    assert ids == sorted(r.id for r in rf_rows if r.azimuth == 120) and pages == 2
@@ -0,0 +1,70 @@
+import random
+from collections import defaultdict
+from datetime import date, timedelta
+
+import pytest
+
+from app import KPI4G, KPI_ARCHIVES, archive_kpi, db, kpi_period_start, kpi_series, normalize_cell_key, parse_kpi_day
+
+CELLS = ['LHA001_1', 'LHA001_2', 'lha002_1 ']
+DAYS = [date.today() - timedelta(days=d) for d in range(200, 129, -1)]
+
+
+@pytest.fixture
+def kpi_rows(app):
+    # Giá trị NULL rải rác để số ngày có giá trị (_n) khác số ngày đã gộp (days)
+    rng = random.Random(7)
+    rows = []
+    for day in DAYS:
+        for cell in CELLS:
+            if rng.random() < 0.1: continue
+            rows.append(KPI4G(ten_cell=cell, thoi_gian=day.strftime('%d/%m/%Y'), traffic=None if rng.random() < 0.2 else rng.uniform(0, 50),
+                              cqi_4g=None if rng.random() < 0.3 else rng.uniform(5, 15)))
+    db.session.add_all(rows)
+    db.session.commit()
+    return rows
+
+
+def raw_periods(rows, metric, granularity, summed):
+    acc = defaultdict(list)
+    for r in rows:
+        value = getattr(r, metric)
+        if value is not None: acc[(r.ten_cell, kpi_period_start(parse_kpi_day(r.thoi_gian), granularity))].append(value)
+    return {k: sum(v) if summed else sum(v) / len(v) for k, v in acc.items()}
+
+
+def archive_in_two_passes():
+    # Lần đầu cắt giữa các tuần/tháng, lần sau gộp tiếp vào dòng archive sẵn có
+    first = archive_kpi('4g', retention_days=165, days_per_batch=3)
+    second = archive_kpi('4g', retention_days=120, days_per_batch=5)
+    return first + second
+
+
+@pytest.mark.parametrize('granularity', ['weekly', 'monthly'])
+@pytest.mark.parametrize('metric, summed', [('cqi_4g', False), ('traffic', True)])
+def test_archive_matches_raw_aggregates(kpi_rows, granularity, metric, summed):
+    expected = raw_periods(kpi_rows, metric, granularity, summed)
+    snapshot = [(r.ten_cell, r.thoi_gian) for r in kpi_rows]
+    assert archive_in_two_passes() == len(snapshot)
+    assert KPI4G.query.count() == 0
+    Archive = KPI_ARCHIVES['4g'][granularity]
+    got = {(r.ten_cell, r.period_start): getattr(r, metric) for r in Archive.query if getattr(r, metric) is not None}
+    assert got.keys() == expected.keys()
+    for key, value in expected.items(): assert got[key] == pytest.approx(value)
+    # days: số dòng ngày đã gộp của mỗi cell trong chu kỳ, kể cả ngày không có giá trị
+    days = defaultdict(int)
+    for cell, day in snapshot: days[(cell, kpi_period_start(parse_kpi_day(day), granularity))] += 1
+    assert {(r.ten_cell, r.period_start): r.days for r in Archive.query} == dict(days)
+
+
+@pytest.mark.parametrize('range_days', [400, 0])
+@pytest.mark.parametrize('metric', ['cqi_4g', 'traffic'])
+def test_kpi_series_unchanged_by_archive(kpi_rows, range_days, metric):
+    keys = sorted({normalize_cell_key(c) for c in CELLS})
+    labels, before = kpi_series('4g', metric, keys, range_days)
+    archive_in_two_passes()
+    labels_after, after = kpi_series('4g', metric, keys, range_days)
+    assert labels_after == labels
+    assert after.keys() == before.keys()
+    for cell, series in before.items():
+        assert after[cell] == pytest.approx(series)
@@ -0,0 +1,64 @@
+import math
+import random
+
+import numpy as np
+import pytest
+
+from app import PCI_COLLISION_DISTANCE, PCI_NEIGHBOR_DISTANCE, classify_pci_pairs, grid_pair_batches
+
+
+def make_cells(specs):
+    # specs: (đông m, bắc m, pci, lớp tần số) quanh một điểm gốc ở Hà Nội
+    lat = np.array([21.0 + north / 111320.0 for east, north, pci, layer in specs])
+    lon = np.array([105.8 + east / (111320.0 * math.cos(math.radians(21.0))) for east, north, pci, layer in specs])
+    return {'lat': lat, 'lon': lon, 'pci': np.array([s[2] for s in specs], dtype=np.int64), 'layer': np.array([s[3] for s in specs], dtype=object),
+            'cell': np.array([f'C{i}' for i in range(len(specs))], dtype=object)}
+
+
+def classify(cells, i, j):
+    return sorted((kind, x, y) for kind, x, y, _ in classify_pci_pairs(cells, np.array(i), np.array(j)))
+
+
+@pytest.mark.parametrize('spec, expected', [
+    ((0, 0, 100, 'L1800'), ['collision']),            # trùng PCI, sát nhau: chỉ collision
+    ((0, 4000, 100, 'L1800'), ['collision']),         # trùng PCI trong PCI_COLLISION_DISTANCE
+    ((0, 6000, 100, 'L1800'), []),                    # trùng PCI nhưng quá xa
+    ((0, 1000, 130, 'L1800'), ['mod30']),             # 100 vs 130: cùng mod 30
+    ((0, 2000, 130, 'L1800'), []),                    # mod 30 ngoài PCI_NEIGHBOR_DISTANCE
+    ((0, 1000, 103, 'L1800'), ['mod3']),              # cùng mod 3, khác mod 30
+    ((0, 1000, 101, 'L1800'), []),
+    ((0, 1000, 100, 'L2100'), []),                    # khác lớp tần số
+])
+def test_classify_single_pair(spec, expected):
+    cells = make_cells([(0, 0, 100, 'L1800'), spec])
+    assert [k for k, _, _ in classify(cells, [0], [1])] == expected
+
+
+def test_classify_keeps_pair_order_and_distance():
+    cells = make_cells([(0, 0, 7, 'L1800'), (300, 400, 7, 'L1800')])
+    (kind, x, y, dist), = classify_pci_pairs(cells, np.array([1]), np.array([0]))
+    assert (kind, x, y) == ('collision', 1, 0)
+    assert dist == pytest.approx(500, abs=1)
+
+
+def brute_force(cells):
+    out = []
+    n = len(cells['pci'])
+    for x in range(n):
+        for y in range(x + 1, n):
+            if cells['layer'][x] != cells['layer'][y]: continue
+            d = math.hypot((cells['lon'][y] - cells['lon'][x]) * 111320.0 * math.cos(math.radians((cells['lat'][x] + cells['lat'][y]) / 2)), (cells['lat'][y] - cells['lat'][x]) * 111320.0)
+            px, py = cells['pci'][x], cells['pci'][y]
+            if px == py and d <= PCI_COLLISION_DISTANCE: out.append(('collision', x, y))
+            elif d <= PCI_NEIGHBOR_DISTANCE and px != py and px % 30 == py % 30: out.append(('mod30', x, y))
+            elif d <= PCI_NEIGHBOR_DISTANCE and px % 30 != py % 30 and px % 3 == py % 3: out.append(('mod3', x, y))
+    return sorted(out)
+
+
+def test_grid_batches_match_brute_force():
+    rng = random.Random(11)
+    cells = make_cells([(rng.uniform(-10000, 10000), rng.uniform(-10000, 10000), rng.randrange(0, 90), rng.choice(['L1800', 'L2100'])) for _ in range(400)])
+    found = []
+    for i, j in grid_pair_batches(cells['lat'], cells['lon'], max(PCI_COLLISION_DISTANCE, PCI_NEIGHBOR_DISTANCE), batch=500):
+        found += classify_pci_pairs(cells, i, j)
+    assert sorted((kind, min(x, y), max(x, y)) for kind, x, y, _ in found) == brute_force(cells)
@@ -0,0 +1,89 @@
+import math
+import random
+
+import numpy as np
+import pytest
+
+from app import RF4G, RFSectorIssue, RF_ANALYSIS_RADIUS, analyze_rf_sectors, db, refresh_rf_analysis
+
+
+def make_sectors(specs):
+    # specs: (cell, site, đông m, bắc m, azimuth, băng, tilt, độ cao)
+    lat = [21.0 + s[3] / 111320.0 for s in specs]
+    lon = [105.8 + s[2] / (111320.0 * math.cos(math.radians(21.0))) for s in specs]
+    return {'cell': np.array([s[0] for s in specs], dtype=object), 'site': np.array([s[1] for s in specs], dtype=object), 'lat': np.array(lat), 'lon': np.array(lon),
+            'azimuth': np.array([float(s[4]) for s in specs]), 'beamwidth': np.full(len(specs), 60.0), 'band': np.array([s[5] for s in specs], dtype=object),
+            'tilt': np.array([np.nan if s[6] is None else float(s[6]) for s in specs]), 'height': np.array([float(s[7]) for s in specs])}
+
+
+def found(specs, **kw):
+    sectors = make_sectors(specs)
+    issues, _ = analyze_rf_sectors(sectors, **kw)
+    return sorted((r['issue'], sectors['cell'][r['index']], sectors['cell'][r['other']]) for r in issues)
+
+
+def test_empty():
+    assert analyze_rf_sectors(make_sectors([])) == ([], 0)
+
+
+def test_facing_same_band():
+    # A nhìn lên bắc, B cách 1 km về phía bắc nhìn xuống nam; không rõ tilt nên tầm phủ = bán kính (và không xét overshoot)
+    specs = [('A', 'S1', 0, 0, 0, '1800', None, 30), ('B', 'S2', 0, 1000, 180, '1800', None, 30)]
+    assert found(specs) == [('facing', 'A', 'B')]
+    assert found([specs[0], specs[1][:5] + ('2100',) + specs[1][6:]]) == []
+
+
+def test_same_site_pairs_ignored():
+    sectors = make_sectors([('A', 'S1', 0, 0, 0, '1800', 0, 30), ('B', 'S1', 0, 1000, 180, '1800', 0, 30)])
+    assert analyze_rf_sectors(sectors) == ([], 0)
+
+
+def test_overlap_same_direction():
+    # B nằm trong búp sóng và tầm phủ của A, cùng hướng; A nằm sau lưng B
+    assert found([('A', 'S1', 0, 0, 0, '1800', None, 30), ('B', 'S2', 0, 500, 10, '1800', None, 30)]) == [('overlap', 'A', 'B')]
+
+
+@pytest.mark.parametrize('north, flagged', [(400, True), (700, False)])
+def test_overshoot(north, flagged):
+    # Tilt 2°, cao 30 m: tầm chạm đất ~859 m, so với 1.5 lần khoảng cách tới trạm gần nhất trong búp sóng
+    specs = [('A', 'S1', 0, 0, 0, '1800', 2, 30), ('B', 'S2', 0, north, 90, '2100', 0, 30)]
+    sectors = make_sectors(specs)
+    issues, pairs = analyze_rf_sectors(sectors)
+    assert pairs == 1
+    over = [r for r in issues if r['issue'] == 'overshoot']
+    assert bool(over) == flagged
+    if flagged:
+        assert over[0]['reach'] == pytest.approx(30 / math.tan(math.radians(2)), abs=0.1)
+        assert over[0]['distance'] == pytest.approx(north, abs=1)
+
+
+def test_unknown_tilt_or_height_not_overshoot():
+    for tilt, height in ((None, 30), (2, 0)):
+        assert found([('A', 'S1', 0, 0, 0, '1800', tilt, height), ('B', 'S2', 0, 300, 90, '2100', 0, 30)]) == []
+
+
+def test_pairs_beyond_radius_ignored():
+    specs = [('A', 'S1', 0, 0, 0, '1800', 0, 30), ('B', 'S2', 0, RF_ANALYSIS_RADIUS + 200, 180, '1800', 0, 30)]
+    assert analyze_rf_sectors(make_sectors(specs)) == ([], 0)
+
+
+def issue_set():
+    return sorted((r.issue, r.cell_code, r.other_cell, r.distance) for r in RFSectorIssue.query.filter_by(tech='4g'))
+
+
+def test_single_cell_edits_match_full_refresh(client):
+    rng = random.Random(5)
+    db.session.add_all(RF4G(cell_code=f'C{i:03d}', site_code=f'S{i // 3:03d}', latitude=21.0 + (i // 3 % 8) * 0.006 + rng.uniform(0, 0.002), longitude=105.8 + (i // 24) * 0.006 + rng.uniform(0, 0.002),
+                            azimuth=(i % 3) * 120 + rng.randrange(-20, 20) % 360, frequency=rng.choice(['L1800', 'L2100']), total_tilt=rng.choice([None, 1, 3, 6]), anten_height=rng.choice([0, 25, 40]))
+                       for i in range(96))
+    db.session.commit()
+    refresh_rf_analysis('4g')
+    target = RF4G.query.filter_by(cell_code='C040').one()
+    client.post(f'/rf/edit/4g/{target.id}', data={'latitude': '21.021', 'longitude': '105.812', 'azimuth': '200', 'total_tilt': '1'})
+    client.post('/rf/add?tech=4g', data={'cell_code': 'NEW1', 'site_code': 'SNEW', 'latitude': '21.01', 'longitude': '105.81', 'azimuth': '90', 'frequency': 'L1800', 'total_tilt': '2', 'anten_height': '35'})
+    client.get(f'/rf/delete/4g/{RF4G.query.filter_by(cell_code="C010").one().id}')
+    db.session.expire_all()
+    incremental = issue_set()
+    assert incremental
+    refresh_rf_analysis('4g')
+    assert issue_set() == incremental
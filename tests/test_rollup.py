@@ -0,0 +1,98 @@
+import math
+import random
+
+import numpy as np
+import pytest
+
+from app import KPI4G, KPIRollup, ROLLUP_MEASURES, RollupAccumulator, db, rebuild_kpi_rollup
+
+FIELDS = ['cell_count'] + [f'{m}_{x}' for m in ROLLUP_MEASURES for x in ('sum', 'n')]
+
+
+def sample_rows(n=400, seed=3):
+    # Ngày hợp lệ/không hợp lệ, tỉnh có khoảng trắng hoặc rỗng, chỉ số None/NaN
+    rng = random.Random(seed)
+    days = ['01/10/2026', '02/10/2026', ' 03/10/2026', 'x', None]
+    rows = []
+    for _ in range(n):
+        row = {'thoi_gian': rng.choice(days), 'tinh': rng.choice(['HNI', ' HNI ', '', None, 'HCM']), 'nha_cung_cap': rng.choice(['NSN', 'ERI']), 'ten_rnc': rng.choice(['R1', 'R2', None])}
+        for col in ('traffic', 'user_dl_avg_thput', 'res_blk_dl', 'cqi_4g', 'erab_ssrate_all', 'service_drop_all'):
+            row[col] = rng.choice([None, float('nan'), round(rng.uniform(0, 100), 3)])
+        rows.append(row)
+    return rows
+
+
+def as_columns(rows):
+    return {k: np.array([r[k] for r in rows], dtype=object) for k in rows[0]}
+
+
+def plain(groups):
+    return {key: {f: grp.get(f, 0) for f in FIELDS} for key, grp in groups.items()}
+
+
+def assert_groups_equal(got, expected):
+    assert got.keys() == expected.keys()
+    for key in expected:
+        assert got[key] == pytest.approx(expected[key]), key
+
+
+def stored():
+    return {(r.day, r.tinh, r.nha_cung_cap, r.controller): {f: getattr(r, f) or 0 for f in FIELDS} for r in KPIRollup.query.filter_by(tech='4g')}
+
+
+def test_add_columns_matches_add():
+    rows = sample_rows()
+    by_row, by_chunk = RollupAccumulator('4g'), RollupAccumulator('4g')
+    for r in rows: by_row.add(r)
+    for i in range(0, len(rows), 150): by_chunk.add_columns(as_columns(rows[i:i + 150]))
+    assert_groups_equal(plain(by_chunk.groups), plain(by_row.groups))
+    # Dòng không parse được ngày không vào cube; khóa nhóm đã strip
+    assert all(key[0] is not None and key[1] == key[1].strip() for key in by_row.groups)
+    assert sum(g['cell_count'] for g in by_row.groups.values()) == sum(1 for r in rows if r['thoi_gian'] and r['thoi_gian'] != 'x')
+
+
+def test_add_columns_missing_columns():
+    acc = RollupAccumulator('4g')
+    acc.add_columns({'thoi_gian': np.array(['01/10/2026', '01/10/2026'], dtype=object), 'traffic': np.array([1.5, None], dtype=object)})
+    (key, grp), = acc.groups.items()
+    assert key[1:] == ('', '', '')
+    assert grp['cell_count'] == 2 and grp['traffic_sum'] == 1.5 and grp['traffic_n'] == 1
+    assert grp['cqi_n'] == 0
+
+
+def test_apply_accumulates_across_files(app):
+    rows = sample_rows()
+    whole = RollupAccumulator('4g')
+    for r in rows: whole.add(r)
+    expected = plain(whole.groups)
+    for half in (rows[:170], rows[170:]):
+        acc = RollupAccumulator('4g')
+        acc.add_columns(as_columns(half))
+        acc.apply()
+        assert acc.groups == {}
+    assert_groups_equal(stored(), expected)
+
+
+def test_apply_replace_overwrites_days(app):
+    rows = sample_rows()
+    for _ in range(2):
+        acc = RollupAccumulator('4g')
+        acc.add_columns(as_columns(rows))
+        acc.apply()
+    acc = RollupAccumulator('4g')
+    acc.add_columns(as_columns(rows))
+    expected = plain(acc.groups)
+    acc.apply(replace=True)
+    assert_groups_equal(stored(), expected)
+
+
+def test_rebuild_matches_import_rollup(app):
+    rows = [r for r in sample_rows() if r['thoi_gian'] and r['thoi_gian'] != 'x']
+    db.session.add_all(KPI4G(ten_cell=f'C{i}', **{k: (None if isinstance(v, float) and math.isnan(v) else v) for k, v in r.items()}) for i, r in enumerate(rows))
+    db.session.commit()
+    acc = RollupAccumulator('4g')
+    acc.add_columns(as_columns(rows))
+    acc.apply()
+    expected = stored()
+    assert rebuild_kpi_rollup('4g', batch_size=1) == len(rows)
+    assert_groups_equal(stored(), expected)